@@ -0,0 +1,130 @@
+"""Admission control of password hashing
+
+Every argon2 hash or verification costs tens of milliseconds of CPU, so a
+single client sending wrong passwords could otherwise occupy all hashing
+processes. Requests which are about to hash a password take a token from the
+bucket of the client address and, when verifying, from the bucket of the
+username. Verifications also wait for one of AUTH_MAX_VERIFICATIONS slots for
+at most AUTH_QUEUE_TIMEOUT seconds. Requests which are over the limits fail at
+once with Overloaded, and cheap requests are not slowed down by them.
+
+Credentials found in app.cache.CredentialCache never reach argon2 and are not
+limited.
+"""
+
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from .config import (
+    AUTH_CLIENT_BURST,
+    AUTH_CLIENT_RATE,
+    AUTH_LIMITER_SIZE,
+    AUTH_MAX_VERIFICATIONS,
+    AUTH_QUEUE_TIMEOUT,
+    AUTH_USER_BURST,
+    AUTH_USER_RATE,
+)
+from .metrics import auth_rejections
+
+
+class Overloaded(Exception):
+    """Request was rejected before hashing; retry after {retry_after} seconds"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> dict[str, str]:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+class TokenBuckets:
+    """Token buckets refilled with {rate} tokens per second up to {burst}
+
+    Buckets of up to {maxsize} recently used keys are kept. Forgetting the
+    least recently used one is the same as refilling it, which is what
+    happens to idle buckets anyway.
+    """
+
+    def __init__(self, rate: float, burst: float, maxsize: int):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        # Tokens and time they were counted at
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str) -> float:
+        """Takes a token, or returns seconds until one is available"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+_clients = TokenBuckets(AUTH_CLIENT_RATE, AUTH_CLIENT_BURST, AUTH_LIMITER_SIZE)
+_users = TokenBuckets(AUTH_USER_RATE, AUTH_USER_BURST, AUTH_LIMITER_SIZE)
+_slots: Optional[tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+
+
+def _take(buckets: TokenBuckets, key: str, reason: str) -> None:
+    wait = buckets.take(key)
+    if wait > 0:
+        auth_rejections.inc(reason)
+        raise Overloaded(429, "Too many password attempts", wait)
+
+
+def admit(client: Optional[str], username: Optional[str] = None) -> None:
+    """Takes tokens of client address and username, raises Overloaded if any is out"""
+    if client is not None:
+        _take(_clients, client, "client")
+    if username is not None:
+        _take(_users, username, "username")
+
+
+def _semaphore() -> asyncio.Semaphore:
+    # See app.hashing._semaphore
+    global _slots
+    loop = asyncio.get_running_loop()
+    if _slots is None or _slots[0] is not loop:
+        _slots = (loop, asyncio.Semaphore(AUTH_MAX_VERIFICATIONS))
+    return _slots[1]
+
+
+@asynccontextmanager
+async def verification() -> AsyncIterator[None]:
+    """Holds a verification slot, raises Overloaded if none is free in time"""
+    semaphore = _semaphore()
+    try:
+        await asyncio.wait_for(semaphore.acquire(), AUTH_QUEUE_TIMEOUT)
+    except TimeoutError:
+        auth_rejections.inc("queue")
+        raise Overloaded(503, "Too many password verifications", AUTH_QUEUE_TIMEOUT)
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+def stats() -> dict[str, int]:
+    return {"auth_limited_clients": len(_clients), "auth_limited_users": len(_users)}
@@ -1,29 +1,73 @@
+import asyncio
+import hmac
 import math
-from typing import Annotated, NamedTuple, Optional
-from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response
+from urllib.parse import quote, urlencode
+from typing import Annotated, NamedTuple, Optional, Union
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query, Request, Response
 from fastapi import status
+from fastapi.responses import StreamingResponse
 
-from .dependencies import authenticated_username
+from .bulk import Importer
+from .config import IMPORT_TOKEN, STREAM_HEARTBEAT
+from .db import LikeKey, PostKey
+from .dependencies import authenticated_username, client_address
 from .models import (
     CreatePostModel,
     CreateUserModel,
     Detailed,
     PaginationParams,
+    ShapeParams,
+    NormalizedPostsModel,
     UserModel,
     LoginModel,
     PostModel,
+    TimelineParams,
+    BatchGetPostsModel,
+    BatchLikeModel,
+    LikeResultModel,
+    StreamParams,
+    SearchParams,
+    TrendingParams,
+    TrendingTagModel,
+    ImportResultModel,
+    LikersParams,
+    LikerModel,
 )
 from .logic import (
-    verify_password,
+    verify_password_async,
     is_username_available,
-    create_user,
+    create_user_async,
     find_user,
     list_user_posts,
+    list_top_posts,
+    decode_cursor,
+    decode_rank_cursor,
     create_post,
-    find_post,
+    find_encoded_post,
     add_like_to_post,
     remove_like_from_post,
+    follow_user,
+    unfollow_user,
+    list_timeline,
+    find_posts,
+    apply_likes,
+    user_etag,
+    user_posts_etag,
+    post_etag,
+    wait_durable,
+    stream_topics,
+    search_posts,
+    decode_search_cursor,
+    list_tag_posts,
+    list_mentions,
+    list_post_likers,
+    list_liked_posts,
+    decode_like_cursor,
+    trending_tags,
+    subscribe,
+    unsubscribe,
 )
+from .serialization import response_format
 
 api = APIRouter()
 
@@ -37,6 +81,52 @@ def _links(links: list[_Link]) -> str:
     return ",".join([f'<{link.url}>; rel="{link.rel}"' for link in links])
 
 
+def _page_query(query: ShapeParams, sort: str = "newest") -> str:
+    """Query string of page size, shape and order, kept in links to other pages"""
+    result = f"limit={query.limit}"
+    if query.shape != "nested":
+        result += f"&shape={query.shape}"
+    if sort != "newest":
+        result += f"&sort={sort}"
+    return result
+
+
+def _not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def _encoded(content: bytes, response: Response) -> Response:
+    """Returns pre-encoded posts with headers set on injected {response}"""
+    result = Response(content, media_type=response_format().media_type)
+    for name, value in response.headers.items():
+        if name != "content-length":
+            result.headers.append(name, value)
+    return result
+
+
+_NOT_MODIFIED = {
+    status.HTTP_304_NOT_MODIFIED: {
+        "description": "Not modified since the version given in If-None-Match"
+    }
+}
+_TOO_MANY_ATTEMPTS = {
+    status.HTTP_429_TOO_MANY_REQUESTS: {
+        "description": "Too many password attempts, retry after Retry-After seconds",
+        "model": Detailed,
+    },
+}
+_OVERLOADED = {
+    **_TOO_MANY_ATTEMPTS,
+    status.HTTP_503_SERVICE_UNAVAILABLE: {
+        "description": "Too many password hashes or verifications in progress",
+        "model": Detailed,
+    },
+}
+
+
 @api.post(
     "/register",
     tags=["users"],
@@ -46,11 +136,13 @@ def _links(links: list[_Link]) -> str:
             "description": "Username already taken",
             "model": Detailed,
         },
+        **_OVERLOADED,
     },
 )
 async def register(
     input: Annotated[CreateUserModel, Body()],
     response: Response,
+    client: Annotated[Optional[str], Depends(client_address)],
 ) -> UserModel:
     """Endpoint for registering new users
 
@@ -63,7 +155,12 @@ async def register(
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail="Username already taken"
         )
-    user = create_user(input)
+    user = await create_user_async(input, client)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail="Username already taken"
+        )
+    await wait_durable()
     response.headers["Link"] = _links(
         [
             _Link("/login", "login"),
@@ -81,11 +178,15 @@ async def register(
         status.HTTP_401_UNAUTHORIZED: {
             "description": "Invalid username or password",
             "model": Detailed,
-        }
+        },
+        **_OVERLOADED,
     },
     status_code=status.HTTP_204_NO_CONTENT,
 )
-async def login(input: Annotated[LoginModel, Body()]) -> None:
+async def login(
+    input: Annotated[LoginModel, Body()],
+    client: Annotated[Optional[str], Depends(client_address)],
+) -> None:
     """Endpoint for logging in
 
     Actually as we use Basic auth this endpoint just checks if provided
@@ -96,7 +197,7 @@ async def login(input: Annotated[LoginModel, Body()]) -> None:
     Please note that this endpoint does not create any kind of user session or
     whatever.
     """
-    if not verify_password(input.username, input.password):
+    if not await verify_password_async(input.username, input.password, client):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             headers={"WWW-Authenticate": "Basic"},
@@ -134,18 +235,84 @@ async def me(
     return user
 
 
+@api.get(
+    "/me/timeline",
+    tags=["posts"],
+    responses={
+        status.HTTP_400_BAD_REQUEST: {"description": "Invalid cursor", "model": Detailed},
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "Not logged in",
+            "model": Detailed,
+        },
+    },
+)
+async def timeline(
+    auth_username: Annotated[Optional[str], Depends(authenticated_username)],
+    query: Annotated[TimelineParams, Query()],
+    response: Response,
+) -> Union[list[PostModel], NormalizedPostsModel]:
+    """Returns home timeline of currently authenticated user
+
+    Timeline contains posts of the user and of users they follow, newest
+    first. The result is paginated with {limit} posts per page; cursor of the
+    next page is sent in the Link header.
+
+    This action requires authentication.
+    """
+    if auth_username is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            headers={"WWW-Authenticate": "Basic"},
+        )
+    before = None
+    if query.before is not None:
+        before = decode_cursor(query.before)
+        if before is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+            )
+    result = list_timeline(
+        auth_username,
+        before=before,
+        limit=query.limit,
+        normalized=query.shape == "normalized",
+    )
+    links = [_Link(f"/api/me/timeline?{_page_query(query)}", "first")]
+    if result.older is not None:
+        links.append(
+            _Link(f"/api/me/timeline?before={result.older}&{_page_query(query)}", "next")
+        )
+    response.headers["Link"] = _links(links)
+    return _encoded(result.posts, response)
+
+
 @api.get(
     "/users/{username}",
     tags=["users"],
     responses={
-        status.HTTP_404_NOT_FOUND: {"description": "User not found", "model": Detailed}
+        **_NOT_MODIFIED,
+        status.HTTP_404_NOT_FOUND: {"description": "User not found", "model": Detailed},
     },
 )
-async def get_user(username: str, response: Response) -> UserModel:
-    """Returns user information by username"""
+async def get_user(
+    username: str,
+    response: Response,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+) -> UserModel:
+    """Returns user information by username
+
+    Response carries an ETag header. If it matches the If-None-Match request
+    header, HTTP 304 Not Modified is returned without a body.
+    """
+    etag = user_etag(username)
+    if etag is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if _not_modified(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
     user = find_user(username)
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    response.headers["ETag"] = etag
     response.headers["Link"] = _links(
         [
             _Link(f"/api/users/{user.username}/posts", "posts"),
@@ -154,11 +321,100 @@ async def get_user(username: str, response: Response) -> UserModel:
     return user
 
 
+@api.put(
+    "/users/{username}/follow",
+    tags=["users"],
+    status_code=status.HTTP_201_CREATED,
+    responses={
+        status.HTTP_400_BAD_REQUEST: {
+            "description": "User can not follow themselves",
+            "model": Detailed,
+        },
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "User not logged in",
+            "model": Detailed,
+        },
+        status.HTTP_404_NOT_FOUND: {"description": "User not found", "model": Detailed},
+    },
+)
+async def follow(
+    auth_username: Annotated[Optional[str], Depends(authenticated_username)],
+    username: str,
+    response: Response,
+) -> None:
+    """Endpoint for following user
+
+    Posts of followed users are shown in the home timeline.
+
+    This action requires authentication.
+
+    This action is idempotent, meaning if the user already follows {username}
+    nothing changes and no error is thrown.
+    """
+    if auth_username is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            headers={"WWW-Authenticate": "Basic"},
+        )
+    if auth_username.lower() == username.lower():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="You can not follow yourself",
+        )
+    user = find_user(username)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    follow_user(auth_username, username)
+    await wait_durable()
+    response.headers["Link"] = _links(
+        [
+            _Link(f"/api/users/{user.username}", "self"),
+            _Link("/api/me/timeline", "timeline"),
+        ]
+    )
+
+
+@api.delete(
+    "/users/{username}/follow",
+    tags=["users"],
+    status_code=status.HTTP_204_NO_CONTENT,
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "User not logged in",
+            "model": Detailed,
+        },
+        status.HTTP_404_NOT_FOUND: {"description": "User not found", "model": Detailed},
+    },
+)
+async def unfollow(
+    auth_username: Annotated[Optional[str], Depends(authenticated_username)],
+    username: str,
+) -> None:
+    """Endpoint for unfollowing user
+
+    This action requires authentication.
+
+    This action is idempotent, if the user does not follow {username} this
+    endpoint will just silently return.
+    """
+    if auth_username is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            headers={"WWW-Authenticate": "Basic"},
+        )
+    if find_user(username) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    unfollow_user(auth_username, username)
+    await wait_durable()
+
+
 @api.get(
     "/users/{username}/posts",
     tags=["posts"],
     responses={
-        status.HTTP_404_NOT_FOUND: {"description": "User not found", "model": Detailed}
+        **_NOT_MODIFIED,
+        status.HTTP_400_BAD_REQUEST: {"description": "Invalid cursor", "model": Detailed},
+        status.HTTP_404_NOT_FOUND: {"description": "User not found", "model": Detailed},
     },
 )
 async def get_user_posts(
@@ -166,46 +422,113 @@ async def get_user_posts(
     username: str,
     query: Annotated[PaginationParams, Query()],
     response: Response,
-) -> list[PostModel]:
+    if_none_match: Annotated[Optional[str], Header()] = None,
+) -> Union[list[PostModel], NormalizedPostsModel]:
     """Returns list of posts by username
 
-    The result is paginated with the page size of 10 posts per page.
+    The result is paginated, newest posts first. Page size is set by {limit}
+    query parameter, 10 posts by default and 100 at most.
+
+    Pages are addressed by opaque cursors: {before} returns posts older than
+    the cursor, {after} returns posts newer than it. Cursors of neighbour
+    pages are sent in the Link header as "next" (older posts) and "prev"
+    (newer posts). Cursor pages are stable, so new posts do not shift them.
+
+    For compatibility, {page} query parameter selects page by its number. In
+    this case the Link header contains page numbers instead of cursors.
+
+    With {sort} set to "likes", posts are ordered by number of likes, most
+    liked first, and cursors refer to positions in this order.
 
     While this method does not require authentication, the response slightly
     differs for authenticated and non-authenticated users.
 
-    If user is unauthenticated, only last 10 posts are returned. Pagination is
-    not supported, and regardless which page is sent in query parameter only
-    last 10 posts will be shown.
+    If user is unauthenticated, only last (or top) 10 posts are returned. Pagination is
+    not supported, and regardless which page or cursor is sent in query
+    parameters only last 10 posts will be shown.
 
     Authenticated users also see whether they liked any of the posts or not.
+
+    Response carries an ETag header, which depends on the page, the posts
+    and likes of the current user. If it matches the If-None-Match request
+    header, HTTP 304 Not Modified is returned without a body.
     """
+    # Invalid cursors are rejected before the ETag is checked
+    before = after = None
+    cursor = query.before if query.before is not None else query.after
+    if cursor is not None:
+        if query.sort == "likes":
+            key = decode_rank_cursor(cursor)
+        else:
+            key = decode_cursor(cursor)
+        if key is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+            )
+        if query.before is not None:
+            before = key
+        else:
+            after = key
+    etag = user_posts_etag(
+        username,
+        auth_username,
+        query.page,
+        query.before,
+        query.after,
+        query.limit,
+        query.shape,
+        query.sort,
+    )
+    if etag is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if _not_modified(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
     user = find_user(username)
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
-    posts = list_user_posts(
-        username=username, current_username=auth_username, page=query.page
+    response.headers["ETag"] = etag
+    list_posts = list_top_posts if query.sort == "likes" else list_user_posts
+    result = list_posts(
+        username=username,
+        current_username=auth_username,
+        page=query.page,
+        limit=query.limit,
+        before=before,
+        after=after,
+        normalized=query.shape == "normalized",
     )
     if auth_username is not None:
+        url = f"/api/users/{user.username}/posts"
+        params = _page_query(query, query.sort)
         links = []
-        if user.posts:
-            links.append(_Link(f"/api/users/{user.username}/posts?page=1", "first"))
-            links.append(
-                _Link(
-                    f"/api/users/{user.username}/posts?page={max(1, math.ceil(user.posts / 10))}",
-                    "last",
+        if query.page is not None:
+            pages = math.ceil(user.posts / query.limit)
+            if user.posts:
+                links.append(_Link(f"{url}?page=1&{params}", "first"))
+                links.append(
+                    _Link(f"{url}?page={max(1, pages)}&{params}", "last")
+                )
+            if query.page > 1:
+                links.append(
+                    _Link(f"{url}?page={query.page - 1}&{params}", "prev")
+                )
+            if query.page < pages:
+                links.append(
+                    _Link(f"{url}?page={query.page + 1}&{params}", "next")
+                )
+        else:
+            if user.posts:
+                links.append(_Link(f"{url}?{params}", "first"))
+            if result.newer is not None:
+                links.append(
+                    _Link(f"{url}?after={result.newer}&{params}", "prev")
+                )
+            if result.older is not None:
+                links.append(
+                    _Link(f"{url}?before={result.older}&{params}", "next")
                 )
-            )
-        if query.page > 1:
-            links.append(
-                _Link(f"/api/users/{user.username}/posts?page={query.page - 1}", "prev")
-            )
-        if query.page < math.ceil(user.posts / 10):
-            links.append(
-                _Link(f"/api/users/{user.username}/posts?page={query.page + 1}", "next")
-            )
         response.headers["Link"] = _links(links)
-    return posts
+    return _encoded(result.posts, response)
 
 
 @api.post(
@@ -251,23 +574,25 @@ async def publish_post(
             detail="You are not allowed to create posts for other users",
         )
     post = create_post(username, input)
+    await wait_durable()
     response.headers["Link"] = _links(
         [
-            _Link(f"/api/users/{post.author.username}/posts", "posts"),
-            _Link(f"/api/users/{post.author.username}/posts/{post.id}", "self"),
+            _Link(f"/api/users/{post.author}/posts", "posts"),
+            _Link(f"/api/users/{post.author}/posts/{post.id}", "self"),
         ]
     )
-    return post
+    return _encoded(post.body, response)
 
 
 @api.get(
     "/users/{username}/posts/{post_id}",
     tags=["posts"],
     responses={
+        **_NOT_MODIFIED,
         status.HTTP_404_NOT_FOUND: {
             "description": "Post or user not found",
             "model": Detailed,
-        }
+        },
     },
 )
 async def read_post(
@@ -275,6 +600,7 @@ async def read_post(
     username: str,
     post_id: str,
     response: Response,
+    if_none_match: Annotated[Optional[str], Header()] = None,
 ) -> PostModel:
     """Endpoint for reading post
 
@@ -285,17 +611,26 @@ async def read_post(
 
     This action does not require authentication, but if the user is
     authenticated, they will see whether they liked the post or not.
+
+    Response carries an ETag header. If it matches the If-None-Match request
+    header, HTTP 304 Not Modified is returned without a body.
     """
-    post = find_post(username, post_id, current_username=auth_username)
+    etag = post_etag(username, post_id, current_username=auth_username)
+    if etag is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if _not_modified(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    post = find_encoded_post(username, post_id, current_username=auth_username)
     if post is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    response.headers["ETag"] = etag
     response.headers["Link"] = _links(
         [
-            _Link(f"/api/users/{post.author.username}/posts", "posts"),
-            _Link(f"/api/users/{post.author.username}/posts/{post.id}/like", "like"),
+            _Link(f"/api/users/{post.author}/posts", "posts"),
+            _Link(f"/api/users/{post.author}/posts/{post.id}/like", "like"),
         ]
     )
-    return post
+    return _encoded(post.body, response)
 
 
 @api.put(
@@ -333,14 +668,13 @@ async def like_post(
             headers={"WWW-Authenticate": "Basic"},
         )
 
-    post = find_post(username, post_id, current_username=auth_username)
-    if post is None:
+    if not add_like_to_post(username, post_id, auth_username):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
-    add_like_to_post(post, auth_username)
+    await wait_durable()
     response.headers["Link"] = _links(
         [
-            _Link(f"/api/users/{post.author.username}/posts", "posts"),
-            _Link(f"/api/users/{post.author.username}/posts/{post.id}", "self"),
+            _Link(f"/api/users/{username}/posts", "posts"),
+            _Link(f"/api/users/{username}/posts/{post_id}", "self"),
         ]
     )
 
@@ -381,13 +715,469 @@ async def unlike_post(
             headers={"WWW-Authenticate": "Basic"},
         )
 
-    post = find_post(username, post_id, current_username=auth_username)
-    if post is None:
+    if not remove_like_from_post(username, post_id, auth_username):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
-    remove_like_from_post(post, auth_username)
+    await wait_durable()
     response.headers["Link"] = _links(
         [
-            _Link(f"/api/users/{post.author.username}/posts", "posts"),
-            _Link(f"/api/users/{post.author.username}/posts/{post.id}", "self"),
+            _Link(f"/api/users/{username}/posts", "posts"),
+            _Link(f"/api/users/{username}/posts/{post_id}", "self"),
         ]
     )
+
+
+@api.get(
+    "/users/{username}/posts/{post_id}/likes",
+    tags=["posts"],
+    responses={
+        status.HTTP_400_BAD_REQUEST: {"description": "Invalid cursor", "model": Detailed},
+        status.HTTP_404_NOT_FOUND: {"description": "Post not found", "model": Detailed},
+    },
+)
+async def get_post_likers(
+    username: str,
+    post_id: str,
+    query: Annotated[LikersParams, Query()],
+    response: Response,
+) -> list[LikerModel]:
+    """Returns users who liked the post, most recent likes first
+
+    Every user is returned with the time of their like. The result is
+    paginated with {limit} users per page; cursor of the next page is sent in
+    the Link header. Likes appear in the list once they are applied, the same
+    as in the number of likes of the post.
+    """
+    before = _decode_like_before(query.before)
+    result = list_post_likers(username, post_id, before=before, limit=query.limit)
+    if result is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if result.older is not None:
+        url = f"/api/users/{username}/posts/{post_id}/likes"
+        response.headers["Link"] = _links(
+            [_Link(f"{url}?before={result.older}&limit={query.limit}", "next")]
+        )
+    return result.likers
+
+
+@api.post("/posts:batchGet", tags=["posts"])
+async def batch_get_posts(
+    auth_username: Annotated[Optional[str], Depends(authenticated_username)],
+    input: Annotated[BatchGetPostsModel, Body()],
+    query: Annotated[ShapeParams, Query()],
+) -> Union[list[Optional[PostModel]], NormalizedPostsModel]:
+    """Endpoint for reading many posts at once
+
+    Accepts up to 100 pairs of {username} and {post_id}, and returns posts in
+    the same order. For every pair which does not match an existing post
+    null is returned, the same way the single post endpoint returns HTTP 404.
+
+    This action does not require authentication, but if the user is
+    authenticated, they will see whether they liked the posts or not.
+    """
+    return Response(
+        find_posts(
+            [(ref.username, ref.post_id) for ref in input.posts],
+            current_username=auth_username,
+            normalized=query.shape == "normalized",
+        ),
+        media_type=response_format().media_type,
+    )
+
+
+@api.post(
+    "/likes:batch",
+    tags=["posts"],
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "User not logged in",
+            "model": Detailed,
+        },
+    },
+)
+async def batch_like(
+    auth_username: Annotated[Optional[str], Depends(authenticated_username)],
+    input: Annotated[BatchLikeModel, Body()],
+) -> list[LikeResultModel]:
+    """Endpoint for liking and unliking many posts at once
+
+    Accepts up to 100 operations, each one likes or unlikes the post given by
+    {username} and {post_id}. Operations are applied in order and are
+    idempotent, same as the single like and unlike endpoints. For every
+    operation the status which the single endpoint would return is reported.
+
+    This action requires authentication.
+    """
+    if auth_username is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            headers={"WWW-Authenticate": "Basic"},
+        )
+    found = apply_likes(
+        [(op.username, op.post_id, op.like) for op in input.operations],
+        auth_username,
+    )
+    await wait_durable()
+    return [
+        LikeResultModel(
+            username=op.username,
+            post_id=op.post_id,
+            status=(
+                status.HTTP_404_NOT_FOUND
+                if not ok
+                else status.HTTP_201_CREATED
+                if op.like
+                else status.HTTP_204_NO_CONTENT
+            ),
+        )
+        for op, ok in zip(input.operations, found)
+    ]
+
+
+def _decode_like_before(before: Optional[str]) -> Optional[LikeKey]:
+    if before is None:
+        return None
+    key = decode_like_cursor(before)
+    if key is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+    return key
+
+
+def _decode_before(before: Optional[str]) -> Optional[PostKey]:
+    if before is None:
+        return None
+    key = decode_cursor(before)
+    if key is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+    return key
+
+
+@api.get("/trending", tags=["posts"])
+async def get_trending(
+    query: Annotated[TrendingParams, Query()],
+) -> list[TrendingTagModel]:
+    """Returns hashtags used in most posts within the last hour or day
+
+    Numbers of posts are estimates: they are never lower than the real ones,
+    and may be slightly higher for rarely used tags.
+    """
+    return [
+        TrendingTagModel(tag=tag, posts=posts)
+        for tag, posts in trending_tags(query.window, query.limit)
+    ]
+
+
+@api.get(
+    "/posts/top",
+    tags=["posts"],
+    responses={
+        status.HTTP_400_BAD_REQUEST: {"description": "Invalid cursor", "model": Detailed},
+    },
+)
+async def get_top_posts(
+    auth_username: Annotated[Optional[str], Depends(authenticated_username)],
+    query: Annotated[TimelineParams, Query()],
+    response: Response,
+) -> Union[list[PostModel], NormalizedPostsModel]:
+    """Returns posts of all users, most liked first
+
+    Posts with the same number of likes are ordered newest first. The result
+    is paginated with {limit} posts per page; cursor of the next page is sent
+    in the Link header.
+
+    This action does not require authentication, but if the user is
+    authenticated, they will see whether they liked the posts or not.
+    """
+    before = None
+    if query.before is not None:
+        before = decode_rank_cursor(query.before)
+        if before is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+            )
+    result = list_top_posts(
+        None,
+        auth_username,
+        limit=query.limit,
+        before=before,
+        normalized=query.shape == "normalized",
+    )
+    if result.older is not None:
+        response.headers["Link"] = _links(
+            [_Link(f"/api/posts/top?before={result.older}&{_page_query(query)}", "next")]
+        )
+    return _encoded(result.posts, response)
+
+
+@api.get(
+    "/tags/{tag}/posts",
+    tags=["posts"],
+    responses={
+        status.HTTP_400_BAD_REQUEST: {"description": "Invalid cursor", "model": Detailed},
+    },
+)
+async def get_tag_posts(
+    auth_username: Annotated[Optional[str], Depends(authenticated_username)],
+    tag: str,
+    query: Annotated[TimelineParams, Query()],
+    response: Response,
+) -> Union[list[PostModel], NormalizedPostsModel]:
+    """Returns posts with the hashtag, newest first
+
+    Tags are matched ignoring case, with or without leading "#". The result
+    is paginated with {limit} posts per page; cursor of the next page is sent
+    in the Link header.
+
+    This action does not require authentication, but if the user is
+    authenticated, they will see whether they liked the posts or not.
+    """
+    before = _decode_before(query.before)
+    result = list_tag_posts(
+        tag,
+        auth_username,
+        before=before,
+        limit=query.limit,
+        normalized=query.shape == "normalized",
+    )
+    if result.older is not None:
+        url = f"/api/tags/{quote(tag, safe='')}/posts"
+        response.headers["Link"] = _links(
+            [_Link(f"{url}?before={result.older}&{_page_query(query)}", "next")]
+        )
+    return _encoded(result.posts, response)
+
+
+@api.get(
+    "/users/{username}/mentions",
+    tags=["posts"],
+    responses={
+        status.HTTP_400_BAD_REQUEST: {"description": "Invalid cursor", "model": Detailed},
+        status.HTTP_404_NOT_FOUND: {"description": "User not found", "model": Detailed},
+    },
+)
+async def get_user_mentions(
+    auth_username: Annotated[Optional[str], Depends(authenticated_username)],
+    username: str,
+    query: Annotated[TimelineParams, Query()],
+    response: Response,
+) -> Union[list[PostModel], NormalizedPostsModel]:
+    """Returns posts mentioning the user as @username, newest first
+
+    The result is paginated with {limit} posts per page; cursor of the next
+    page is sent in the Link header.
+
+    This action does not require authentication, but if the user is
+    authenticated, they will see whether they liked the posts or not.
+    """
+    user = find_user(username)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    before = _decode_before(query.before)
+    result = list_mentions(
+        username,
+        auth_username,
+        before=before,
+        limit=query.limit,
+        normalized=query.shape == "normalized",
+    )
+    if result.older is not None:
+        url = f"/api/users/{user.username}/mentions"
+        response.headers["Link"] = _links(
+            [_Link(f"{url}?before={result.older}&{_page_query(query)}", "next")]
+        )
+    return _encoded(result.posts, response)
+
+
+@api.get(
+    "/users/{username}/likes",
+    tags=["posts"],
+    responses={
+        status.HTTP_400_BAD_REQUEST: {"description": "Invalid cursor", "model": Detailed},
+        status.HTTP_404_NOT_FOUND: {"description": "User not found", "model": Detailed},
+    },
+)
+async def get_user_likes(
+    auth_username: Annotated[Optional[str], Depends(authenticated_username)],
+    username: str,
+    query: Annotated[TimelineParams, Query()],
+    response: Response,
+) -> Union[list[PostModel], NormalizedPostsModel]:
+    """Returns posts liked by the user, most recently liked first
+
+    The result is paginated with {limit} posts per page; cursor of the next
+    page is sent in the Link header.
+
+    This action does not require authentication, but if the user is
+    authenticated, they will see whether they liked the posts or not.
+    """
+    user = find_user(username)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    before = _decode_like_before(query.before)
+    result = list_liked_posts(
+        username,
+        auth_username,
+        before=before,
+        limit=query.limit,
+        normalized=query.shape == "normalized",
+    )
+    if result.older is not None:
+        url = f"/api/users/{user.username}/likes"
+        response.headers["Link"] = _links(
+            [_Link(f"{url}?before={result.older}&{_page_query(query)}", "next")]
+        )
+    return _encoded(result.posts, response)
+
+
+@api.get(
+    "/search",
+    tags=["posts"],
+    responses={
+        status.HTTP_400_BAD_REQUEST: {"description": "Invalid cursor", "model": Detailed},
+    },
+)
+async def search(
+    auth_username: Annotated[Optional[str], Depends(authenticated_username)],
+    query: Annotated[SearchParams, Query()],
+    response: Response,
+) -> Union[list[PostModel], NormalizedPostsModel]:
+    """Searches posts by their content
+
+    Returns posts containing all words of {q}, ignoring case. The last word
+    also matches longer words starting with it. Posts are ranked by
+    relevance, so rare words weigh more than common ones, and by recency.
+
+    The result is paginated with {limit} posts per page; cursor of the next
+    page is sent in the Link header.
+
+    This action does not require authentication, but if the user is
+    authenticated, they will see whether they liked the posts or not.
+    """
+    after = None
+    if query.cursor is not None:
+        after = decode_search_cursor(query.cursor)
+        if after is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+            )
+    result = search_posts(
+        query.q,
+        auth_username,
+        limit=query.limit,
+        after=after,
+        normalized=query.shape == "normalized",
+    )
+    if result.next is not None:
+        url = f"/api/search?{urlencode({'q': query.q, 'cursor': result.next})}"
+        response.headers["Link"] = _links([_Link(f"{url}&{_page_query(query)}", "next")])
+    return _encoded(result.posts, response)
+
+
+async def _events(topics: list[str]):
+    # Subscribe only once the response is being sent, so that an abandoned
+    # response does not leave its subscription behind
+    subscription = subscribe(topics)
+    try:
+        while not subscription.dropped:
+            events = await subscription.get(STREAM_HEARTBEAT)
+            if subscription.dropped:
+                yield b"event: dropped\ndata: {}\n\n"
+            elif events:
+                yield b"".join(events)
+            else:
+                yield b": heartbeat\n\n"
+    finally:
+        unsubscribe(subscription)
+
+
+@api.get(
+    "/stream",
+    tags=["posts"],
+    response_class=StreamingResponse,
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Stream of Server-Sent Events",
+            "content": {"text/event-stream": {}},
+        },
+        status.HTTP_404_NOT_FOUND: {
+            "description": "User or post not found",
+            "model": Detailed,
+        },
+    },
+)
+async def stream(query: Annotated[StreamParams, Query()]) -> StreamingResponse:
+    """Streams new posts and like counts as Server-Sent Events
+
+    Subscribes to new posts and likes of every {author}, and to likes of every
+    {post} given by id. Up to 100 authors and 100 posts may be given.
+
+    A "post" event carries a new post, same as the post endpoint returns to
+    unauthenticated users. A "likes" event carries {id}, {author} and the
+    current number of {likes} of a post. Like counts are sent at most a few
+    times per second, so some intermediate counts are skipped.
+
+    A heartbeat comment is sent when there are no events for a while. If the
+    client does not read events fast enough, a "dropped" event is sent and
+    the stream is closed; the client should reload posts and reconnect.
+
+    This action does not require authentication.
+    """
+    topics = stream_topics(query.author, query.post)
+    if topics is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return StreamingResponse(
+        _events(topics),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@api.post(
+    "/import",
+    tags=["users"],
+    responses={
+        status.HTTP_403_FORBIDDEN: {
+            "description": "Import is disabled or token is wrong",
+            "model": Detailed,
+        },
+    },
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/x-ndjson": {"schema": {"type": "string"}}},
+        }
+    },
+)
+async def bulk_import(
+    request: Request,
+    x_import_token: Annotated[Optional[str], Header()] = None,
+) -> ImportResultModel:
+    """Imports users, posts, likes and follows from JSON lines
+
+    Every line of the request body is a record with a "type": "user",
+    "post", "like" or "follow". Users carry argon2 password hashes. The body
+    is read as a stream and written in batches, so it may be of any size.
+    Existing users and posts are skipped; invalid lines are counted and the
+    first errors are reported, while the rest is imported.
+
+    The endpoint is enabled by KPITTER_IMPORT_TOKEN setting, which must be
+    sent in the X-Import-Token header.
+    """
+    if IMPORT_TOKEN is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Import is disabled"
+        )
+    if x_import_token is None or not hmac.compare_digest(
+        x_import_token.encode(), IMPORT_TOKEN.encode()
+    ):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Wrong token")
+    importer = Importer()
+    async for chunk in request.stream():
+        if chunk:
+            await asyncio.to_thread(importer.feed, chunk)
+    result = await asyncio.to_thread(importer.finish)
+    await wait_durable()
+    return result
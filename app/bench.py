@@ -0,0 +1,434 @@
+"""In-process load benchmark
+
+Seeds storage and drives the ASGI application of app.main with a mix of
+requests, without a server or network, then reports throughput and latency
+percentiles of every route:
+
+    python -m app.bench --users 1000 --posts 20 --likes 5 --duration 30 \
+        --json bench.json --baseline previous.json
+
+Storage is configured by the same KPITTER_* environment variables as the
+server. Seed users share one password, hashed once, so seeding does not pay
+for argon2 per user; their credentials are verified once before measuring,
+as the credential cache of a running server would be warm. Registrations do
+pay for argon2, like in production.
+
+Scenarios and their weights (see SCENARIOS) are changed with --weight, e.g.
+--weight register=0 --weight like=50 for a like storm.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import math
+import random
+import sys
+import time
+from dataclasses import dataclass, field
+from itertools import count
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+_WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua python fastapi argon2 "
+    "timeline posts likes search history rain june coffee weekend music"
+).split()
+_PASSWORD = "benchmark"
+
+
+@dataclass
+class Seed:
+    users: list[str]
+    posts: list[tuple[str, str]]
+    tags: list[str]
+    # Users making authenticated requests, with their Authorization headers
+    active: dict[str, str] = field(default_factory=dict)
+    hot: list[tuple[str, str]] = field(default_factory=list)
+
+
+def _content(tags: list[str]) -> str:
+    words = random.choices(_WORDS, k=random.randint(3, 12))
+    return " ".join(words) + f" #{random.choice(tags)}"
+
+
+def _authorization(username: str) -> str:
+    return "Basic " + base64.b64encode(f"{username}:{_PASSWORD}".encode()).decode()
+
+
+def seed(
+    users: int, posts: int, likes: int, follows: int, active: int, hot: int
+) -> Seed:
+    """Creates users with posts, likes and follows through app.logic"""
+    from passlib.hash import argon2
+
+    from .logic import (
+        _save_new_user,
+        add_like_to_post,
+        create_post,
+        follow_user,
+        is_username_available,
+    )
+    from .models import CreatePostModel, CreateUserModel
+
+    if not is_username_available("bench_0"):
+        sys.exit("Storage already contains benchmark users, use an empty one")
+    password_hash = argon2.hash(_PASSWORD)
+    usernames = [f"bench_{i}" for i in range(users)]
+    for username in usernames:
+        _save_new_user(
+            CreateUserModel(username=username, password=_PASSWORD), password_hash
+        )
+    for username in usernames:
+        for followee in random.sample(usernames, min(follows, users)):
+            if followee != username:
+                follow_user(username, followee)
+    tags = [f"tag{i}" for i in range(max(1, users // 10))]
+    refs = []
+    for _ in range(posts):
+        for username in usernames:
+            post = create_post(username, CreatePostModel(content=_content(tags)))
+            refs.append((post.author, post.id))
+    for author, post_id in refs:
+        for liker in random.sample(usernames, min(likes, users)):
+            add_like_to_post(author, post_id, liker)
+    result = Seed(users=usernames, posts=refs, tags=tags)
+    for username in random.sample(usernames, min(active, users)):
+        result.active[username] = _authorization(username)
+    result.hot = random.sample(refs, min(hot, len(refs)))
+    return result
+
+
+# Scenario returns route template and response
+Scenario = Callable[[httpx.AsyncClient, Seed], Awaitable[tuple[str, httpx.Response]]]
+
+
+def _viewer(seed: Seed) -> tuple[str, dict[str, str]]:
+    username = random.choice(list(seed.active))
+    return username, {"Authorization": seed.active[username]}
+
+
+async def _get_user(client: httpx.AsyncClient, seed: Seed):
+    username = random.choice(seed.users)
+    return "GET /api/users/{username}", await client.get(f"/api/users/{username}")
+
+
+async def _trending(client: httpx.AsyncClient, seed: Seed):
+    window = random.choice(["1h", "24h"])
+    return "GET /api/trending", await client.get(f"/api/trending?window={window}")
+
+
+async def _user_posts(client: httpx.AsyncClient, seed: Seed):
+    _, headers = _viewer(seed)
+    username = random.choice(seed.users)
+    response = await client.get(f"/api/users/{username}/posts", headers=headers)
+    return "GET /api/users/{username}/posts", response
+
+
+async def _top_posts(client: httpx.AsyncClient, seed: Seed):
+    _, headers = _viewer(seed)
+    if random.random() < 0.5:
+        return "GET /api/posts/top", await client.get("/api/posts/top", headers=headers)
+    username = random.choice(seed.users)
+    response = await client.get(f"/api/users/{username}/posts?sort=likes", headers=headers)
+    return "GET /api/users/{username}/posts?sort=likes", response
+
+
+async def _likes(client: httpx.AsyncClient, seed: Seed):
+    username, headers = _viewer(seed)
+    if random.random() < 0.5:
+        response = await client.get(f"/api/users/{username}/likes", headers=headers)
+        return "GET /api/users/{username}/likes", response
+    author, post_id = random.choice(seed.hot)
+    response = await client.get(f"/api/users/{author}/posts/{post_id}/likes")
+    return "GET /api/users/{username}/posts/{post_id}/likes", response
+
+
+async def _read_post(client: httpx.AsyncClient, seed: Seed):
+    _, headers = _viewer(seed)
+    author, post_id = random.choice(seed.posts)
+    response = await client.get(f"/api/users/{author}/posts/{post_id}", headers=headers)
+    return "GET /api/users/{username}/posts/{post_id}", response
+
+
+async def _timeline(client: httpx.AsyncClient, seed: Seed):
+    _, headers = _viewer(seed)
+    return "GET /api/me/timeline", await client.get("/api/me/timeline", headers=headers)
+
+
+async def _search(client: httpx.AsyncClient, seed: Seed):
+    _, headers = _viewer(seed)
+    query = " ".join(random.sample(_WORDS, random.randint(1, 2)))
+    response = await client.get("/api/search", params={"q": query}, headers=headers)
+    return "GET /api/search", response
+
+
+async def _tag_posts(client: httpx.AsyncClient, seed: Seed):
+    _, headers = _viewer(seed)
+    tag = random.choice(seed.tags)
+    response = await client.get(f"/api/tags/{tag}/posts", headers=headers)
+    return "GET /api/tags/{tag}/posts", response
+
+
+async def _publish(client: httpx.AsyncClient, seed: Seed):
+    username, headers = _viewer(seed)
+    response = await client.post(
+        f"/api/users/{username}/posts",
+        json={"content": _content(seed.tags)},
+        headers=headers,
+    )
+    return "POST /api/users/{username}/posts", response
+
+
+async def _like(client: httpx.AsyncClient, seed: Seed):
+    _, headers = _viewer(seed)
+    author, post_id = random.choice(seed.hot)
+    response = await client.put(
+        f"/api/users/{author}/posts/{post_id}/like", headers=headers
+    )
+    return "PUT /api/users/{username}/posts/{post_id}/like", response
+
+
+async def _unlike(client: httpx.AsyncClient, seed: Seed):
+    _, headers = _viewer(seed)
+    author, post_id = random.choice(seed.hot)
+    response = await client.delete(
+        f"/api/users/{author}/posts/{post_id}/like", headers=headers
+    )
+    return "DELETE /api/users/{username}/posts/{post_id}/like", response
+
+
+async def _follow(client: httpx.AsyncClient, seed: Seed):
+    _, headers = _viewer(seed)
+    followee = random.choice(seed.users)
+    response = await client.put(f"/api/users/{followee}/follow", headers=headers)
+    return "PUT /api/users/{username}/follow", response
+
+
+_registered = count()
+
+
+async def _register(client: httpx.AsyncClient, seed: Seed):
+    username = f"bench_new_{next(_registered)}"
+    response = await client.post(
+        "/api/register", json={"username": username, "password": _PASSWORD}
+    )
+    return "POST /api/register", response
+
+
+# Default weights: mostly reads, a storm of likes on a few hot posts, and
+# occasional registrations
+SCENARIOS: dict[str, tuple[Scenario, int]] = {
+    "user": (_get_user, 10),
+    "trending": (_trending, 3),
+    "posts": (_user_posts, 20),
+    "post": (_read_post, 15),
+    "top": (_top_posts, 3),
+    "likes": (_likes, 3),
+    "timeline": (_timeline, 25),
+    "search": (_search, 5),
+    "tag": (_tag_posts, 3),
+    "publish": (_publish, 5),
+    "like": (_like, 10),
+    "unlike": (_unlike, 3),
+    "follow": (_follow, 2),
+    "register": (_register, 1),
+}
+
+
+def _percentile(latencies: list[float], percent: float) -> float:
+    # Nearest-rank percentile of sorted latencies
+    return latencies[max(0, math.ceil(percent / 100 * len(latencies)) - 1)]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+    }
+
+
+async def run(
+    seed: Seed,
+    weights: dict[str, int],
+    duration: float,
+    requests: Optional[int],
+    concurrency: int,
+) -> dict:
+    from .db import database
+    from .main import app
+
+    scenarios = [SCENARIOS[name][0] for name, weight in weights.items() if weight > 0]
+    scenario_weights = [weight for weight in weights.values() if weight > 0]
+    latencies: dict[str, list[float]] = {}
+    errors: dict[str, int] = {}
+
+    def connect(number: int) -> httpx.AsyncClient:
+        # Every simulated client has its own address, as password attempts
+        # are limited per address (see app.admission)
+        address = f"10.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}"
+        transport = httpx.ASGITransport(app=app, client=(address, 1024))
+        return httpx.AsyncClient(transport=transport, base_url="http://bench")
+
+    # Warm up credential cache, so that measurements do not include argon2
+    # verification of every active user
+    for number, authorization in enumerate(seed.active.values()):
+        async with connect(number) as client:
+            await client.get("/api/me", headers={"Authorization": authorization})
+
+    remaining = count() if requests is None else iter(range(requests))
+    deadline = time.perf_counter() + duration
+
+    async def worker(number: int):
+        async with connect(number) as client:
+            for _ in remaining:
+                if time.perf_counter() >= deadline:
+                    return
+                (scenario,) = random.choices(scenarios, scenario_weights)
+                started = time.perf_counter()
+                route, response = await scenario(client, seed)
+                latency = time.perf_counter() - started
+                latencies.setdefault(route, []).append(latency)
+                if response.status_code >= 400:
+                    errors[route] = errors.get(route, 0) + 1
+
+    # Likes are applied in batches, measured by numbers of both
+    stats = database.stats()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(number) for number in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stats = {
+        name: database.stats()[name] - stats[name]
+        for name in ("like_batches", "likes_applied")
+    }
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    return {
+        "elapsed": round(elapsed, 3),
+        "total": summarize(all_latencies, sum(errors.values()), elapsed),
+        "routes": {
+            route: summarize(values, errors.get(route, 0), elapsed)
+            for route, values in sorted(latencies.items())
+        },
+        "likes": {"batches": stats["like_batches"], "applied": stats["likes_applied"]},
+    }
+
+
+def report(result: dict, baseline: Optional[dict] = None) -> str:
+    """Formats results as a table, with relative changes from the baseline"""
+    columns = ("requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms")
+    rows = [("route", *columns)]
+    for route, stats in [*result["routes"].items(), ("total", result["total"])]:
+        previous = {}
+        if baseline is not None:
+            previous = baseline["routes"].get(route, {})
+            if route == "total":
+                previous = baseline["total"]
+        row = [route]
+        for column in columns:
+            cell = str(stats[column])
+            if previous.get(column) and column not in ("requests", "errors"):
+                cell += f" ({(stats[column] / previous[column] - 1) * 100:+.0f}%)"
+            row.append(cell)
+        rows.append(tuple(row))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = [
+        "  ".join(
+            [row[0].ljust(widths[0])]
+            + [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+        )
+        for row in rows
+    ]
+    likes = result.get("likes")
+    if likes is not None and likes["batches"]:
+        lines.append(
+            f"{likes['applied']} likes applied in {likes['batches']} batches"
+            f" ({likes['applied'] / likes['batches']:.1f} per batch)"
+        )
+    return "\n".join(lines)
+
+
+def _weight(value: str) -> tuple[str, int]:
+    name, _, weight = value.partition("=")
+    if name not in SCENARIOS or not weight.isdigit():
+        raise argparse.ArgumentTypeError(
+            f"expected NAME=WEIGHT with NAME one of {', '.join(SCENARIOS)}"
+        )
+    return name, int(weight)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m app.bench", description="In-process load benchmark"
+    )
+    parser.add_argument("--users", type=int, default=1000, help="Seed users")
+    parser.add_argument("--posts", type=int, default=10, help="Posts per user")
+    parser.add_argument("--likes", type=int, default=5, help="Likes per post")
+    parser.add_argument("--follows", type=int, default=20, help="Follows per user")
+    parser.add_argument(
+        "--active", type=int, default=100, help="Users making authenticated requests"
+    )
+    parser.add_argument("--hot", type=int, default=10, help="Posts receiving like storms")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to run")
+    parser.add_argument("--requests", type=int, help="Stop after this many requests")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--weight", type=_weight, action="append", default=[], metavar="NAME=WEIGHT"
+    )
+    parser.add_argument("--seed", type=int, help="Seed of random choices")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--baseline", help="Compare with results of a previous run")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    weights = {name: weight for name, (_, weight) in SCENARIOS.items()}
+    weights.update(args.weight)
+    if not any(weights.values()):
+        parser.error("all scenarios are disabled")
+
+    async def bench() -> tuple[float, dict]:
+        from .main import app
+
+        async with app.router.lifespan_context(app):
+            started = time.perf_counter()
+            data = seed(
+                args.users, args.posts, args.likes, args.follows, args.active, args.hot
+            )
+            seeding = time.perf_counter() - started
+            print(
+                f"Seeded {len(data.users)} users, {len(data.posts)} posts "
+                f"in {seeding:.1f}s",
+                file=sys.stderr,
+            )
+            return seeding, await run(
+                data, weights, args.duration, args.requests, args.concurrency
+            )
+
+    seeding, result = asyncio.run(bench())
+    result = {
+        "config": {**vars(args), "weights": weights, "seeding": round(seeding, 3)},
+        **result,
+    }
+    for name in ("json", "baseline", "weight"):
+        del result["config"][name]
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print(report(result, baseline))
+    if args.json is not None:
+        with open(args.json, "w") as file:
+            json.dump(result, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""Bulk import of users, posts, likes and follows from JSON lines
+
+Every line is an object with a "type" (see ImportRecord in app.models):
+
+    {"type": "user", "username": "johndoe", "password_hash": "$argon2id$..."}
+    {"type": "post", "id": "deadbeef...", "author": "johndoe", "content": "Hi",
+     "created_at": "2024-12-01T10:00:00"}
+    {"type": "like", "post_id": "deadbeef...", "username": "janedoe",
+     "liked_at": "2024-12-01T11:00:00"}
+    {"type": "follow", "username": "janedoe", "followee": "johndoe"}
+
+Lines are read one by one and written to storage in batches of
+IMPORT_BATCH_SIZE records (see Storage.import_batch), so memory use does not
+depend on the size of the input. Passwords are expected to be hashed already;
+plain passwords are accepted too, but hashing them is slow. Records may refer
+to users and posts of earlier lines or of the storage. Existing users and
+posts (with ids) are skipped, so an interrupted import may be run again:
+
+    python -m app.bulk users.jsonl posts.jsonl likes.jsonl
+"""
+
+import json
+import sys
+from datetime import datetime
+from typing import Iterable, Optional
+from uuid import uuid4
+
+from pydantic import TypeAdapter, ValidationError
+
+from .config import IMPORT_BATCH_SIZE
+from .db import ImportBatch, Post, Storage, User, database
+from .hashing import hash_password_sync
+from .models import (
+    ImportFollowModel,
+    ImportLikeModel,
+    ImportPostModel,
+    ImportRecord,
+    ImportResultModel,
+    ImportUserModel,
+)
+from .ranking import ranking
+from .search import search_index
+from .tags import trending
+from .timeline import timelines
+
+_records: TypeAdapter[ImportRecord] = TypeAdapter(ImportRecord)
+_MAX_LINE = 1 << 16
+_MAX_ERRORS = 100
+
+
+def _describe(error: ValidationError) -> str:
+    return "; ".join(
+        ": ".join(filter(None, [".".join(map(str, detail["loc"])), detail["msg"]]))
+        for detail in error.errors(include_url=False)
+    )
+
+
+class Importer:
+    """Writes records of lines to storage in batches
+
+    Posts written to storage are added to in-memory indexes of this process
+    unless {index} is False.
+    """
+
+    def __init__(
+        self,
+        storage: Storage = database,
+        batch_size: int = IMPORT_BATCH_SIZE,
+        index: bool = True,
+    ):
+        self._storage = storage
+        self._batch_size = batch_size
+        self._index = index
+        self._batch = ImportBatch()
+        # Users found or created by records of the current batch
+        self._users: dict[str, User] = {}
+        self._source: Optional[str] = None
+        self._line = 0
+        # Incomplete last line of fed input, and whether the rest of a too long
+        # line is being skipped
+        self._rest = b""
+        self._skipping = False
+        self._result = ImportResultModel(
+            users=0, posts=0, likes=0, follows=0, skipped=0, failed=0, errors=[]
+        )
+
+    def begin(self, source: str) -> None:
+        """Starts numbering lines of the next input, named {source} in errors"""
+        self._source = source
+        self._line = 0
+
+    def _fail(self, message: str) -> None:
+        self._result.failed += 1
+        if len(self._result.errors) < _MAX_ERRORS:
+            where = f"Line {self._line}"
+            if self._source is not None:
+                where = f"{self._source}:{self._line}"
+            self._result.errors.append(f"{where}: {message}")
+
+    def _user(self, key: str) -> Optional[User]:
+        user = self._users.get(key)
+        if user is None:
+            user = self._storage.find_user(key)
+            if user is not None:
+                self._users[key] = user
+        return user
+
+    def add(self, line: str | bytes) -> None:
+        self._line += 1
+        if not line.strip():
+            return
+        try:
+            record = _records.validate_json(line)
+        except ValidationError as error:
+            self._fail(_describe(error))
+            return
+        if isinstance(record, ImportUserModel):
+            key = record.username.lower()
+            if self._user(key) is not None:
+                self._result.skipped += 1
+                return
+            user = self._users[key] = User(
+                username=record.username,
+                password_hash=record.password_hash or hash_password_sync(record.password),
+                full_name=record.full_name,
+            )
+            self._batch.users.append((key, user))
+        elif isinstance(record, ImportPostModel):
+            author = self._user(record.author.lower())
+            if author is None:
+                self._fail(f"Unknown author {record.author}")
+                return
+            created_at = record.created_at or datetime.now()
+            if created_at.tzinfo is not None:
+                # Posts are timestamped with naive local time
+                created_at = created_at.astimezone().replace(tzinfo=None)
+            post = Post(
+                id=(record.id or uuid4().hex).lower(),
+                author=author,
+                content=record.content,
+                created_at=created_at,
+            )
+            self._batch.posts.append(post)
+        elif isinstance(record, ImportLikeModel):
+            # Naive times are local, the same as times of posts
+            liked_at = (record.liked_at or datetime.now()).timestamp()
+            self._batch.likes.append(
+                (record.post_id.lower(), record.username.lower(), liked_at)
+            )
+        elif isinstance(record, ImportFollowModel):
+            self._batch.follows.append((record.username.lower(), record.followee.lower()))
+        if len(self._batch) >= self._batch_size:
+            self.flush()
+
+    def add_all(self, lines: Iterable[str | bytes]) -> None:
+        for line in lines:
+            self.add(line)
+
+    def feed(self, chunk: bytes) -> None:
+        """Adds complete lines of a chunk of input"""
+        lines = (self._rest + chunk).split(b"\n")
+        self._rest = lines.pop()
+        if self._skipping and lines:
+            # The first line is the end of the too long one
+            self._skipping = False
+            lines.pop(0)
+        self.add_all(lines)
+        if len(self._rest) > _MAX_LINE:
+            self._line += 1
+            self._fail(f"Line is longer than {_MAX_LINE} bytes")
+            self._rest = b""
+            self._skipping = True
+
+    def flush(self) -> None:
+        batch, self._batch = self._batch, ImportBatch()
+        self._users.clear()
+        if not batch:
+            return
+        imported = self._storage.import_batch(batch)
+        if self._index:
+            for post in imported.posts:
+                search_index.add(post)
+                trending.on_post(post)
+                ranking.add(post)
+            if imported.posts or imported.follows:
+                # Imported posts may be older than posts in timelines
+                timelines.reset()
+        result = self._result
+        result.users += imported.users
+        result.posts += len(imported.posts)
+        result.likes += imported.likes
+        result.follows += imported.follows
+        result.skipped += len(batch) - (
+            imported.users + len(imported.posts) + imported.likes + imported.follows
+        )
+
+    def finish(self) -> ImportResultModel:
+        """Imports the rest of input and returns the result"""
+        if self._rest and not self._skipping:
+            self.add(self._rest)
+        self._rest = b""
+        self.flush()
+        return self._result
+
+
+def import_lines(
+    lines: Iterable[str | bytes], storage: Storage = database, index: bool = True
+) -> ImportResultModel:
+    importer = Importer(storage, index=index)
+    importer.add_all(lines)
+    return importer.finish()
+
+
+def seed(source: str) -> Optional[ImportResultModel]:
+    """Loads data into storage: demo data, none, or lines of the file"""
+    if source == "none":
+        return None
+    if source == "demo":
+        from .demo import demo_lines
+
+        return import_lines(demo_lines())
+    with open(source, "rb") as file:
+        return import_lines(file)
+
+
+def main() -> None:
+    from .config import DATA_DIR, FSYNC, FSYNC_INTERVAL, SNAPSHOT_INTERVAL, STORAGE
+    from .journal import close_journal, open_journal
+
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python -m app.bulk FILE... (- reads standard input)")
+    journal = None
+    if STORAGE == "memory":
+        if DATA_DIR is None:
+            sys.exit(
+                "Imported data would be lost: set KPITTER_DATA_DIR,"
+                " or KPITTER_STORAGE=sqlite"
+            )
+        journal = open_journal(
+            database,
+            DATA_DIR,
+            fsync=FSYNC,
+            fsync_interval=FSYNC_INTERVAL,
+            snapshot_interval=SNAPSHOT_INTERVAL,
+        )
+    importer = Importer(index=False)
+    try:
+        for path in sys.argv[1:]:
+            importer.begin(path)
+            if path == "-":
+                importer.add_all(sys.stdin.buffer)
+            else:
+                with open(path, "rb") as file:
+                    importer.add_all(file)
+        print(json.dumps(importer.finish().model_dump(), indent=2))
+    finally:
+        close_journal(database, journal)
+        database.close()
+
+
+if __name__ == "__main__":
+    main()
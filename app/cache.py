@@ -0,0 +1,88 @@
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from .config import AUTH_CACHE_SIZE, AUTH_CACHE_TTL
+
+
+class _Entry(NamedTuple):
+    password_hash: bytes
+    expires_at: float
+
+
+class CredentialCache:
+    """Bounded LRU cache of recently verified credentials
+
+    Entries are keyed by an HMAC of username and password under a per-process
+    random key, so plaintext passwords are never kept in memory. Every entry
+    remembers the password hash it was verified against, and is dropped as
+    soon as the user's current hash differs from it.
+
+    Evictions count every entry that was dropped, whether because the cache
+    was full, the entry expired or the password hash changed.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._key = secrets.token_bytes(32)
+        self._entries: OrderedDict[bytes, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _digest(self, username: str, password: str) -> bytes:
+        username_ = username.encode()
+        message = len(username_).to_bytes(4, "big") + username_ + password.encode()
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def check(self, username: str, password: str, password_hash: bytes) -> bool:
+        """Returns True if credentials were recently verified against given hash"""
+        key = self._digest(username, password)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False
+            if entry.expires_at <= time.monotonic() or entry.password_hash != password_hash:
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return False
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True
+
+    def add(self, username: str, password: str, password_hash: bytes) -> None:
+        if self.maxsize <= 0:
+            return
+        key = self._digest(username, password)
+        with self._lock:
+            self._entries[key] = _Entry(password_hash, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+credential_cache = CredentialCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
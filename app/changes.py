@@ -0,0 +1,97 @@
+"""Changes made by other worker processes
+
+Several uvicorn workers may share one SQLite database. Data read from the
+database is always current, but timelines (app.timeline), indexes of posts
+(app.search, app.tags, app.ranking) and subscriptions (app.pubsub) live in
+memory of every worker, and are updated by the worker which handles the
+write. Other workers learn about writes from the changes table of the
+database: they poll it in the background, and before every
+timeline read, so that a timeline includes posts just published through
+another worker. If a worker missed changes which have expired already, it
+builds all of them again from the database.
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+from .pubsub import pubsub
+from .ranking import ranking
+from .search import search_index
+from .sqlitedb import SqliteDatabase
+from .tags import trending
+from .timeline import timelines
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeFeed:
+    def __init__(self, storage: SqliteDatabase):
+        self._storage = storage
+        self._last = storage.last_change()
+
+    def catch_up(self) -> None:
+        """Applies changes made by other workers since the last call"""
+        self._last, changes = self._storage.changes(self._last)
+        if changes is None:
+            logger.warning("Missed expired changes, rebuilding indexes of posts")
+            self._rebuild()
+            return
+        imported = False
+        for kind, subject, target in changes:
+            if kind == "follow":
+                timelines.on_follows_changed(subject, target)
+                continue
+            post = self._storage.find_post(subject)
+            if post is None:
+                continue
+            if kind == "post":
+                timelines.on_post(post)
+                search_index.add(post)
+                trending.on_post(post)
+                ranking.add(post)
+                pubsub.publish_post(post)
+            elif kind == "import":
+                search_index.add(post)
+                trending.on_post(post)
+                ranking.add(post)
+                imported = True
+            elif kind == "likes":
+                counts = {post.id: len(post.likes)}
+                ranking.on_likes(counts)
+                pubsub.on_likes(counts)
+        if imported:
+            # Bulk imports may add old posts anywhere in timelines
+            timelines.reset()
+
+    def _rebuild(self) -> None:
+        timelines.reset()
+        search_index.reset()
+        trending.reset()
+        ranking.reset()
+        for post in self._storage.posts():
+            search_index.add(post)
+            trending.on_post(post)
+            ranking.add(post)
+
+    async def run(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.catch_up()
+            except Exception:
+                logger.exception("Failed to apply changes of other workers")
+
+
+feed: Optional[ChangeFeed] = None
+
+
+def open_feed(storage: SqliteDatabase) -> ChangeFeed:
+    global feed
+    feed = ChangeFeed(storage)
+    return feed
+
+
+def catch_up() -> None:
+    if feed is not None:
+        feed.catch_up()
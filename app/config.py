@@ -0,0 +1,93 @@
+import os
+
+
+def _env(name: str, default: str) -> str:
+    return os.environ.get(f"KPITTER_{name}", default)
+
+
+# Verified credentials cache (see app.cache.CredentialCache)
+AUTH_CACHE_SIZE = int(_env("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(_env("AUTH_CACHE_TTL", "300"))
+
+# Password hashing process pool (see app.hashing). Hashes beyond HASH_WORKERS
+# running and HASH_QUEUE_SIZE queued ones are rejected
+HASH_WORKERS = int(_env("HASH_WORKERS", str(os.cpu_count() or 1)))
+HASH_QUEUE_SIZE = int(_env("HASH_QUEUE_SIZE", str(2 * HASH_WORKERS)))
+
+# Admission control of password hashing (see app.admission). Every client
+# address may start AUTH_CLIENT_RATE hashes per second and every username
+# AUTH_USER_RATE verifications per second, in bursts of up to *_BURST.
+# Verifications waiting for one of AUTH_MAX_VERIFICATIONS slots longer than
+# AUTH_QUEUE_TIMEOUT seconds are rejected
+AUTH_CLIENT_RATE = float(_env("AUTH_CLIENT_RATE", "2"))
+AUTH_CLIENT_BURST = float(_env("AUTH_CLIENT_BURST", "20"))
+AUTH_USER_RATE = float(_env("AUTH_USER_RATE", "0.2"))
+AUTH_USER_BURST = float(_env("AUTH_USER_BURST", "10"))
+AUTH_LIMITER_SIZE = int(_env("AUTH_LIMITER_SIZE", "100000"))
+AUTH_MAX_VERIFICATIONS = int(
+    _env("AUTH_MAX_VERIFICATIONS", str(max(1, HASH_WORKERS) + HASH_QUEUE_SIZE))
+)
+AUTH_QUEUE_TIMEOUT = float(_env("AUTH_QUEUE_TIMEOUT", "1"))
+
+# Persistence (see app.journal). Data is kept only in memory unless DATA_DIR
+# is set. FSYNC is one of "always", "batch" or "interval".
+DATA_DIR = _env("DATA_DIR", "") or None
+FSYNC = _env("FSYNC", "batch")
+FSYNC_INTERVAL = float(_env("FSYNC_INTERVAL", "1"))
+SNAPSHOT_INTERVAL = float(_env("SNAPSHOT_INTERVAL", "300"))
+
+# Storage backend: "memory" or "sqlite" (see app.db.Storage)
+STORAGE = _env("STORAGE", "memory")
+# Number of independently locked shards of the memory backend
+DB_SHARDS = int(_env("DB_SHARDS", "16"))
+SQLITE_PATH = _env("SQLITE_PATH", "kpitter.db")
+SQLITE_POOL_SIZE = int(_env("SQLITE_POOL_SIZE", "4"))
+# Likes are written in batched transactions of up to LIKE_BATCH_SIZE writes,
+# flushed at least every LIKE_BATCH_DELAY seconds
+LIKE_BATCH_SIZE = int(_env("LIKE_BATCH_SIZE", "256"))
+LIKE_BATCH_DELAY = float(_env("LIKE_BATCH_DELAY", "0.05"))
+# Worker processes sharing SQLite database poll it for changes made by other
+# workers every CHANGES_POLL_INTERVAL seconds (see app.changes)
+CHANGES_POLL_INTERVAL = float(_env("CHANGES_POLL_INTERVAL", "0.1"))
+CHANGES_RETENTION = float(_env("CHANGES_RETENTION", "60"))
+
+# Home timelines (see app.timeline)
+TIMELINE_SIZE = int(_env("TIMELINE_SIZE", "800"))
+TIMELINE_FANOUT_LIMIT = int(_env("TIMELINE_FANOUT_LIMIT", "10000"))
+
+# Number of posts whose immutable JSON parts are cached (see app.serialization)
+POST_ENCODER_CACHE_SIZE = int(_env("POST_ENCODER_CACHE_SIZE", "100000"))
+
+# Responses of at least COMPRESSION_MIN_SIZE bytes are compressed for clients
+# accepting gzip or brotli (see app.encoding)
+COMPRESSION_MIN_SIZE = int(_env("COMPRESSION_MIN_SIZE", "1024"))
+
+# Streams of new posts and like counts (see app.pubsub). Subscribers with more
+# than STREAM_QUEUE_SIZE unsent events are dropped.
+STREAM_QUEUE_SIZE = int(_env("STREAM_QUEUE_SIZE", "100"))
+STREAM_LIKES_INTERVAL = float(_env("STREAM_LIKES_INTERVAL", "0.5"))
+STREAM_HEARTBEAT = float(_env("STREAM_HEARTBEAT", "15"))
+
+# Full-text search (see app.search). Recency of posts halves every
+# SEARCH_HALF_LIFE hours; the last query term matches up to SEARCH_PREFIX_TERMS
+# longer terms
+SEARCH_HALF_LIFE = float(_env("SEARCH_HALF_LIFE", "24"))
+SEARCH_PREFIX_TERMS = int(_env("SEARCH_PREFIX_TERMS", "64"))
+
+# Trending tags (see app.tags). Tags are counted in count-min sketches of
+# TRENDING_SKETCH_WIDTH counters per row; up to TRENDING_TOP tags with highest
+# counts are tracked in every window
+TRENDING_SKETCH_WIDTH = int(_env("TRENDING_SKETCH_WIDTH", "4096"))
+TRENDING_TOP = int(_env("TRENDING_TOP", "100"))
+
+# Bulk import (see app.bulk). Records are written in batches of
+# IMPORT_BATCH_SIZE; the import endpoint is enabled by setting IMPORT_TOKEN
+IMPORT_BATCH_SIZE = int(_env("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_TOKEN = _env("IMPORT_TOKEN", "") or None
+# Data loaded into empty storage at startup: "demo", "none", or path of a JSON
+# lines file to import
+SEED = _env("SEED", "demo")
+
+# Sampling profiler of the /debug/profile endpoint (see app.profiler), off by
+# default
+PROFILER = _env("PROFILER", "0") == "1"
@@ -1,42 +1,819 @@
-from dataclasses import dataclass
+import contextlib
+import heapq
+import itertools
+import math
+import secrets
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Optional
+from operator import itemgetter
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Optional,
+    Protocol,
+)
 from uuid import uuid4
 
+from .config import (
+    DB_SHARDS,
+    LIKE_BATCH_DELAY,
+    LIKE_BATCH_SIZE,
+    SQLITE_PATH,
+    STORAGE,
+)
+from .likes import Intent, LikeQueue
 
-@dataclass
+PostKey = tuple[datetime, str]
+# Time of a like, and username of the liker or id of the liked post
+LikeKey = tuple[float, str]
+
+
+class Posts(Protocol):
+    """Posts of a user, as seen by the application logic
+
+    The memory backend keeps them in PostLog, other backends provide views
+    which query the storage.
+    """
+
+    def newest(
+        self, offset: int = 0, limit: Optional[int] = None
+    ) -> Iterator["Post"]: ...
+
+    def before(self, key: PostKey, limit: Optional[int] = None) -> Iterator["Post"]: ...
+
+    def after(self, key: PostKey, limit: int) -> Iterator["Post"]: ...
+
+    def has_before(self, key: PostKey) -> bool: ...
+
+    def has_after(self, key: PostKey) -> bool: ...
+
+    def __len__(self) -> int: ...
+
+
+class Likes(Protocol):
+    """Users who liked a post
+
+    Whether particular user liked the post is answered by the storage, see
+    {Storage.is_liked}, and who liked it by {Storage.post_likes}.
+    """
+
+    def __len__(self) -> int: ...
+
+
+# Items of a LikeLog, their times, and late likes: times and items, sorted by
+# time
+_LogData = tuple[list[Any], array, Optional[tuple[array, list[Any]]]]
+
+
+def _live(items: list[Any], times: array) -> Iterator[tuple[float, Any]]:
+    for position in range(min(len(items), len(times))):
+        item = items[position]
+        if item is not None:
+            yield times[position], item
+
+
+class LikeLog:
+    """Liked items with times of their likes, in order of time
+
+    Items are users who liked a post, or posts liked by a user. They are kept
+    in a list, oldest first, with a parallel array of times, so a like is
+    appended in amortized O(1) and a page of the newest likes is found by
+    bisect. Removed items leave holes, which are skipped by reads, so an
+    unlike takes O(1) as well; the log is compacted once there are more holes
+    than items. Times of items are indexed only when the log has more than
+    _MIN_INDEX entries, small logs are scanned.
+
+    Times are strictly increasing, so a time alone marks a position in the
+    log; the time of a like is moved by a fraction of a microsecond if
+    another like has the same time. Likes with out-of-order times, such as
+    imported ones, are kept aside in a sorted list of late likes, which is
+    merged into the log once it is longer than the square root of the log.
+    So an out-of-order like costs amortized O(sqrt(n)), not a copy of the log.
+
+    Writers are serialized by the caller. Readers take no locks: the list,
+    the array and late likes are replaced at once, items are appended to the
+    list before their times, and times in the index never change.
+    """
+
+    __slots__ = ("_data", "_index", "_count")
+
+    _MIN_INDEX = 16
+    _MIN_LATE = 16
+
+    def __init__(self):
+        self._data: Optional[_LogData] = None
+        self._index: Optional[dict[Any, float]] = None
+        self._count = 0
+
+    def _position(self, data: _LogData, item: object) -> Optional[tuple[bool, int]]:
+        """Returns whether the item is late and its position, if it is there"""
+        if item is None:
+            return None
+        items, times, late = data
+        index = self._index
+        if index is None:
+            if item in items:
+                return False, items.index(item)
+            if late is not None and item in late[1]:
+                return True, late[1].index(item)
+            return None
+        at = index.get(item)
+        if at is None:
+            return None
+        position = bisect_left(times, at)
+        if position < min(len(items), len(times)) and items[position] == item:
+            return False, position
+        if late is not None:
+            position = bisect_left(late[0], at)
+            if position < len(late[1]) and late[1][position] == item:
+                return True, position
+        return None
+
+    def __contains__(self, item: object) -> bool:
+        data = self._data
+        return data is not None and self._position(data, item) is not None
+
+    def _merge(self) -> None:
+        """Moves late likes into the log, between slices of it"""
+        assert self._data is not None
+        items, times, late = self._data
+        assert late is not None
+        merged_items: list[Any] = []
+        merged_times = array("d")
+        start = 0
+        for at, item in zip(*late):
+            position = bisect_left(times, at, start)
+            merged_items += items[start:position]
+            merged_times += times[start:position]
+            merged_items.append(item)
+            merged_times.append(at)
+            start = position
+        merged_items += items[start:]
+        merged_times += times[start:]
+        self._data = merged_items, merged_times, None
+
+    def add(self, item: Any, at: float) -> bool:
+        """Adds item liked at {at} and returns whether it was not there yet"""
+        if item in self:
+            return False
+        if self._data is None:
+            self._data = [], array("d"), None
+        items, times, late = self._data
+        late_times = array("d") if late is None else late[0]
+        position = bisect_left(times, at)
+        late_position = bisect_left(late_times, at)
+        while (position < len(times) and times[position] == at) or (
+            late_position < len(late_times) and late_times[late_position] == at
+        ):
+            at = math.nextafter(at, math.inf)
+            position = bisect_left(times, at)
+            late_position = bisect_left(late_times, at)
+        self._count += 1
+        if self._index is not None:
+            self._index[item] = at
+        elif self._count > self._MIN_INDEX:
+            self._index = {logged: time for time, logged in self}
+            self._index[item] = at
+        if position == len(times):
+            items.append(item)
+            times.append(at)
+            return True
+        late_times = array("d", late_times)
+        late_times.insert(late_position, at)
+        late_items = [] if late is None else late[1][:]
+        late_items.insert(late_position, item)
+        self._data = items, times, (late_times, late_items)
+        if len(late_items) > max(self._MIN_LATE, math.isqrt(len(items))):
+            self._merge()
+        return True
+
+    def discard(self, item: Any) -> bool:
+        """Removes item and returns whether it was there"""
+        data = self._data
+        found = None if data is None else self._position(data, item)
+        if found is None:
+            return False
+        assert data is not None
+        items, times, late = data
+        is_late, position = found
+        self._count -= 1
+        if self._index is not None:
+            del self._index[item]
+        if is_late:
+            assert late is not None
+            rest = None
+            if len(late[1]) > 1:
+                late_times = array("d", late[0])
+                del late_times[position]
+                rest = late_times, late[1][:position] + late[1][position + 1 :]
+            self._data = items, times, rest
+            return True
+        items[position] = None
+        logged = self._count - (0 if late is None else len(late[1]))
+        if len(items) - logged > self._count:
+            if late is not None:
+                self._merge()
+            items, times, _ = self._data
+            kept = [position for position, item in enumerate(items) if item is not None]
+            self._data = (
+                [items[position] for position in kept],
+                array("d", [times[position] for position in kept]),
+                None,
+            )
+        return True
+
+    def newest(
+        self, before: Optional[float] = None, limit: int = 10
+    ) -> tuple[list[tuple[float, Any]], bool]:
+        """Returns up to {limit} items liked before {before}, newest first
+
+        Items are returned with times of their likes, together with whether
+        there are older ones.
+        """
+        result: list[tuple[float, Any]] = []
+        data = self._data
+        if data is None:
+            return result, False
+        items, times, late = data
+        late_times, late_items = (array("d"), []) if late is None else late
+        position = min(len(items), len(times))
+        late_position = len(late_items)
+        if before is not None:
+            position = bisect_left(times, before, 0, position)
+            late_position = bisect_left(late_times, before)
+        while True:
+            # Late likes are merged with the log, newest first
+            if late_position and (
+                not position or late_times[late_position - 1] > times[position - 1]
+            ):
+                late_position -= 1
+                like = late_times[late_position], late_items[late_position]
+            elif position:
+                position -= 1
+                item = items[position]
+                if item is None:
+                    continue
+                like = times[position], item
+            else:
+                return result, False
+            if len(result) == limit:
+                return result, True
+            result.append(like)
+
+    def __iter__(self) -> Iterator[tuple[float, Any]]:
+        """Yields items with times of their likes, oldest first"""
+        data = self._data
+        if data is None:
+            return
+        items, times, late = data
+        if late is None:
+            yield from _live(items, times)
+        else:
+            yield from heapq.merge(_live(items, times), zip(*late), key=itemgetter(0))
+
+    def __len__(self) -> int:
+        return self._count
+
+
+@dataclass(slots=True)
 class User:
     username: str
     password_hash: bytes
     full_name: Optional[str]
-    posts: list["Post"]
+    posts: Posts = field(default_factory=lambda: PostLog())
+    # Changes whenever user, their posts or likes of their posts change
+    version: int = 0
+    # Changes whenever user likes or unlikes any post
+    likes_version: int = 0
 
 
-@dataclass
+@dataclass(slots=True)
 class Post:
     id: str
     author: User
     content: str
-    likes: set[str]
     created_at: datetime
+    likes: Likes = field(default_factory=LikeLog)
+    # Changes whenever the post or its likes change
+    version: int = 0
 
 
-class Database:
+def post_key(post: Post) -> PostKey:
+    return post.created_at, post.id
+
+
+@dataclass(slots=True)
+class ImportBatch:
+    """Records written to storage together by bulk import (see app.bulk)"""
+
+    users: list[tuple[str, User]] = field(default_factory=list)
+    posts: list[Post] = field(default_factory=list)
+    # Post id, username and time of the like
+    likes: list[tuple[str, str, float]] = field(default_factory=list)
+    # Follower and followee
+    follows: list[tuple[str, str]] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.users) + len(self.posts) + len(self.likes) + len(self.follows)
+
+
+class LikesPage(NamedTuple):
+    # Newest first
+    keys: list[LikeKey]
+    # Whether there are older likes
+    more: bool
+
+
+class Imported(NamedTuple):
+    users: int
+    posts: list[Post]
+    likes: int
+    follows: int
+
+
+class ShardCopy(NamedTuple):
+    users: list[tuple[str, User]]
+    # Posts of the users, oldest first, with likers and times of their likes
+    posts: list[tuple[Post, list[tuple[str, float]]]]
+    # Followers and their followees
+    following: list[tuple[str, list[str]]]
+
+
+class PostLog:
+    """Posts of a single user ordered by creation time
+
+    Posts are stored oldest-first by (created_at, id), so a new post is
+    appended in amortized O(1). A post which arrives with an out-of-order
+    timestamp is placed using bisect. Reads are newest-first and never copy
+    more than requested.
+    """
+
+    __slots__ = ("_posts",)
+
+    def __init__(self):
+        self._posts: list[Post] = []
+
+    def add(self, post: Post) -> None:
+        if not self._posts or post_key(self._posts[-1]) <= post_key(post):
+            self._posts.append(post)
+        else:
+            index = bisect_right(self._posts, post_key(post), key=post_key)
+            self._posts.insert(index, post)
+
+    def _range(self, start: int, limit: Optional[int], low: int = 0) -> Iterator[Post]:
+        stop = low - 1 if limit is None else max(low - 1, start - limit)
+        for index in range(start, stop, -1):
+            yield self._posts[index]
+
+    def newest(self, offset: int = 0, limit: Optional[int] = None) -> Iterator[Post]:
+        """Yields up to {limit} posts, newest first, skipping {offset} newest"""
+        return self._range(len(self._posts) - 1 - offset, limit)
+
+    def before(self, key: PostKey, limit: Optional[int] = None) -> Iterator[Post]:
+        """Yields up to {limit} posts older than {key}, newest first"""
+        return self._range(bisect_left(self._posts, key, key=post_key) - 1, limit)
+
+    def after(self, key: PostKey, limit: int) -> Iterator[Post]:
+        """Yields up to {limit} posts right after {key}, newest first"""
+        low = bisect_right(self._posts, key, key=post_key)
+        return self._range(min(low + limit, len(self._posts)) - 1, limit, low)
+
+    def has_before(self, key: PostKey) -> bool:
+        return bisect_left(self._posts, key, key=post_key) > 0
+
+    def has_after(self, key: PostKey) -> bool:
+        return bisect_right(self._posts, key, key=post_key) < len(self._posts)
+
+    def __iter__(self) -> Iterator[Post]:
+        return self.newest()
+
+    def __len__(self) -> int:
+        return len(self._posts)
+
+
+class Journal(Protocol):
+    def append(self, op: str, fields: dict[str, Any]) -> int: ...
+
+    async def sync(self) -> None: ...
+
+
+class Storage(Protocol):
+    """Interface of storage backends used by the application logic
+
+    Every mutation goes through these methods; reads of user posts and post
+    likes go through the {User.posts} and {Post.likes} collections.
+
+    Record versions are unique only within the {epoch} of the storage, which
+    changes whenever versions may be reused.
+    """
+
+    epoch: str
+    # Called with new numbers of likes by post id, whenever likes of posts
+    # were changed by an applied batch of likes or by an import
+    on_likes: Optional[Callable[[dict[str, int]], None]]
+
+    def find_user(self, username: str) -> Optional[User]: ...
+
+    def find_post(self, post_id: str) -> Optional[Post]: ...
+
+    def posts(self) -> Iterable[Post]:
+        """Returns all posts, in no particular order"""
+
+    def save_user(self, key: str, user: User): ...
+
+    def add_user(self, key: str, user: User) -> bool:
+        """Saves a new user, returns False if {key} is taken already"""
+
+    def save_post(self, post: Post): ...
+
+    def add_like(self, post: Post, username: str, liked_at: Optional[float] = None):
+        """Likes the post at {liked_at}, a POSIX timestamp, or now"""
+
+    def remove_like(self, post: Post, username: str): ...
+
+    def is_liked(self, post: Post, username: str) -> bool: ...
+
+    def post_likes(
+        self, post: Post, before: Optional[LikeKey], limit: int
+    ) -> LikesPage:
+        """Returns likes of the post older than {before}, by username"""
+
+    def user_likes(
+        self, username: str, before: Optional[LikeKey], limit: int
+    ) -> LikesPage:
+        """Returns likes of the user older than {before}, by post id"""
+
+    def follow(self, follower: str, followee: str): ...
+
+    def unfollow(self, follower: str, followee: str): ...
+
+    def followers(self, username: str) -> Iterable[str]: ...
+
+    def following(self, username: str) -> Iterable[str]: ...
+
+    def count_followers(self, username: str) -> int: ...
+
+    def is_empty(self) -> bool: ...
+
+    def import_batch(self, batch: ImportBatch) -> Imported:
+        """Writes the batch, skipping existing records and missing references
+
+        Returns numbers of written records, and the written posts.
+        """
+
+    def stats(self) -> dict[str, float]: ...
+
+    def exclusive(self) -> ContextManager[None]:
+        """Excludes other processes sharing the storage"""
+
+    async def sync(self) -> None:
+        """Waits until changes made so far by the current request are durable"""
+
+    def close(self) -> None: ...
+
+
+class _Shard:
+    """Users and their follows, written under the lock of the shard"""
+
+    __slots__ = ("lock", "users", "following", "followers")
+
     def __init__(self):
-        self._storage = {"users": {}}
+        self.lock = threading.RLock()
+        self.users: dict[str, User] = {}
+        self.following: dict[str, set[str]] = {}
+        self.followers: dict[str, set[str]] = {}
+
+
+class Database:
+    """In-memory storage partitioned into shards by username
+
+    Writes take the lock of the shard of the user they change; posts and
+    their likes belong to the shard of the author. Reads take no locks, or
+    only the lock of the shard being read, so they never wait for writes to
+    other shards. Likes are queued and applied in batches (see app.likes).
+    """
+
+    def __init__(self, shards: int = DB_SHARDS):
+        self._shards = [_Shard() for _ in range(shards)]
+        # Posts are found by id alone, so they are indexed outside of shards
+        self._posts: dict[str, Post] = {}
+        # Users are interned as small integer ids, which are stored in likes
+        self._user_ids: dict[str, int] = {}
+        self._usernames: list[str] = []
+        # Posts liked by every user id. Logs are changed together with likes
+        # of posts, which are applied one batch at a time or by imports
+        # holding all locks, so writers of a log never run concurrently
+        self._liked: dict[int, LikeLog] = {}
+        self._intern_lock = threading.Lock()
+        # Versions are taken from a single counter, so replaced records never
+        # get a version which was already used. They are not kept between
+        # restarts, so every run has a new epoch
+        self._versions = itertools.count(1)
+        self.epoch = secrets.token_hex(8)
+        self.journal: Optional[Journal] = None
+        self.on_likes: Optional[Callable[[dict[str, int]], None]] = None
+        # Number of likes of all posts, changed under shard locks
+        self._like_total = 0
+        self._likes = LikeQueue(self._apply_likes, LIKE_BATCH_SIZE, LIKE_BATCH_DELAY)
+
+    def _log(self, op: str, **fields: Any) -> None:
+        if self.journal is not None:
+            self.journal.append(op, fields)
+
+    def _shard(self, username: str) -> _Shard:
+        return self._shards[hash(username) % len(self._shards)]
+
+    @contextlib.contextmanager
+    def _locked(self, *usernames: str) -> Iterator[None]:
+        # Locks are always taken in the order of shards, so writers which
+        # change several shards never deadlock
+        indexes = sorted({hash(username) % len(self._shards) for username in usernames})
+        with contextlib.ExitStack() as stack:
+            for index in indexes:
+                stack.enter_context(self._shards[index].lock)
+            yield
+
+    @contextlib.contextmanager
+    def locked(self) -> Iterator[None]:
+        """Blocks all writes, so that the whole database is seen consistent"""
+        with contextlib.ExitStack() as stack:
+            for shard in self._shards:
+                stack.enter_context(shard.lock)
+            yield
+
+    def users(self) -> Iterator[tuple[str, User]]:
+        for shard in self._shards:
+            yield from shard.users.items()
+
+    def posts(self) -> Iterable[Post]:
+        return self._posts.values()
+
+    def follows(self) -> Iterator[tuple[str, Iterable[str]]]:
+        for shard in self._shards:
+            yield from shard.following.items()
+
+    def copy_shards(self) -> Iterator[ShardCopy]:
+        """Yields copies of shards, holding the lock of one shard at a time
+
+        Writes to other shards go on while a shard is copied, so copies of
+        different shards are not consistent with each other.
+        """
+        for shard in self._shards:
+            with shard.lock:
+                users = list(shard.users.items())
+                posts = [
+                    (post, list(self.likers(post)))
+                    for _, user in users
+                    for post in reversed(list(user.posts.newest()))
+                ]
+                following = [
+                    (follower, list(followees))
+                    for follower, followees in shard.following.items()
+                    if followees
+                ]
+            yield ShardCopy(users, posts, following)
 
     def find_user(self, username: str) -> Optional[User]:
-        return self._storage["users"].get(username)
+        return self._shard(username).users.get(username)
+
+    def find_post(self, post_id: str) -> Optional[Post]:
+        return self._posts.get(post_id)
+
+    def followers(self, username: str) -> Iterable[str]:
+        shard = self._shard(username)
+        with shard.lock:
+            return tuple(shard.followers.get(username, ()))
+
+    def following(self, username: str) -> Iterable[str]:
+        shard = self._shard(username)
+        with shard.lock:
+            return tuple(shard.following.get(username, ()))
+
+    def count_followers(self, username: str) -> int:
+        return len(self._shard(username).followers.get(username, ()))
+
+    def is_empty(self) -> bool:
+        return not any(shard.users for shard in self._shards)
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "users": sum(len(shard.users) for shard in self._shards),
+            "posts": len(self._posts),
+            "likes": self._like_total,
+            **self._likes.stats(),
+        }
+
+    def exclusive(self) -> ContextManager[None]:
+        # Data in memory is never shared with other processes
+        return contextlib.nullcontext()
+
+    async def sync(self) -> None:
+        if self.journal is not None:
+            self._likes.flush()
+            await self.journal.sync()
+
+    def flush_likes(self) -> None:
+        self._likes.flush()
+
+    def close(self) -> None:
+        self._likes.close()
 
     def save_user(self, key: str, user: User):
-        self._storage["users"][key] = user
+        key = sys.intern(key)
+        with self._shard(key).lock:
+            self._save_user(key, user)
+
+    def add_user(self, key: str, user: User) -> bool:
+        key = sys.intern(key)
+        with self._shard(key).lock:
+            if key in self._shard(key).users:
+                return False
+            self._save_user(key, user)
+            return True
+
+    def _save_user(self, key: str, user: User) -> None:
+        user.version = next(self._versions)
+        self._shard(key).users[key] = user
+        with self._intern_lock:
+            if key not in self._user_ids:
+                self._user_ids[key] = len(self._usernames)
+                self._usernames.append(key)
+        self._log(
+            "save_user",
+            key=key,
+            username=user.username,
+            password_hash=user.password_hash,
+            full_name=user.full_name,
+        )
 
     def save_post(self, post: Post):
         author = post.author
-        id_ = uuid4().hex
-        post.id = id_
-        author.posts.insert(0, post)
-        author.posts.sort(key=lambda p: p.created_at, reverse=True)
+        with self._shard(author.username.lower()).lock:
+            if not post.id:
+                post.id = uuid4().hex
+            self._posts[post.id] = post
+            author.posts.add(post)
+            post.version = author.version = next(self._versions)
+            self._log(
+                "save_post",
+                id=post.id,
+                author=author.username.lower(),
+                content=post.content,
+                created_at=post.created_at.isoformat(),
+            )
+
+    def import_batch(self, batch: ImportBatch) -> Imported:
+        users = likes = follows = 0
+        posts = []
+        counts = {}
+        # Shard locks are reentrant, so the batch is written under them at once
+        with self.locked():
+            for key, user in batch.users:
+                if self.find_user(key) is None:
+                    self.save_user(key, user)
+                    users += 1
+            for post in batch.posts:
+                if post.id not in self._posts:
+                    self.save_post(post)
+                    posts.append(post)
+            # Likes are written in order of time, so that most of them are
+            # appended to logs of likes
+            for post_id, username, liked_at in sorted(batch.likes, key=itemgetter(2)):
+                post = self._posts.get(post_id)
+                user_id = self._user_ids.get(username)
+                if user_id is None or post is None:
+                    continue
+                if self._like(post, user_id, True, liked_at):
+                    self._bump_like_versions(post, username)
+                    self._log("like", post=post_id, username=username, at=liked_at)
+                    counts[post_id] = len(post.likes)
+                    likes += 1
+            self._like_total += likes
+            for follower, followee in batch.follows:
+                if self.find_user(follower) is None or self.find_user(followee) is None:
+                    continue
+                if followee not in self._shard(follower).following.get(follower, ()):
+                    self.follow(follower, followee)
+                    follows += 1
+        if counts and self.on_likes is not None:
+            self.on_likes(counts)
+        return Imported(users, posts, likes, follows)
+
+    def add_like(self, post: Post, username: str, liked_at: Optional[float] = None):
+        self._queue_like(True, post, username, liked_at)
+
+    def remove_like(self, post: Post, username: str):
+        self._queue_like(False, post, username)
+
+    def _queue_like(
+        self, like: bool, post: Post, username: str, at: Optional[float] = None
+    ) -> None:
+        liker = self.find_user(username)
+        if liker is None:
+            return
+        self._likes.put(like, post.id, username, at)
+        # is_liked flags seen by the liker change before the like is applied
+        liker.likes_version = next(self._versions)
+
+    def _apply_likes(self, intents: list[Intent]) -> None:
+        by_shard: dict[int, list[tuple[bool, Post, str, float]]] = {}
+        for like, post_id, username, at in intents:
+            post = self._posts.get(post_id)
+            if post is not None:
+                index = hash(post.author.username.lower()) % len(self._shards)
+                by_shard.setdefault(index, []).append((like, post, username, at))
+        counts = {}
+        for index, likes in by_shard.items():
+            with self._shards[index].lock:
+                for like, post, username, at in likes:
+                    if self._like(post, self._user_ids[username], like, at):
+                        self._like_total += 1 if like else -1
+                        self._bump_like_versions(post, username)
+                        counts[post.id] = len(post.likes)
+                    if like:
+                        self._log("like", post=post.id, username=username, at=at)
+                    else:
+                        self._log("unlike", post=post.id, username=username)
+        if counts and self.on_likes is not None:
+            self.on_likes(counts)
+
+    def _like(self, post: Post, user_id: int, like: bool, at: float) -> bool:
+        """Changes likes of the post and of the user, returns whether they changed"""
+        assert isinstance(post.likes, LikeLog)
+        if not like:
+            if not post.likes.discard(user_id):
+                return False
+            self._liked[user_id].discard(post.id)
+            return True
+        if not post.likes.add(user_id, at):
+            return False
+        self._liked.setdefault(user_id, LikeLog()).add(post.id, at)
+        return True
+
+    def _bump_like_versions(self, post: Post, username: str) -> None:
+        version = next(self._versions)
+        post.version = post.author.version = version
+        liker = self.find_user(username)
+        if liker is not None:
+            liker.likes_version = version
+
+    def is_liked(self, post: Post, username: str) -> bool:
+        pending = self._likes.pending(post.id, username)
+        if pending is not None:
+            return pending
+        user_id = self._user_ids.get(username)
+        return user_id is not None and user_id in post.likes
+
+    def likers(self, post: Post) -> Iterator[tuple[str, float]]:
+        """Yields usernames of likers and times of their likes, oldest first"""
+        assert isinstance(post.likes, LikeLog)
+        return ((self._usernames[user_id], at) for at, user_id in post.likes)
+
+    def post_likes(
+        self, post: Post, before: Optional[LikeKey], limit: int
+    ) -> LikesPage:
+        assert isinstance(post.likes, LikeLog)
+        keys, more = post.likes.newest(None if before is None else before[0], limit)
+        return LikesPage([(at, self._usernames[user_id]) for at, user_id in keys], more)
+
+    def user_likes(
+        self, username: str, before: Optional[LikeKey], limit: int
+    ) -> LikesPage:
+        log = self._liked.get(self._user_ids.get(username, -1))
+        if log is None:
+            return LikesPage([], False)
+        keys, more = log.newest(None if before is None else before[0], limit)
+        return LikesPage(keys, more)
+
+    def follow(self, follower: str, followee: str):
+        with self._locked(follower, followee):
+            self._shard(follower).following.setdefault(follower, set()).add(followee)
+            self._shard(followee).followers.setdefault(followee, set()).add(follower)
+            self._log("follow", follower=follower, followee=followee)
+
+    def unfollow(self, follower: str, followee: str):
+        with self._locked(follower, followee):
+            self._shard(follower).following.get(follower, set()).discard(followee)
+            self._shard(followee).followers.get(followee, set()).discard(follower)
+            self._log("unfollow", follower=follower, followee=followee)
+
+
+def _create_database() -> Storage:
+    if STORAGE == "sqlite":
+        from .sqlitedb import SqliteDatabase
+
+        return SqliteDatabase(SQLITE_PATH)
+    if STORAGE != "memory":
+        raise ValueError(f"Unknown storage backend: {STORAGE}")
+    return Database()
 
 
-database = Database()
+database = _create_database()
@@ -0,0 +1,66 @@
+"""Demo data loaded into empty storage at startup (see SEED in app.config)
+
+Three users, user_1, user_2 and user_3, with password 12345678, a few posts
+and random likes. The password is hashed once for all users.
+"""
+
+import json
+import random
+from typing import Iterator
+from uuid import uuid4
+
+from passlib.hash import argon2
+
+
+def demo_lines() -> Iterator[str]:
+    """Returns demo records as JSON lines for app.bulk"""
+    password_hash = argon2.hash("12345678")
+    texts = [
+        'Is history repeating itself...?',
+        "Damn, it's hard to wrap presents when you're drunk.",
+        "Don't Look a Gift Horse In The Mouth",
+        "Shot In the Dark",
+        "Let Her Rip",
+        "He excelled at firing people nicely.",
+        "I don’t respect anybody who can’t tell the difference between Pepsi and Coke.",
+        "We have a lot of rain in June.",
+        "I may struggle with geography, but I'm sure I'm somewhere around here."
+        "He wasn't bitter that she had moved on but from the radish.",
+        "Barking dogs and screaming toddlers turn friendly neighbors into cranky enemies."
+        "He uses onomatopoeia as a weapon of mental destruction.",
+        "Every manager should be able to recite at least ten nursery rhymes backward.",
+        "Make a sandwich blindfolded, then take a bite."
+        "You Can't Teach an Old Dog New Tricks",
+        "Off One's Base",
+        "Mountain Out of a Molehill",
+        "There's a message for you if you look up.",
+        "It must be five o'clock somewhere.",
+    ]
+    users = [f"user_{i + 1}" for i in range(3)]
+    for i, username in enumerate(users):
+        yield json.dumps(
+            {
+                "type": "user",
+                "username": username,
+                "password_hash": password_hash,
+                "full_name": random.choice([f"User {i + 1}", None]),
+            }
+        )
+    posts = [uuid4().hex for _ in texts]
+    for post_id, text in zip(posts, texts):
+        yield json.dumps(
+            {
+                "type": "post",
+                "id": post_id,
+                "author": random.choice(users),
+                "content": text,
+            }
+        )
+    for _ in range(len(texts) * 2):
+        yield json.dumps(
+            {
+                "type": "like",
+                "post_id": random.choice(posts),
+                "username": random.choice(users),
+            }
+        )
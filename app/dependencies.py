@@ -1,15 +1,23 @@
 from typing import Annotated, Optional
-from fastapi import Depends
+from fastapi import Depends, Request
 from fastapi.security import HTTPBasicCredentials, HTTPBasic
 
-from .logic import verify_password
+from .logic import verify_password_async
 
-_security = HTTPBasic()
+# Credentials are optional, endpoints which require them respond with 401
+_security = HTTPBasic(auto_error=False)
 
 
-def authenticated_username(
-    credentials: Annotated[HTTPBasicCredentials, Depends(_security)],
+async def client_address(request: Request) -> Optional[str]:
+    return request.client.host if request.client is not None else None
+
+
+async def authenticated_username(
+    credentials: Annotated[Optional[HTTPBasicCredentials], Depends(_security)],
+    client: Annotated[Optional[str], Depends(client_address)],
 ) -> Optional[str]:
-    if verify_password(credentials.username, credentials.password):
+    if credentials is None:
+        return None
+    if await verify_password_async(credentials.username, credentials.password, client):
         return credentials.username
     return None
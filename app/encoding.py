@@ -0,0 +1,156 @@
+"""Negotiated encodings of responses
+
+Responses are sent as MessagePack instead of JSON to clients accepting
+application/msgpack, and compressed with brotli or gzip for clients
+accepting them, if the body has at least COMPRESSION_MIN_SIZE bytes.
+MessagePack and brotli are used only if the msgpack and brotli packages are
+installed (the encodings extra). Streamed responses, such as the event
+stream, are sent as is.
+
+MessagePack is encoded straight from the data: pre-encoded posts in the
+format selected for the request (see app.serialization), and models with
+FormattedResponse. Only JSON bodies rendered elsewhere, such as errors, are
+converted by the middleware.
+
+Every response varies by Accept-Encoding, and by Accept if MessagePack is
+available, whether it was transformed or not, so caches never serve one
+representation for another. ETags of MessagePack and compressed responses are
+made weak, as their bytes differ from the ones of the JSON representation, but
+they remain valid for If-None-Match.
+"""
+
+import gzip
+import json
+from typing import Any, Optional
+
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+
+from .config import COMPRESSION_MIN_SIZE
+from .serialization import JSON, MSGPACK, formatted, response_format
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_GZIP_LEVEL = 6
+_BROTLI_QUALITY = 5
+_MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+_COMPRESSIBLE = ("application/json", "application/msgpack", "text/")
+
+
+def _qualities(header: str) -> dict[str, float]:
+    """Parses a header like Accept-Encoding into values and their q weights"""
+    result = {}
+    for item in header.split(","):
+        value, *params = item.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, number = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        if value.strip():
+            result[value.strip().lower()] = quality
+    return result
+
+
+def _coding(accept_encoding: str) -> Optional[str]:
+    qualities = _qualities(accept_encoding)
+    candidates = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best = max(candidates, key=lambda coding: qualities.get(coding, 0.0))
+    return best if qualities.get(best, 0.0) > 0 else None
+
+
+def _wants_msgpack(accept: str) -> bool:
+    if MSGPACK is None:
+        return False
+    qualities = _qualities(accept)
+    quality = max(qualities.get(media_type, 0.0) for media_type in _MSGPACK_TYPES)
+    return quality > 0 and quality >= qualities.get("application/json", 0.0)
+
+
+def _compress(body: bytes, coding: str) -> bytes:
+    if coding == "br":
+        return brotli.compress(body, quality=_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=_GZIP_LEVEL, mtime=0)
+
+
+class FormattedResponse(JSONResponse):
+    """Renders content as JSON, or in the format the client asked for"""
+
+    def render(self, content: Any) -> bytes:
+        format = response_format()
+        self.media_type = format.media_type
+        return format.render(content)
+
+
+class EncodingMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_headers = Headers(scope=scope)
+        to_msgpack = _wants_msgpack(request_headers.get("accept", ""))
+        coding = _coding(request_headers.get("accept-encoding", ""))
+
+        start = None
+        # Whether messages are sent as they are, once the start was sent
+        passing = False
+
+        async def send_encoded(message):
+            nonlocal start, passing
+            if message["type"] == "http.response.start":
+                start = message
+                headers = MutableHeaders(scope=start)
+                headers.add_vary_header("Accept-Encoding")
+                if MSGPACK is not None:
+                    headers.add_vary_header("Accept")
+                if not to_msgpack and coding is None:
+                    passing = True
+                    await send(start)
+                return
+            if passing or message["type"] != "http.response.body":
+                await send(message)
+                return
+            if message.get("more_body", False):
+                passing = True
+                await send(start)
+                await send(message)
+                return
+            headers = MutableHeaders(scope=start)
+            body = message.get("body", b"")
+            changed = False
+            media_type = headers.get("content-type", "")
+            if to_msgpack and body and media_type.startswith("application/json"):
+                body = MSGPACK.render(json.loads(body))
+                headers["content-type"] = media_type = MSGPACK.media_type
+                changed = True
+            if (
+                coding is not None
+                and len(body) >= self.minimum_size
+                and "content-encoding" not in headers
+                and media_type.startswith(_COMPRESSIBLE)
+            ):
+                body = _compress(body, coding)
+                headers["content-encoding"] = coding
+                changed = True
+            if changed:
+                headers["content-length"] = str(len(body))
+                message = {**message, "body": body}
+            etag = headers.get("etag")
+            weak = etag is None or etag.startswith("W/")
+            if (changed or to_msgpack) and not weak:
+                headers["etag"] = "W/" + etag
+            await send(start)
+            await send(message)
+
+        with formatted(MSGPACK if to_msgpack else JSON):
+            await self.app(scope, receive, send_encoded)
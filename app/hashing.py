@@ -0,0 +1,103 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from passlib.hash import argon2
+
+from .admission import Overloaded
+from .config import HASH_QUEUE_SIZE, HASH_WORKERS
+from .metrics import argon2_duration, argon2_wait, auth_rejections
+
+_executor: Optional[ProcessPoolExecutor] = None
+_slots: Optional[tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+
+
+def _hash(password: str) -> str:
+    return argon2.hash(password)
+
+
+def _verify(password: str, password_hash: bytes) -> bool:
+    return argon2.verify(password, password_hash)
+
+
+_OPS = {_hash: "hash", _verify: "verify"}
+
+
+def _timed(fn, *args):
+    # Runs in hashing processes, so the time is recorded by the caller
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def _pool() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=HASH_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def _semaphore() -> asyncio.Semaphore:
+    # Semaphore is recreated whenever the running loop changes, as asyncio
+    # primitives can not be shared between loops
+    global _slots
+    loop = asyncio.get_running_loop()
+    if _slots is None or _slots[0] is not loop:
+        _slots = (loop, asyncio.Semaphore(HASH_WORKERS + HASH_QUEUE_SIZE))
+    return _slots[1]
+
+
+def _run_sync(fn, *args):
+    result, elapsed = _timed(fn, *args)
+    argon2_duration.observe(elapsed, _OPS[fn])
+    return result
+
+
+async def _run(fn, *args):
+    if HASH_WORKERS <= 0:
+        return _run_sync(fn, *args)
+    started = time.perf_counter()
+    semaphore = _semaphore()
+    # Slots cover running hashes and at most HASH_QUEUE_SIZE queued ones, so
+    # nothing waits beyond them
+    if semaphore.locked():
+        auth_rejections.inc("hashing")
+        raise Overloaded(503, "Too many password hashes", 1)
+    async with semaphore:
+        result, elapsed = await asyncio.get_running_loop().run_in_executor(
+            _pool(), _timed, fn, *args
+        )
+    argon2_duration.observe(elapsed, _OPS[fn])
+    argon2_wait.observe(time.perf_counter() - started - elapsed, _OPS[fn])
+    return result
+
+
+async def hash_password(password: str) -> str:
+    """Hashes password in the process pool without blocking event loop
+
+    Raises Overloaded if HASH_QUEUE_SIZE hashes are queued already, the same
+    as verify_hash.
+    """
+    return await _run(_hash, password)
+
+
+async def verify_hash(password: str, password_hash: bytes) -> bool:
+    """Verifies password in the process pool without blocking event loop"""
+    return await _run(_verify, password, password_hash)
+
+
+def hash_password_sync(password: str) -> str:
+    """Hashes password in the calling thread"""
+    return _run_sync(_hash, password)
+
+
+def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
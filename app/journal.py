@@ -0,0 +1,366 @@
+"""Write-ahead journal and snapshots for the in-memory database
+
+Every mutation of the database is appended to the journal as a JSON line
+with a sequence number. Snapshots of the whole database are written in the
+background; each snapshot starts a new journal segment, so older segments can
+be removed once the snapshot is durable. On startup the latest snapshot is
+loaded and only journal records newer than it are replayed.
+
+Snapshots do not stop writes: the segment is rotated first, and then shards
+of the database are copied one at a time, each under its own lock. So a
+snapshot may include changes which were journaled after its sequence number;
+replaying a record is idempotent, so they are simply applied again.
+
+The directory is locked, as only one process may journal into it. Several
+worker processes need a shared storage backend instead (see app.changes).
+"""
+
+import asyncio
+import fcntl
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import IO, Any, Iterator, Optional
+
+from .db import Database, Post, User
+
+FSYNC_ALWAYS = "always"
+FSYNC_BATCH = "batch"
+FSYNC_INTERVAL = "interval"
+
+_SNAPSHOT = "snapshot-{:020d}.jsonl"
+_SEGMENT = "journal-{:020d}.jsonl"
+
+
+def _seq_of(path: Path) -> int:
+    return int(path.stem.split("-")[1])
+
+
+def _read(path: Path) -> Iterator[dict[str, Any]]:
+    with path.open(encoding="utf-8") as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # Torn write at the end of the file after a crash
+                return
+
+
+def _apply(database: Database, record: dict[str, Any]) -> None:
+    op = record["op"]
+    if op == "save_user":
+        database.save_user(
+            record["key"],
+            User(
+                username=record["username"],
+                password_hash=record["password_hash"],
+                full_name=record["full_name"],
+            ),
+        )
+    elif op == "save_post":
+        author = database.find_user(record["author"])
+        if author is not None and database.find_post(record["id"]) is None:
+            database.save_post(
+                Post(
+                    id=record["id"],
+                    author=author,
+                    content=record["content"],
+                    created_at=datetime.fromisoformat(record["created_at"]),
+                )
+            )
+    elif op in ("like", "unlike", "likes"):
+        post = database.find_post(record["post"])
+        if post is None:
+            return
+        if op == "like":
+            database.add_like(post, record["username"], record.get("at"))
+        elif op == "unlike":
+            database.remove_like(post, record["username"])
+        else:
+            # Journals written before likes were timestamped have no times
+            times = record.get("times") or [None] * len(record["usernames"])
+            for username, at in zip(record["usernames"], times):
+                database.add_like(post, username, at)
+    elif op == "follow":
+        database.follow(record["follower"], record["followee"])
+    elif op == "unfollow":
+        database.unfollow(record["follower"], record["followee"])
+    elif op == "follows":
+        for followee in record["followees"]:
+            database.follow(record["follower"], followee)
+    else:
+        raise ValueError(f"Unknown journal operation: {op}")
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class Journal:
+    def __init__(
+        self,
+        directory: Path,
+        database: Database,
+        seq: int,
+        snapshot_seq: int,
+        fsync: str,
+        fsync_interval: float,
+        snapshot_interval: float,
+        lock_file: Optional[IO[str]] = None,
+    ):
+        if fsync not in (FSYNC_ALWAYS, FSYNC_BATCH, FSYNC_INTERVAL):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self._directory = directory
+        self._database = database
+        self._fsync = fsync
+        self._fsync_interval = fsync_interval
+        self._snapshot_interval = snapshot_interval
+        self._lock_file = lock_file
+        self._seq = seq
+        self._synced = seq
+        self._snapshot_seq = snapshot_seq
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._waiters: list[tuple[int, asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._closed = threading.Event()
+        self._file = self._open_segment(seq + 1)
+        self._threads = [
+            threading.Thread(target=self._snapshot_loop, name="journal-snapshot")
+        ]
+        if fsync != FSYNC_ALWAYS:
+            self._threads.append(
+                threading.Thread(target=self._flush_loop, name="journal-fsync")
+            )
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def _open_segment(self, first_seq: int):
+        # Existing segment may only hold a torn record which was not replayed
+        return (self._directory / _SEGMENT.format(first_seq)).open(
+            "w", encoding="utf-8"
+        )
+
+    def append(self, op: str, fields: dict[str, Any]) -> int:
+        with self._lock:
+            self._seq += 1
+            line = json.dumps({"seq": self._seq, "op": op, **fields})
+            self._file.write(line + "\n")
+            if self._fsync == FSYNC_ALWAYS:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._synced = self._seq
+            elif self._fsync == FSYNC_BATCH:
+                self._wakeup.notify()
+            return self._seq
+
+    async def sync(self) -> None:
+        """Waits until every record appended so far is on disk
+
+        Only the batch policy makes callers wait: concurrent callers are
+        released together by a single fsync. The always policy syncs on
+        every append, while the interval policy trades durability of the
+        last interval for latency.
+        """
+        if self._fsync != FSYNC_BATCH:
+            return
+        with self._lock:
+            if self._synced >= self._seq:
+                return
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._waiters.append((self._seq, loop, future))
+            self._wakeup.notify()
+        await future
+
+    def _flush(self) -> None:
+        with self._lock:
+            if self._synced >= self._seq:
+                return
+            target = self._seq
+            self._file.flush()
+            # Duplicate descriptor, so the segment may be rotated while the
+            # fsync below runs without holding the lock
+            fd = os.dup(self._file.fileno())
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        with self._lock:
+            self._synced = max(self._synced, target)
+            self._release_waiters()
+
+    def _release_waiters(self) -> None:
+        waiting = []
+        for seq, loop, future in self._waiters:
+            if seq <= self._synced:
+                loop.call_soon_threadsafe(_resolve, future)
+            else:
+                waiting.append((seq, loop, future))
+        self._waiters = waiting
+
+    def _flush_loop(self) -> None:
+        while not self._closed.is_set():
+            if self._fsync == FSYNC_BATCH:
+                with self._lock:
+                    while self._synced >= self._seq and not self._closed.is_set():
+                        self._wakeup.wait()
+            else:
+                self._closed.wait(self._fsync_interval)
+            self._flush()
+
+    def _snapshot_loop(self) -> None:
+        while not self._closed.wait(self._snapshot_interval):
+            if self._seq > self._snapshot_seq:
+                self.snapshot()
+
+    def snapshot(self) -> None:
+        """Writes compacted snapshot and removes journal segments before it
+
+        Writers wait only while the shard they write to is copied.
+        """
+        with self._lock:
+            seq = self._seq
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = self._open_segment(seq + 1)
+            self._synced = seq
+            self._release_waiters()
+        # Every change up to {seq} was applied before it was journaled, under
+        # the lock of its shard, so the copies include it
+        users, posts, following = [], [], []
+        for copy in self._database.copy_shards():
+            users += copy.users
+            posts += copy.posts
+            following += copy.following
+
+        path = self._directory / _SNAPSHOT.format(seq)
+        temporary = path.with_suffix(".tmp")
+        with temporary.open("w", encoding="utf-8") as file:
+            file.write(json.dumps({"seq": seq}) + "\n")
+            for key, user in users:
+                record = {
+                    "op": "save_user",
+                    "key": key,
+                    "username": user.username,
+                    "password_hash": user.password_hash,
+                    "full_name": user.full_name,
+                }
+                file.write(json.dumps(record) + "\n")
+            for post, likes in posts:
+                record = {
+                    "op": "save_post",
+                    "id": post.id,
+                    "author": post.author.username.lower(),
+                    "content": post.content,
+                    "created_at": post.created_at.isoformat(),
+                }
+                file.write(json.dumps(record) + "\n")
+                if likes:
+                    usernames, times = zip(*likes)
+                    record = {
+                        "op": "likes",
+                        "post": post.id,
+                        "usernames": usernames,
+                        "times": times,
+                    }
+                    file.write(json.dumps(record) + "\n")
+            for follower, followees in following:
+                record = {"op": "follows", "follower": follower, "followees": followees}
+                file.write(json.dumps(record) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+        _fsync_directory(self._directory)
+        self._snapshot_seq = seq
+
+        for old in self._directory.glob("snapshot-*.jsonl"):
+            if _seq_of(old) < seq:
+                old.unlink()
+        for old in self._directory.glob("journal-*.jsonl"):
+            if _seq_of(old) <= seq:
+                old.unlink()
+
+    def close(self) -> None:
+        self._closed.set()
+        with self._lock:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._synced = self._seq
+            self._release_waiters()
+        if self._lock_file is not None:
+            self._lock_file.close()
+
+
+def _fsync_directory(directory: Path) -> None:
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def open_journal(
+    database: Database,
+    directory: str,
+    fsync: str = FSYNC_BATCH,
+    fsync_interval: float = 1.0,
+    snapshot_interval: float = 300.0,
+) -> Journal:
+    """Restores database from {directory} and starts journaling into it"""
+    path = Path(directory)
+    path.mkdir(parents=True, exist_ok=True)
+    lock_file = (path / "lock").open("w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        raise RuntimeError(
+            f"{directory} is used by another process, several workers need"
+            " KPITTER_STORAGE=sqlite"
+        ) from None
+
+    snapshot_seq = 0
+    snapshots = sorted(path.glob("snapshot-*.jsonl"), key=_seq_of)
+    if snapshots:
+        records = _read(snapshots[-1])
+        snapshot_seq = next(records)["seq"]
+        for record in records:
+            _apply(database, record)
+
+    seq = snapshot_seq
+    for segment in sorted(path.glob("journal-*.jsonl"), key=_seq_of):
+        for record in _read(segment):
+            if record["seq"] > seq:
+                _apply(database, record)
+                seq = record["seq"]
+
+    database.flush_likes()
+    journal = Journal(
+        path,
+        database,
+        seq=seq,
+        snapshot_seq=snapshot_seq,
+        fsync=fsync,
+        fsync_interval=fsync_interval,
+        snapshot_interval=snapshot_interval,
+        lock_file=lock_file,
+    )
+    database.journal = journal
+    return journal
+
+
+def close_journal(database: Database, journal: Optional[Journal]) -> None:
+    if journal is not None:
+        database.flush_likes()
+        journal.close()
+        database.journal = None
@@ -0,0 +1,169 @@
+"""Queue of like and unlike intents applied to storage in batches
+
+Liking a post only queues the intent. Intents are applied in batches of up to
+LIKE_BATCH_SIZE, at least every LIKE_BATCH_DELAY seconds, by a background
+thread or by the writer which fills the batch. Applying is idempotent, and
+only the latest intent of a user for a post is applied, so a storm of likes
+costs one storage write per batch for every distinct liker.
+
+Until its batch is applied, the intent is visible through pending(), so that
+users see their own likes at once, and when_applied() tells when it is written.
+Numbers of likes change when the batch is applied. Every intent carries the
+time it was made, which becomes the time of the like, and intents are applied
+in the order of the latest intent of every user for a post. A batch which
+fails to be applied is dropped, and the queue goes on with later intents.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Like or unlike, post id, username and time of the intent
+Intent = tuple[bool, str, str, float]
+
+
+class LikeQueue:
+    def __init__(
+        self,
+        apply: Callable[[list[Intent]], None],
+        batch_size: int,
+        batch_delay: float,
+    ):
+        self._apply = apply
+        self._batch_size = batch_size
+        self._batch_delay = batch_delay
+        self._queue: list[tuple[Intent, int]] = []
+        # Latest queued intent and its number, for every post and user
+        self._latest: dict[tuple[str, str], tuple[bool, int]] = {}
+        self._seq = 0
+        # Number of the last applied intent, and futures of when_applied() with
+        # numbers of intents they wait for
+        self._applied_seq = 0
+        self._waiters: list[tuple[int, Future[None]]] = []
+        self._queued_at: Optional[float] = None
+        self._lock = threading.Lock()
+        # Number of intents which are not applied yet. It is decreased only
+        # after the batch is applied, so flush() waits for batches in progress
+        self._unapplied = 0
+        self._flush_lock = threading.Lock()
+        self.batches = 0
+        self.applied = 0
+        self._closed = threading.Event()
+        self._thread = threading.Thread(
+            target=self._flush_loop, name="likes", daemon=True
+        )
+        self._thread.start()
+
+    def put(
+        self, like: bool, post_id: str, username: str, at: Optional[float] = None
+    ) -> int:
+        """Queues the intent and returns its number"""
+        with self._lock:
+            # The time is taken under the lock, so queued intents are ordered
+            if at is None:
+                at = time.time()
+            self._seq += 1
+            seq = self._seq
+            self._queue.append(((like, post_id, username, at), seq))
+            self._latest[post_id, username] = (like, seq)
+            if self._queued_at is None:
+                self._queued_at = time.monotonic()
+            self._unapplied += 1
+            full = len(self._queue) >= self._batch_size
+        if full:
+            self.flush()
+        return seq
+
+    def pending(self, post_id: str, username: str) -> Optional[bool]:
+        """Returns latest intent of user which is not applied yet, if any"""
+        intent = self._latest.get((post_id, username))
+        return None if intent is None else intent[0]
+
+    def when_applied(self, seq: int) -> Future[None]:
+        """Returns future which is done when intents up to {seq} are applied
+
+        Unlike flush(), it does not apply a batch early, so that intents of
+        concurrent writers waiting for them are applied together.
+        """
+        future: Future[None] = Future()
+        with self._lock:
+            if seq > self._applied_seq:
+                self._waiters.append((seq, future))
+                return future
+        future.set_result(None)
+        return future
+
+    def flush(self) -> None:
+        """Applies queued intents, waiting for batches being applied"""
+        if not self._unapplied:
+            return
+        with self._flush_lock:
+            with self._lock:
+                queue, self._queue = self._queue, []
+                self._queued_at = None
+            if not queue:
+                return
+            latest: dict[tuple[str, str], Intent] = {}
+            for intent, _ in queue:
+                # Moved to the end, so intents are applied in order of time
+                latest.pop(intent[1:3], None)
+                latest[intent[1:3]] = intent
+            try:
+                self._apply(list(latest.values()))
+            except BaseException as error:
+                # The batch is dropped, so that its intents are not reported
+                # as pending forever, and waiters for it fail
+                self._settle(queue)
+                for future in self._done(queue[-1][1]):
+                    future.set_exception(error)
+                raise
+            self._settle(queue)
+            with self._lock:
+                self.batches += 1
+                self.applied += len(latest)
+            for future in self._done(queue[-1][1]):
+                future.set_result(None)
+
+    def _settle(self, queue: list[tuple[Intent, int]]) -> None:
+        """Removes intents of the batch from pending ones"""
+        with self._lock:
+            for (_, post_id, username, _), seq in queue:
+                if self._latest.get((post_id, username), (None, 0))[1] == seq:
+                    del self._latest[post_id, username]
+            self._unapplied -= len(queue)
+            self._applied_seq = queue[-1][1]
+
+    def _done(self, seq: int) -> list[Future[None]]:
+        """Removes waiters for intents up to number {seq}, and returns them"""
+        with self._lock:
+            done = [future for last, future in self._waiters if last <= seq]
+            self._waiters = [waiter for waiter in self._waiters if waiter[0] > seq]
+        return done
+
+    def _flush_loop(self) -> None:
+        while not self._closed.wait(self._batch_delay):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to apply a batch of likes")
+
+    def close(self) -> None:
+        self._closed.set()
+        self._thread.join()
+        self.flush()
+
+    def __len__(self) -> int:
+        return self._unapplied
+
+    def stats(self) -> dict[str, float]:
+        queued_at = self._queued_at
+        return {
+            "like_queue_depth": self._unapplied,
+            "like_queue_lag": 0.0 if queued_at is None else time.monotonic() - queued_at,
+            "like_batches": self.batches,
+            "likes_applied": self.applied,
+        }
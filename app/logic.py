@@ -1,18 +1,46 @@
+import base64
+import binascii
+import hashlib
 from datetime import datetime
-from typing import Optional
-from passlib.hash import argon2
+from typing import Iterable, NamedTuple, Optional
 
-from .db import Post, User, database
-from .models import CreateUserModel, PostModel, UserModel, CreatePostModel
+from .admission import admit, verification
+from .cache import credential_cache
+from .changes import catch_up
+from .db import LikeKey, Post, PostKey, User, database, post_key
+from .hashing import hash_password, verify_hash
+from .models import CreateUserModel, LikerModel, UserModel, CreatePostModel
+from .pubsub import Subscription, author_topic, post_topic, pubsub
+from .ranking import RankKey, ranking
+from .search import SearchCursor, search_index
+from .tags import PostIndex, normalize_tag, trending
+from .serialization import response_format
+from .timeline import timelines
 
 
-def verify_password(username: str, password: str) -> bool:
+async def verify_password_async(
+    username: str, password: str, client: Optional[str] = None
+) -> bool:
+    """Verifies password off the event loop
+
+    Raises Overloaded if {client} or the user made too many attempts, or
+    too many verifications are in progress.
+    """
     user = database.find_user(username.lower())
-    return user is not None and argon2.verify(password, user.password_hash)
+    if user is None:
+        return False
+    if credential_cache.check(username.lower(), password, user.password_hash):
+        return True
+    admit(client, username.lower())
+    async with verification():
+        if not await verify_hash(password, user.password_hash):
+            return False
+    credential_cache.add(username.lower(), password, user.password_hash)
+    return True
 
 
 def is_username_available(username: str) -> bool:
-    return username.lower() not in database._storage["users"]
+    return database.find_user(username.lower()) is None
 
 
 def _find_user(username: str) -> Optional[User]:
@@ -30,14 +58,17 @@ def find_user(username: str) -> Optional[UserModel]:
     )
 
 
-def create_user(input: CreateUserModel) -> UserModel:
+def _save_new_user(
+    input: CreateUserModel, password_hash: str
+) -> Optional[UserModel]:
+    """Saves the user unless the username is taken, then returns None"""
     user = User(
         username=input.username,
-        password_hash=argon2.hash(input.password),
+        password_hash=password_hash,
         full_name=input.full_name,
-        posts=[],
     )
-    database.save_user(input.username.lower(), user)
+    if not database.add_user(input.username.lower(), user):
+        return None
     return UserModel(
         username=user.username,
         full_name=user.full_name,
@@ -45,100 +76,539 @@ def create_user(input: CreateUserModel) -> UserModel:
     )
 
 
+async def create_user_async(
+    input: CreateUserModel, client: Optional[str] = None
+) -> Optional[UserModel]:
+    """Creates user hashing password off the event loop
+
+    Returns None if the username was taken while password was being hashed.
+    Raises Overloaded if {client} started too many hashes.
+    """
+    admit(client)
+    password_hash = await hash_password(input.password)
+    return _save_new_user(input, password_hash)
+
+
+def _encode_posts(
+    posts: Iterable[Optional[Post]],
+    current_username: Optional[str],
+    users: Optional[dict[str, bytes]] = None,
+) -> list[bytes]:
+    """Encodes posts matching PostModel, null for missing ones
+
+    Posts are encoded in the format of the current request. If {users} is
+    given, authors are encoded into it by username, and posts refer to them by
+    username only.
+    """
+    format = response_format()
+    viewer = None if current_username is None else current_username.lower()
+    authors: dict[str, bytes] = {}
+    result = []
+    for post in posts:
+        if post is None:
+            result.append(format.null)
+            continue
+        author = authors.get(post.author.username)
+        if author is None:
+            user = format.user(
+                post.author.username, post.author.full_name, len(post.author.posts)
+            )
+            if users is not None:
+                users[post.author.username] = user
+                user = format.string(post.author.username)
+            author = authors[post.author.username] = user
+        result.append(
+            format.posts.encode(
+                post,
+                author,
+                len(post.likes),
+                viewer is not None and database.is_liked(post, viewer),
+            )
+        )
+    return result
+
+
+def _encode_page(
+    posts: Iterable[Optional[Post]], current_username: Optional[str], normalized: bool
+) -> bytes:
+    """Encodes posts as a list of PostModel, or as NormalizedPostsModel"""
+    format = response_format()
+    if not normalized:
+        return format.list(_encode_posts(posts, current_username))
+    users: dict[str, bytes] = {}
+    return format.normalized(_encode_posts(posts, current_username, users), users)
+
+
+class EncodedPost(NamedTuple):
+    id: str
+    author: str
+    body: bytes
+
+
+class PostsPage(NamedTuple):
+    posts: bytes
+    newer: Optional[str]
+    older: Optional[str]
+
+
+def encode_cursor(key: PostKey) -> str:
+    created_at, post_id = key
+    raw = f"{created_at.isoformat()}|{post_id}".encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> Optional[PostKey]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, post_id = raw.decode().split("|")
+        return datetime.fromisoformat(created_at), post_id
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
 def list_user_posts(
-    username: str, current_username: Optional[str] = None, page: int = 1
-) -> list[PostModel]:
+    username: str,
+    current_username: Optional[str] = None,
+    page: Optional[int] = None,
+    limit: int = 10,
+    before: Optional[PostKey] = None,
+    after: Optional[PostKey] = None,
+    normalized: bool = False,
+) -> PostsPage:
+    """Returns page of user posts, newest first
+
+    Posts are selected either by {page} number, or by keyset cursors: {before}
+    selects posts older than given key, {after} selects posts newer than it.
+    Returned page contains cursors for newer and older neighbour pages.
+    """
     user = _find_user(username)
     assert user is not None
     # Unauthenticated users can only see last 10 posts from user
     if current_username is None:
-        page = 1
-    return [
-        PostModel(
-            id=post.id,
-            author=UserModel(
-                username=user.username,
-                full_name=user.full_name,
-                posts=len(user.posts),
-            ),
-            content=post.content,
-            likes=len(post.likes),
-            is_liked=current_username is not None and username.lower() in post.likes,
-            created_at=post.created_at,
-        )
-        for post in user.posts[(page - 1) * 10 : page * 10]
-    ]
+        page, limit, before, after = None, 10, None, None
+    if before is not None:
+        posts = list(user.posts.before(before, limit))
+    elif after is not None:
+        posts = list(user.posts.after(after, limit))
+    else:
+        posts = list(user.posts.newest(offset=((page or 1) - 1) * limit, limit=limit))
+
+    newer = older = None
+    if posts:
+        if user.posts.has_after(post_key(posts[0])):
+            newer = encode_cursor(post_key(posts[0]))
+        if user.posts.has_before(post_key(posts[-1])):
+            older = encode_cursor(post_key(posts[-1]))
+    elif before is not None and user.posts.has_after(before):
+        newer = encode_cursor(before)
+    elif after is not None and user.posts.has_before(after):
+        older = encode_cursor(after)
+
+    return PostsPage(
+        posts=_encode_page(posts, current_username, normalized),
+        newer=newer,
+        older=older,
+    )
+
+
+def encode_rank_cursor(key: RankKey) -> str:
+    likes, timestamp, post_id = key
+    raw = f"{likes}|{timestamp!r}|{post_id}".encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_rank_cursor(cursor: str) -> Optional[RankKey]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        likes, timestamp, post_id = raw.decode().split("|")
+        return int(likes), float(timestamp), post_id
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
 
 
-def create_post(username: str, input: CreatePostModel) -> PostModel:
+def list_top_posts(
+    username: Optional[str],
+    current_username: Optional[str] = None,
+    page: Optional[int] = None,
+    limit: int = 10,
+    before: Optional[RankKey] = None,
+    after: Optional[RankKey] = None,
+    normalized: bool = False,
+) -> PostsPage:
+    """Returns page of posts of the user, or of all users, most liked first
+
+    Pages are selected the same way as by list_user_posts, with cursors of
+    the ranking. Posts of ties are ordered newest first.
+    """
+    catch_up()
+    # Unauthenticated users can only see top 10 posts of a user
+    if current_username is None and username is not None:
+        page, limit, before, after = None, 10, None, None
+    result = ranking.page(
+        None if username is None else username.lower(),
+        limit,
+        offset=((page or 1) - 1) * limit,
+        before=before,
+        after=after,
+    )
+    posts = [database.find_post(post_id) for _, _, post_id in result.keys]
+    newer = older = None
+    if result.keys:
+        if result.higher:
+            newer = encode_rank_cursor(result.keys[0])
+        if result.lower:
+            older = encode_rank_cursor(result.keys[-1])
+    return PostsPage(
+        posts=_encode_page(filter(None, posts), current_username, normalized),
+        newer=newer,
+        older=older,
+    )
+
+
+def create_post(username: str, input: CreatePostModel) -> EncodedPost:
     user = _find_user(username)
     assert user is not None
     post = Post(
         id="",
         author=user,
         content=input.content,
-        likes=set(),
         created_at=datetime.now(),
     )
     database.save_post(post)
-    return PostModel(
-        id=post.id,
-        author=UserModel(
-            username=user.username,
-            full_name=user.full_name,
-            posts=len(user.posts),
-        ),
-        content=post.content,
-        likes=len(post.likes),
-        is_liked=username.lower() in post.likes,
-        created_at=post.created_at,
-    )
+    timelines.on_post(post)
+    search_index.add(post)
+    trending.on_post(post)
+    ranking.add(post)
+    pubsub.publish_post(post)
+    return _encoded_post(post, username)
 
 
 def _find_post(username: str, post_id: str) -> Optional[Post]:
-    user = _find_user(username)
-    if user is None:
+    post = database.find_post(post_id.lower())
+    if post is None or post.author.username.lower() != username.lower():
         return None
-    for post in user.posts:
-        if post.id == post_id.lower():
-            return post
-    return None
+    return post
 
 
-def find_post(
+def _encoded_post(post: Post, current_username: Optional[str]) -> EncodedPost:
+    (body,) = _encode_posts([post], current_username)
+    return EncodedPost(id=post.id, author=post.author.username, body=body)
+
+
+def find_encoded_post(
     username: str, post_id: str, current_username: Optional[str] = None
-) -> Optional[PostModel]:
+) -> Optional[EncodedPost]:
+    post = _find_post(username, post_id)
+    if post is None:
+        return None
+    return _encoded_post(post, current_username)
+
+
+def _like(post: Post, username: str, like: bool) -> None:
+    if like:
+        database.add_like(post, username.lower())
+    else:
+        database.remove_like(post, username.lower())
+
+
+def add_like_to_post(author: str, post_id: str, username: str) -> bool:
+    """Likes the post, returns whether it was found"""
+    post = _find_post(author, post_id)
+    if post is not None:
+        _like(post, username, True)
+    return post is not None
+
+
+def remove_like_from_post(author: str, post_id: str, username: str) -> bool:
+    """Unlikes the post, returns whether it was found"""
+    post = _find_post(author, post_id)
+    if post is not None:
+        _like(post, username, False)
+    return post is not None
+
+
+class LikersPage(NamedTuple):
+    likers: list[LikerModel]
+    older: Optional[str]
+
+
+def encode_like_cursor(key: LikeKey) -> str:
+    liked_at, name = key
+    raw = f"{liked_at!r}|{name}".encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_like_cursor(cursor: str) -> Optional[LikeKey]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        liked_at, name = raw.decode().split("|")
+        return float(liked_at), name
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def list_post_likers(
+    username: str,
+    post_id: str,
+    before: Optional[LikeKey] = None,
+    limit: int = 10,
+) -> Optional[LikersPage]:
+    """Returns page of users who liked the post, most recent likes first
+
+    Returns None if the post does not exist.
+    """
     post = _find_post(username, post_id)
     if post is None:
         return None
-    return PostModel(
-        id=post.id,
-        author=UserModel(
-            username=post.author.username,
-            full_name=post.author.full_name,
-            posts=len(post.author.posts),
-        ),
-        content=post.content,
-        likes=len(post.likes),
-        is_liked=current_username is not None
-        and current_username.lower() in post.likes,
-        created_at=post.created_at,
-    )
-
-
-def add_like_to_post(post: PostModel, username: str) -> None:
+    page = database.post_likes(post, before, limit)
+    likers = []
+    for liked_at, liker in page.keys:
+        user = _find_user(liker)
+        if user is not None:
+            likers.append(
+                LikerModel(
+                    username=user.username,
+                    full_name=user.full_name,
+                    liked_at=datetime.fromtimestamp(liked_at),
+                )
+            )
+    return LikersPage(
+        likers=likers,
+        older=encode_like_cursor(page.keys[-1]) if page.more else None,
+    )
+
+
+def list_liked_posts(
+    username: str,
+    current_username: Optional[str] = None,
+    before: Optional[LikeKey] = None,
+    limit: int = 10,
+    normalized: bool = False,
+) -> PostsPage:
+    """Returns page of posts liked by the user, most recently liked first"""
+    page = database.user_likes(username.lower(), before, limit)
+    posts = [database.find_post(post_id) for _, post_id in page.keys]
+    return PostsPage(
+        posts=_encode_page(filter(None, posts), current_username, normalized),
+        newer=None,
+        older=encode_like_cursor(page.keys[-1]) if page.more else None,
+    )
+
+
+def find_posts(
+    refs: list[tuple[str, str]],
+    current_username: Optional[str] = None,
+    normalized: bool = False,
+) -> bytes:
+    """Returns encoded list of posts for (username, post_id) pairs
+
+    Missing posts are encoded as null.
+    """
+    posts = [_find_post(username, post_id) for username, post_id in refs]
+    return _encode_page(posts, current_username, normalized)
+
+
+def apply_likes(operations: list[tuple[str, str, bool]], username: str) -> list[bool]:
+    """Likes or unlikes posts given as (username, post_id, like) triples
+
+    Returns whether each post was found.
+    """
+    result = []
+    for author, post_id, like in operations:
+        post = _find_post(author, post_id)
+        if post is not None:
+            _like(post, username, like)
+        result.append(post is not None)
+    return result
+
+
+def follow_user(username: str, followee: str) -> None:
+    database.follow(username.lower(), followee.lower())
+    timelines.on_follows_changed(username.lower(), followee.lower())
+
+
+def unfollow_user(username: str, followee: str) -> None:
+    database.unfollow(username.lower(), followee.lower())
+    timelines.on_follows_changed(username.lower(), followee.lower())
+
+
+def list_timeline(
+    username: str,
+    before: Optional[PostKey] = None,
+    limit: int = 10,
+    normalized: bool = False,
+) -> PostsPage:
+    """Returns page of posts by followed users and by the user, newest first"""
+    catch_up()
+    posts, more = timelines.page(username.lower(), before, limit)
+    return PostsPage(
+        posts=_encode_page(posts, username, normalized),
+        newer=None,
+        older=encode_cursor(post_key(posts[-1])) if more else None,
+    )
+
+
+def _indexed_posts(
+    index: PostIndex,
+    name: str,
+    current_username: Optional[str],
+    before: Optional[PostKey],
+    limit: int,
+    normalized: bool,
+) -> PostsPage:
+    catch_up()
+    keys, more = index.before(name, before, limit)
+    posts = [database.find_post(post_id) for _, post_id in keys]
+    return PostsPage(
+        posts=_encode_page(filter(None, posts), current_username, normalized),
+        newer=None,
+        older=encode_cursor(keys[-1]) if more else None,
+    )
+
+
+def list_tag_posts(
+    tag: str,
+    current_username: Optional[str] = None,
+    before: Optional[PostKey] = None,
+    limit: int = 10,
+    normalized: bool = False,
+) -> PostsPage:
+    """Returns page of posts with the hashtag, newest first"""
+    return _indexed_posts(
+        trending.hashtags, normalize_tag(tag), current_username, before, limit, normalized
+    )
+
+
+def list_mentions(
+    username: str,
+    current_username: Optional[str] = None,
+    before: Optional[PostKey] = None,
+    limit: int = 10,
+    normalized: bool = False,
+) -> PostsPage:
+    """Returns page of posts mentioning the user, newest first"""
+    return _indexed_posts(
+        trending.mentions, username.lower(), current_username, before, limit, normalized
+    )
+
+
+def trending_tags(window: str, limit: int = 10) -> list[tuple[str, int]]:
+    """Returns most used hashtags within the window, with estimated counts"""
+    catch_up()
+    return trending.top(window, limit)
+
+
+class SearchResults(NamedTuple):
+    posts: bytes
+    next: Optional[str]
+
+
+def encode_search_cursor(cursor: SearchCursor) -> str:
+    raw = "|".join(map(repr, cursor)).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_search_cursor(cursor: str) -> Optional[SearchCursor]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        now, count, score, number = raw.decode().split("|")
+        return SearchCursor(float(now), int(count), float(score), int(number))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def search_posts(
+    query: str,
+    current_username: Optional[str],
+    limit: int = 10,
+    after: Optional[SearchCursor] = None,
+    normalized: bool = False,
+) -> SearchResults:
+    """Returns posts matching the query, best matching and most recent first"""
+    post_ids, cursor = search_index.search(query, limit, after)
+    posts = [database.find_post(post_id) for post_id in post_ids]
+    return SearchResults(
+        posts=_encode_page(filter(None, posts), current_username, normalized),
+        next=None if cursor is None else encode_search_cursor(cursor),
+    )
+
+
+def stream_topics(authors: list[str], post_ids: list[str]) -> Optional[list[str]]:
+    """Returns topics of new posts and likes of authors, and of likes of posts
+
+    Returns None if any of the authors or posts does not exist.
+    """
+    if any(_find_user(author) is None for author in authors):
+        return None
+    if any(database.find_post(post_id.lower()) is None for post_id in post_ids):
+        return None
+    return [author_topic(author) for author in authors] + [
+        post_topic(post_id) for post_id in post_ids
+    ]
+
+
+def subscribe(topics: list[str]) -> Subscription:
+    return pubsub.subscribe(topics)
+
+
+def unsubscribe(subscription: Subscription) -> None:
+    pubsub.unsubscribe(subscription)
+
+
+def _etag(*parts: object) -> str:
+    digest = hashlib.blake2b(repr((database.epoch, *parts)).encode(), digest_size=16)
+    return f'"{digest.hexdigest()}"'
+
+
+def user_etag(username: str) -> Optional[str]:
+    """Returns strong validator of the user, or None if user does not exist"""
     user = _find_user(username)
-    post_ = _find_post(post.author.username, post.id)
-    assert user is not None
-    assert post_ is not None
+    if user is None:
+        return None
+    return _etag("user", username.lower(), user.version)
 
-    post_.likes.add(username.lower())
 
+def user_posts_etag(
+    username: str, current_username: Optional[str], *query: object
+) -> Optional[str]:
+    """Returns strong validator of user posts page as seen by current user
 
-def remove_like_from_post(post: PostModel, username: str) -> None:
+    The page changes with author's posts and their likes, and its is_liked
+    flags change with likes of the current user. Query parameters selecting
+    the page are passed in {query}.
+    """
     user = _find_user(username)
-    post_ = _find_post(post.author.username, post.id)
-    assert user is not None
-    assert post_ is not None
+    if user is None:
+        return None
+    viewer = None
+    if current_username is not None:
+        viewer = _find_user(current_username)
+    return _etag(
+        "posts",
+        username.lower(),
+        user.version,
+        None if viewer is None else (current_username.lower(), viewer.likes_version),
+        query,
+    )
+
+
+def post_etag(
+    username: str, post_id: str, current_username: Optional[str] = None
+) -> Optional[str]:
+    """Returns strong validator of the post as seen by current user"""
+    post = _find_post(username, post_id)
+    if post is None:
+        return None
+    return _etag(
+        "post",
+        post.id,
+        post.version,
+        len(post.author.posts),
+        current_username is not None
+        and database.is_liked(post, current_username.lower()),
+    )
+
 
-    post_.likes.remove(username.lower())
+async def wait_durable() -> None:
+    """Waits until changes made so far by the current request are durable"""
+    await database.sync()
@@ -1,57 +1,93 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI, Request
 from fastapi.responses import HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
 
+from . import admission, hashing, metrics
+from .admission import Overloaded
 from .api import api
+from .bulk import seed
+from .cache import credential_cache
+from .changes import ChangeFeed, open_feed
+from .config import (
+    CHANGES_POLL_INTERVAL,
+    DATA_DIR,
+    FSYNC,
+    FSYNC_INTERVAL,
+    SEED,
+    SNAPSHOT_INTERVAL,
+    STORAGE,
+)
+from .db import database
+from .encoding import EncodingMiddleware, FormattedResponse
+from .journal import close_journal, open_journal
+from .pubsub import pubsub
+from .ranking import ranking
+from .search import search_index
+from .tags import trending
+
+
+metrics.instrument_storage(database)
+metrics.register_stats("", database.stats)
+metrics.register_stats("", search_index.stats)
+metrics.register_stats("credential_cache_", credential_cache.stats)
+metrics.register_stats("", lambda: {"stream_subscribers": len(pubsub)})
+metrics.register_stats("", admission.stats)
+
+
+def _on_likes(counts: dict[str, int]) -> None:
+    ranking.on_likes(counts)
+    pubsub.on_likes(counts)
+
+
+database.on_likes = _on_likes
 
+journal = None
+if DATA_DIR is not None and STORAGE == "memory":
+    journal = open_journal(
+        database,
+        DATA_DIR,
+        fsync=FSYNC,
+        fsync_interval=FSYNC_INTERVAL,
+        snapshot_interval=SNAPSHOT_INTERVAL,
+    )
 
-def init():
-    from app.models import CreatePostModel, CreateUserModel
-    from app.logic import add_like_to_post, create_post, create_user
-    import random
-
-    password = "12345678"
-    texts = [
-        'Is history repeating itself...?',
-        "Damn, it's hard to wrap presents when you're drunk.",
-        "Don't Look a Gift Horse In The Mouth",
-        "Shot In the Dark",
-        "Let Her Rip",
-        "He excelled at firing people nicely.",
-        "I don’t respect anybody who can’t tell the difference between Pepsi and Coke.",
-        "We have a lot of rain in June.",
-        "I may struggle with geography, but I'm sure I'm somewhere around here."
-        "He wasn't bitter that she had moved on but from the radish.",
-        "Barking dogs and screaming toddlers turn friendly neighbors into cranky enemies."
-        "He uses onomatopoeia as a weapon of mental destruction.",
-        "Every manager should be able to recite at least ten nursery rhymes backward.",
-        "Make a sandwich blindfolded, then take a bite."
-        "You Can't Teach an Old Dog New Tricks",
-        "Off One's Base",
-        "Mountain Out of a Molehill",
-        "There's a message for you if you look up.",
-        "It must be five o'clock somewhere.",
-    ]
-    users = [
-        create_user(CreateUserModel(
-            username=f"user_{i + 1}",
-            password=password,
-            full_name=random.choice([f"User {i + 1}", None]),
-        ))
-        for i in range(3)
-    ]
-    posts = [
-        create_post(random.choice(users).username, CreatePostModel(content=text))
-        for text in texts
-    ]
-    for _ in range(len(texts) * 2):
-        add_like_to_post(random.choice(posts), random.choice(users).username)
-
-
-init()
-
-
-app = FastAPI()
+
+def startup() -> Optional[ChangeFeed]:
+    """Indexes posts in storage, and seeds it if it is empty"""
+    feed = None
+    # Several workers may start at once with the same empty storage
+    with database.exclusive():
+        if STORAGE == "sqlite":
+            feed = open_feed(database)
+        for post in database.posts():
+            search_index.add(post)
+            trending.on_post(post)
+            ranking.add(post)
+        if database.is_empty():
+            seed(SEED)
+    return feed
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    feed = startup()
+    polling = None
+    if feed is not None:
+        polling = asyncio.create_task(feed.run(CHANGES_POLL_INTERVAL))
+    yield
+    if polling is not None:
+        polling.cancel()
+    await database.sync()
+    hashing.shutdown()
+    close_journal(database, journal)
+    database.close()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FormattedResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -59,7 +95,18 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(EncodingMiddleware)
+# Added last, so that it measures the whole request
+app.add_middleware(metrics.MetricsMiddleware)
 app.include_router(api, prefix="/api", tags=["api"])
+app.include_router(metrics.router)
+
+
+@app.exception_handler(Overloaded)
+async def overloaded(request: Request, error: Overloaded) -> FormattedResponse:
+    return FormattedResponse(
+        {"detail": error.detail}, status_code=error.status_code, headers=error.headers
+    )
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -0,0 +1,282 @@
+"""Metrics in Prometheus text format
+
+Counters and histograms are updated in place by instrumented code: requests
+by the middleware, argon2 by app.hashing and storage operations by wrappers
+installed on the storage object. Other values are read from stats() of
+components registered with register_stats() when metrics are scraped, so
+they cost nothing in between.
+
+The module imports no storage or other stateful modules of the application,
+as it is also imported by hashing processes.
+"""
+
+import asyncio
+import functools
+import threading
+import time
+from bisect import bisect_left
+from typing import Annotated, Any, Callable, Iterable, Iterator
+
+from fastapi import APIRouter, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+
+from . import profiler
+from .config import PROFILER
+
+
+_LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+_HASH_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labels, labels)} {value}"
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = _LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # Counts of observations in every bucket (not cumulative), the last
+        # one is +Inf, and the sum of observations
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            values = sorted(
+                (labels, list(counts), total[0])
+                for labels, (counts, total) in self._values.items()
+            )
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {cumulative}"
+
+
+requests_total = Counter(
+    "kpitter_http_requests_total",
+    "Number of HTTP requests",
+    ("method", "route", "status"),
+)
+request_duration = Histogram(
+    "kpitter_http_request_duration_seconds",
+    "Time until response headers are sent",
+    ("method", "route"),
+)
+argon2_duration = Histogram(
+    "kpitter_argon2_seconds",
+    "Time spent computing argon2 hashes",
+    ("op",),
+    _HASH_BUCKETS,
+)
+argon2_wait = Histogram(
+    "kpitter_argon2_wait_seconds",
+    "Time argon2 operations waited for a hashing process",
+    ("op",),
+    _HASH_BUCKETS,
+)
+auth_rejections = Counter(
+    "kpitter_auth_rejections_total",
+    "Number of requests rejected before hashing a password",
+    ("reason",),
+)
+storage_operations = Counter(
+    "kpitter_storage_operations_total", "Number of storage method calls", ("op",)
+)
+
+# Storage methods which are counted
+STORAGE_OPERATIONS = (
+    "find_user",
+    "find_post",
+    "save_user",
+    "add_user",
+    "save_post",
+    "add_like",
+    "remove_like",
+    "is_liked",
+    "post_likes",
+    "user_likes",
+    "follow",
+    "unfollow",
+    "followers",
+    "following",
+    "import_batch",
+)
+
+
+def instrument_storage(storage: Any, operations: Iterable[str] = STORAGE_OPERATIONS):
+    """Counts calls of storage methods by replacing them on the instance"""
+    for name in operations:
+        setattr(storage, name, _counted(name, getattr(storage, name)))
+
+
+def _counted(name: str, method: Callable[..., Any]) -> Callable[..., Any]:
+    @functools.wraps(method)
+    def counted(*args, **kwargs):
+        storage_operations.inc(name)
+        return method(*args, **kwargs)
+
+    return counted
+
+
+def _route_path(scope) -> str:
+    route = scope.get("route")
+    if route is None:
+        return "unmatched"
+    # Depending on the version of FastAPI, routes of included routers know
+    # their path with or without the prefix. The prefix is static, so it is
+    # restored from the leading segments of the request path.
+    path = route.path
+    extra = scope["path"].count("/") - path.count("/")
+    if extra > 0:
+        path = "/".join(scope["path"].split("/")[: extra + 1]) + path
+    return path
+
+
+class MetricsMiddleware:
+    """Counts requests and measures their latency by route template
+
+    Requests which match no route are labeled with route "unmatched", so
+    arbitrary paths do not create new series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        recorded = False
+
+        def record(status: int) -> None:
+            nonlocal recorded
+            recorded = True
+            path = _route_path(scope)
+            request_duration.observe(time.perf_counter() - started, scope["method"], path)
+            requests_total.inc(scope["method"], path, str(status))
+
+        async def send_recorded(message):
+            if message["type"] == "http.response.start":
+                record(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_recorded)
+        finally:
+            if not recorded:
+                record(500)
+
+
+# Values of stats() which only grow; others are exposed as gauges
+_COUNTERS = {"like_batches", "likes_applied", "hits", "misses", "evictions"}
+_sources: list[tuple[str, Callable[[], dict[str, float]]]] = []
+
+
+def register_stats(prefix: str, stats: Callable[[], dict[str, float]]) -> None:
+    """Exposes values returned by {stats} as metrics named with {prefix}"""
+    _sources.append((prefix, stats))
+
+
+def _stats(prefix: str, stats: dict[str, float]) -> Iterator[str]:
+    for key, value in stats.items():
+        name = f"kpitter_{prefix}{key}"
+        if key in _COUNTERS:
+            yield f"# TYPE {name}_total counter"
+            yield f"{name}_total {value}"
+        else:
+            yield f"# TYPE {name} gauge"
+            yield f"{name} {value}"
+
+
+def render() -> str:
+    lines: list[str] = []
+    for metric in (
+        requests_total,
+        request_duration,
+        argon2_duration,
+        argon2_wait,
+        auth_rejections,
+        storage_operations,
+    ):
+        lines.extend(metric.render())
+    for prefix, stats in _sources:
+        lines.extend(_stats(prefix, stats()))
+    return "\n".join(lines) + "\n"
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics() -> PlainTextResponse:
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/debug/profile", include_in_schema=False)
+async def profile(
+    seconds: Annotated[float, Query(gt=0, le=300)] = 10,
+    interval: Annotated[float, Query(ge=0.001, le=1)] = 0.01,
+) -> PlainTextResponse:
+    """Samples stacks of all threads, in collapsed format for flame graphs
+
+    Enabled by KPITTER_PROFILER=1.
+    """
+    if not PROFILER:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    try:
+        stacks = await asyncio.to_thread(profiler.sample, seconds, interval)
+    except RuntimeError as error:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(error))
+    return PlainTextResponse(stacks)
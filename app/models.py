@@ -1,7 +1,7 @@
 from datetime import datetime
-from typing import Optional
+from typing import Annotated, Literal, Optional, Union
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 
 
 class Detailed(BaseModel):
@@ -54,5 +54,188 @@ class PostModel(BaseModel):
     created_at: datetime
 
 
-class PaginationParams(BaseModel):
-    page: int = Field(gt=0, default=1, examples=[1, 2, 3])
+class NormalizedPostModel(BaseModel):
+    id: str = Field(examples=["deadbeefdeadbeefdeadbeefdeadbeef"])
+    author: str = Field(examples=["johndoe2024"], description="Username of the author")
+    content: str = Field(examples=["Lorem Ipsum Dolor Sit Amet"])
+    likes: int = Field(ge=0, examples=[0, 100, 200], description="Number of likes")
+    is_liked: bool
+    created_at: datetime
+
+
+class NormalizedPostsModel(BaseModel):
+    posts: list[Optional[NormalizedPostModel]]
+    users: dict[str, UserModel] = Field(description="Authors of the posts by username")
+
+
+class ShapeParams(BaseModel):
+    shape: Literal["nested", "normalized"] = Field(
+        default="nested",
+        description="With normalized, posts refer to authors by username and "
+        "every author is sent once (see NormalizedPostsModel)",
+    )
+
+
+class PaginationParams(ShapeParams):
+    page: Optional[int] = Field(
+        gt=0,
+        default=None,
+        examples=[1, 2, 3],
+        description="Page number, kept for compatibility. Prefer cursors",
+    )
+    before: Optional[str] = Field(
+        default=None, description="Cursor, returns posts older than it"
+    )
+    after: Optional[str] = Field(
+        default=None, description="Cursor, returns posts newer than it"
+    )
+    limit: int = Field(gt=0, le=100, default=10, description="Page size")
+    sort: Literal["newest", "likes"] = Field(
+        default="newest", description="Newest posts first, or most liked first"
+    )
+
+    @model_validator(mode="after")
+    def _single_position(self) -> "PaginationParams":
+        if sum(x is not None for x in (self.page, self.before, self.after)) > 1:
+            raise ValueError("Only one of page, before and after may be used")
+        return self
+
+
+class TimelineParams(ShapeParams):
+    before: Optional[str] = Field(
+        default=None, description="Cursor, returns posts older than it"
+    )
+    limit: int = Field(gt=0, le=100, default=10, description="Page size")
+
+
+class SearchParams(ShapeParams):
+    q: str = Field(min_length=1, max_length=140, description="Search query")
+    cursor: Optional[str] = Field(
+        default=None, description="Cursor of the next page of results"
+    )
+    limit: int = Field(gt=0, le=100, default=10, description="Page size")
+
+
+class LikersParams(BaseModel):
+    before: Optional[str] = Field(
+        default=None, description="Cursor, returns users who liked the post before it"
+    )
+    limit: int = Field(gt=0, le=100, default=10, description="Page size")
+
+
+class LikerModel(BaseModel):
+    username: str = Field(examples=["johndoe2024"])
+    full_name: Optional[str] = Field(examples=[None, "John Doe"])
+    liked_at: datetime
+
+
+class TrendingParams(BaseModel):
+    window: Literal["1h", "24h"] = Field(
+        default="1h", description="Period in which tags are counted"
+    )
+    limit: int = Field(gt=0, le=100, default=10, description="Number of tags")
+
+
+class TrendingTagModel(BaseModel):
+    tag: str = Field(examples=["python"])
+    posts: int = Field(
+        ge=0, examples=[0, 100, 200], description="Estimated number of posts"
+    )
+
+
+class StreamParams(BaseModel):
+    author: list[str] = Field(
+        default=[], max_length=100, description="Usernames to receive new posts and likes of"
+    )
+    post: list[str] = Field(
+        default=[], max_length=100, description="Post ids to receive likes of"
+    )
+
+    @model_validator(mode="after")
+    def _any_topic(self) -> "StreamParams":
+        if not self.author and not self.post:
+            raise ValueError("At least one author or post is required")
+        return self
+
+
+class PostRefModel(BaseModel):
+    username: str = Field(examples=["johndoe2024"])
+    post_id: str = Field(examples=["deadbeefdeadbeefdeadbeefdeadbeef"])
+
+
+class BatchGetPostsModel(BaseModel):
+    posts: list[PostRefModel] = Field(min_length=1, max_length=100)
+
+
+class LikeOperationModel(PostRefModel):
+    like: bool = Field(default=True, description="Whether to like or unlike post")
+
+
+class BatchLikeModel(BaseModel):
+    operations: list[LikeOperationModel] = Field(min_length=1, max_length=100)
+
+
+class LikeResultModel(BaseModel):
+    username: str = Field(examples=["johndoe2024"])
+    post_id: str = Field(examples=["deadbeefdeadbeefdeadbeefdeadbeef"])
+    status: int = Field(
+        examples=[201, 204, 404],
+        description="Status the single like or unlike endpoint would return",
+    )
+
+
+class ImportUserModel(BaseModel):
+    type: Literal["user"]
+    username: str = Field(min_length=3, max_length=20, pattern=r"^[a-zA-Z0-9_]+$")
+    password_hash: Optional[str] = Field(
+        default=None, pattern=r"^\$argon2(id|i|d)\$", description="Argon2 hash"
+    )
+    password: Optional[str] = Field(
+        default=None, min_length=8, description="Hashed on import, which is slow"
+    )
+    full_name: Optional[str] = Field(max_length=64, default=None)
+
+    @model_validator(mode="after")
+    def _one_password(self) -> "ImportUserModel":
+        if (self.password is None) == (self.password_hash is None):
+            raise ValueError("Exactly one of password and password_hash is required")
+        return self
+
+
+class ImportPostModel(BaseModel):
+    type: Literal["post"]
+    id: Optional[str] = Field(default=None, pattern=r"^[0-9a-fA-F]{32}$")
+    author: str
+    content: str = Field(min_length=1, max_length=140)
+    created_at: Optional[datetime] = None
+
+
+class ImportLikeModel(BaseModel):
+    type: Literal["like"]
+    post_id: str
+    username: str
+    liked_at: Optional[datetime] = None
+
+
+class ImportFollowModel(BaseModel):
+    type: Literal["follow"]
+    username: str
+    followee: str
+
+
+ImportRecord = Annotated[
+    Union[ImportUserModel, ImportPostModel, ImportLikeModel, ImportFollowModel],
+    Field(discriminator="type"),
+]
+
+
+class ImportResultModel(BaseModel):
+    users: int = Field(ge=0, description="Number of imported users")
+    posts: int = Field(ge=0, description="Number of imported posts")
+    likes: int = Field(ge=0, description="Number of imported likes")
+    follows: int = Field(ge=0, description="Number of imported follows")
+    skipped: int = Field(
+        ge=0, description="Number of records which exist already or refer to missing ones"
+    )
+    failed: int = Field(ge=0, description="Number of invalid lines")
+    errors: list[str] = Field(description="Errors of the first invalid lines")
@@ -0,0 +1,50 @@
+"""Sampling profiler of all threads of the process
+
+While sampling, a background thread records the stacks of all other threads
+every {interval} seconds. Samples are returned in the collapsed format: one
+line per distinct stack, with frames from the root separated by semicolons
+and followed by the number of samples. This is the input of flamegraph.pl,
+speedscope and similar tools. Nothing is recorded while sampling is not
+running.
+"""
+
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import Optional
+
+_lock = threading.Lock()
+
+
+def _stack(frame: Optional[FrameType]) -> str:
+    names = []
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "?")
+        names.append(f"{module}.{frame.f_code.co_qualname}")
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+def sample(duration: float, interval: float) -> str:
+    """Samples stacks for {duration} seconds and returns them collapsed
+
+    Raises RuntimeError if sampling is running already.
+    """
+    if not _lock.acquire(blocking=False):
+        raise RuntimeError("Profiler is running already")
+    try:
+        current = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks: Counter[str] = Counter()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident != current:
+                    stacks[f"{names.get(ident, ident)};{_stack(frame)}"] += 1
+            time.sleep(interval)
+    finally:
+        _lock.release()
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
@@ -0,0 +1,188 @@
+"""In-process publish/subscribe of new posts and like counts
+
+Subscribers listen to topics: posts of an author, or a single post. Events
+are encoded once per publish and shared by all subscribers, as ready to send
+Server-Sent Events.
+
+Every subscriber has a queue of at most STREAM_QUEUE_SIZE events. Subscribers
+which do not keep up are dropped, instead of slowing down publishers or
+buffering without limit. Like counts are coalesced: changes of a post within
+STREAM_LIKES_INTERVAL are sent as one update with the latest count, and an
+update still waiting in a queue is replaced by the newer one.
+
+New posts must be published from the event loop thread. Like counts are
+reported by storage once batches of likes are applied (see app.likes), from
+any thread, so only likes which changed a count are sent.
+"""
+
+import asyncio
+from collections import deque
+from typing import Iterable, Optional
+
+from .config import STREAM_LIKES_INTERVAL, STREAM_QUEUE_SIZE
+from .db import Post, database
+from .serialization import encode_string, encode_user, post_encoder
+
+
+def author_topic(username: str) -> str:
+    return f"author:{username.lower()}"
+
+
+def post_topic(post_id: str) -> str:
+    return f"post:{post_id.lower()}"
+
+
+def _event(name: bytes, data: bytes) -> bytes:
+    return b"event: %s\ndata: %s\n\n" % (name, data)
+
+
+class Subscription:
+    __slots__ = ("topics", "dropped", "_maxsize", "_posts", "_likes", "_ready")
+
+    def __init__(self, topics: Iterable[str], maxsize: int):
+        self.topics = frozenset(topics)
+        self.dropped = False
+        self._maxsize = maxsize
+        self._posts: deque[bytes] = deque()
+        self._likes: dict[str, bytes] = {}
+        self._ready = asyncio.Event()
+
+    def _put_post(self, event: bytes) -> bool:
+        if len(self._posts) + len(self._likes) >= self._maxsize:
+            return False
+        self._posts.append(event)
+        self._ready.set()
+        return True
+
+    def _put_likes(self, post_id: str, event: bytes) -> bool:
+        if post_id not in self._likes:
+            if len(self._posts) + len(self._likes) >= self._maxsize:
+                return False
+        self._likes[post_id] = event
+        self._ready.set()
+        return True
+
+    def _drop(self) -> None:
+        self.dropped = True
+        self._posts.clear()
+        self._likes.clear()
+        self._ready.set()
+
+    async def get(self, timeout: float) -> list[bytes]:
+        """Waits for queued events and returns all of them
+
+        Returns empty list if nothing was published within {timeout} seconds,
+        or if the subscriber was dropped.
+        """
+        if not self._ready.is_set():
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except TimeoutError:
+                return []
+        self._ready.clear()
+        # New posts go first, likes may refer to them
+        events = [*self._posts, *self._likes.values()]
+        self._posts.clear()
+        self._likes.clear()
+        return events
+
+
+class PubSub:
+    def __init__(self, queue_size: int, likes_interval: float):
+        self._queue_size = queue_size
+        self._likes_interval = likes_interval
+        self._subscriptions: set[Subscription] = set()
+        self._topics: dict[str, set[Subscription]] = {}
+        # New like counts by post id
+        self._changed: dict[str, int] = {}
+        self._flush: Optional[asyncio.TimerHandle] = None
+        # Loop of subscribers, which events are sent in
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def subscribe(self, topics: Iterable[str]) -> Subscription:
+        self._loop = asyncio.get_running_loop()
+        subscription = Subscription(topics, self._queue_size)
+        self._subscriptions.add(subscription)
+        for topic in subscription.topics:
+            self._topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscriptions.discard(subscription)
+        for topic in subscription.topics:
+            subscriptions = self._topics.get(topic)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._topics[topic]
+
+    def _subscribers(self, *topics: str) -> set[Subscription]:
+        result = set()
+        for topic in topics:
+            result.update(self._topics.get(topic, ()))
+        return result
+
+    def _drop(self, subscription: Subscription) -> None:
+        self.unsubscribe(subscription)
+        subscription._drop()
+
+    def publish_post(self, post: Post) -> None:
+        """Sends new post to subscribers of its author"""
+        subscribers = self._subscribers(author_topic(post.author.username))
+        if not subscribers:
+            return
+        author = encode_user(
+            post.author.username, post.author.full_name, len(post.author.posts)
+        )
+        event = _event(b"post", post_encoder.encode(post, author, len(post.likes), False))
+        for subscription in subscribers:
+            if not subscription._put_post(event):
+                self._drop(subscription)
+
+    def on_likes(self, counts: dict[str, int]) -> None:
+        """Schedules updates of like counts, given by post id
+
+        May be called from any thread.
+        """
+        loop = self._loop
+        if not self._topics or loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._publish_likes, counts)
+
+    def _publish_likes(self, counts: dict[str, int]) -> None:
+        self._changed.update(counts)
+        if self._flush is None:
+            self._flush = asyncio.get_running_loop().call_later(
+                self._likes_interval, self._flush_likes
+            )
+
+    def _flush_likes(self) -> None:
+        self._flush = None
+        changed, self._changed = self._changed, {}
+        for post_id, likes in changed.items():
+            if not self._topics:
+                return
+            # Authors are found only for posts which have subscribers
+            post = database.find_post(post_id)
+            if post is None:
+                continue
+            subscribers = self._subscribers(
+                author_topic(post.author.username), post_topic(post.id)
+            )
+            if not subscribers:
+                continue
+            data = b'{"id":%s,"author":%s,"likes":%d}' % (
+                encode_string(post.id),
+                encode_string(post.author.username),
+                likes,
+            )
+            event = _event(b"likes", data)
+            for subscription in subscribers:
+                if not subscription._put_likes(post.id, event):
+                    self._drop(subscription)
+
+
+pubsub = PubSub(STREAM_QUEUE_SIZE, STREAM_LIKES_INTERVAL)
@@ -0,0 +1,219 @@
+"""Posts ranked by number of likes
+
+Every user has an index of their posts ordered by likes, most liked first,
+then by creation time, newest first; one more index holds posts of all
+users. Indexes are order-statistic lists, so a post is moved in O(log n)
+when its likes change, and a page is found by its offset or by the key of a
+neighbour post in O(log n), without sorting posts on every request.
+
+Like counts change when batches of likes are applied to storage (see
+app.likes), which reports new counts to Ranking.on_likes.
+"""
+
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from .db import Post
+
+# Negated likes, negated timestamp and id, so that ascending order of keys
+# is the order of posts in the ranking
+RankKey = tuple[int, float, str]
+
+# Keys are kept in blocks of _BLOCK to 2 * _BLOCK keys
+_BLOCK = 256
+
+
+def rank_key(post_id: str, created_at: datetime, likes: int) -> RankKey:
+    return -likes, -created_at.timestamp(), post_id
+
+
+class RankIndex:
+    """Sorted list of keys with access by position
+
+    Keys are split into sorted blocks. A Fenwick tree of block sizes finds
+    the block holding a position, and the number of keys before a block, in
+    O(log n); within a block keys are found with bisect and moved by list
+    insertion of at most 2 * _BLOCK references.
+    """
+
+    __slots__ = ("_blocks", "_maxes", "_tree", "_len")
+
+    def __init__(self):
+        self._blocks: list[list[RankKey]] = []
+        # The last key of every block
+        self._maxes: list[RankKey] = []
+        # Fenwick tree of block sizes, indexed from 1
+        self._tree: list[int] = [0]
+        self._len = 0
+
+    def _rebuild(self) -> None:
+        tree = [0] * (len(self._blocks) + 1)
+        for index, block in enumerate(self._blocks, 1):
+            tree[index] += len(block)
+            parent = index + (index & -index)
+            if parent < len(tree):
+                tree[parent] += tree[index]
+        self._tree = tree
+
+    def _resize(self, block: int, delta: int) -> None:
+        index = block + 1
+        while index < len(self._tree):
+            self._tree[index] += delta
+            index += index & -index
+
+    def _before(self, block: int) -> int:
+        """Returns number of keys in blocks before {block}"""
+        count = 0
+        while block > 0:
+            count += self._tree[block]
+            block -= block & -block
+        return count
+
+    def _locate(self, position: int) -> tuple[int, int]:
+        """Returns block of the key at {position}, and its offset within it"""
+        block = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            index = block + step
+            if index < len(self._tree) and self._tree[index] <= position:
+                block = index
+                position -= self._tree[index]
+            step >>= 1
+        return block, position
+
+    def add(self, key: RankKey) -> None:
+        self._len += 1
+        if not self._blocks:
+            self._blocks.append([key])
+            self._maxes.append(key)
+            self._rebuild()
+            return
+        index = min(bisect_left(self._maxes, key), len(self._blocks) - 1)
+        block = self._blocks[index]
+        insort(block, key)
+        self._maxes[index] = block[-1]
+        if len(block) > 2 * _BLOCK:
+            self._blocks[index : index + 1] = [block[:_BLOCK], block[_BLOCK:]]
+            self._maxes[index : index + 1] = [block[_BLOCK - 1], block[-1]]
+            self._rebuild()
+        else:
+            self._resize(index, 1)
+
+    def remove(self, key: RankKey) -> None:
+        index = bisect_left(self._maxes, key)
+        block = self._blocks[index]
+        del block[bisect_left(block, key)]
+        self._len -= 1
+        if block:
+            self._maxes[index] = block[-1]
+            self._resize(index, -1)
+        else:
+            del self._blocks[index], self._maxes[index]
+            self._rebuild()
+
+    def position(self, key: RankKey) -> int:
+        """Returns number of keys less than {key}"""
+        index = bisect_left(self._maxes, key)
+        if index == len(self._blocks):
+            return self._len
+        return self._before(index) + bisect_left(self._blocks[index], key)
+
+    def slice(self, start: int, stop: int) -> list[RankKey]:
+        result: list[RankKey] = []
+        start, stop = max(0, start), min(stop, self._len)
+        if start >= stop:
+            return result
+        index, offset = self._locate(start)
+        while len(result) < stop - start:
+            block = self._blocks[index]
+            result.extend(block[offset : offset + stop - start - len(result)])
+            index, offset = index + 1, 0
+        return result
+
+    def __len__(self) -> int:
+        return self._len
+
+
+class RankPage(NamedTuple):
+    keys: list[RankKey]
+    # Whether there are higher and lower ranked posts
+    higher: bool
+    lower: bool
+
+
+class Ranking:
+    def __init__(self):
+        # Author and key of every ranked post
+        self._keys: dict[str, tuple[str, RankKey]] = {}
+        self._authors: dict[str, RankIndex] = {}
+        self._all = RankIndex()
+        self._lock = threading.Lock()
+
+    def add(self, post: Post) -> None:
+        author = post.author.username.lower()
+        key = rank_key(post.id, post.created_at, len(post.likes))
+        with self._lock:
+            if post.id in self._keys:
+                return
+            self._keys[post.id] = author, key
+            self._authors.setdefault(author, RankIndex()).add(key)
+            self._all.add(key)
+
+    def reset(self) -> None:
+        """Removes all posts from the ranking"""
+        with self._lock:
+            self._keys = {}
+            self._authors = {}
+            self._all = RankIndex()
+
+    def on_likes(self, counts: dict[str, int]) -> None:
+        """Moves posts by their new numbers of likes, given by post id"""
+        with self._lock:
+            for post_id, likes in counts.items():
+                entry = self._keys.get(post_id)
+                if entry is None or entry[1][0] == -likes:
+                    continue
+                author, key = entry
+                moved = (-likes, *key[1:])
+                self._keys[post_id] = author, moved
+                for index in (self._authors[author], self._all):
+                    index.remove(key)
+                    index.add(moved)
+
+    def page(
+        self,
+        author: Optional[str],
+        limit: int,
+        offset: int = 0,
+        before: Optional[RankKey] = None,
+        after: Optional[RankKey] = None,
+    ) -> RankPage:
+        """Returns keys of posts of {author}, or of all users, most liked first
+
+        The page starts at {offset}, or right below {before}; with {after},
+        it is the page right above it.
+        """
+        with self._lock:
+            index = self._all if author is None else self._authors.get(author)
+            if index is None:
+                return RankPage([], False, False)
+            if after is not None:
+                stop = index.position(after)
+                start = max(0, stop - limit)
+            else:
+                start = offset
+                if before is not None:
+                    start = index.position(before)
+                    # The post of the cursor itself is not repeated
+                    if index.slice(start, start + 1) == [before]:
+                        start += 1
+                stop = start + limit
+            return RankPage(index.slice(start, stop), start > 0, stop < len(index))
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+ranking = Ranking()
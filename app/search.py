@@ -0,0 +1,218 @@
+"""Full-text search over post contents
+
+Posts are kept in an inverted index in memory: every term maps to the array
+of numbers of posts containing it. Posts are numbered in the order they are
+indexed, so arrays stay sorted. Terms are case-folded words; the last term of
+a query also matches longer terms starting with it, so that results can be
+shown while the query is being typed.
+
+Posts matching all terms of a query are ranked by relevance, the sum of
+inverse document frequencies of matched terms (prefix matches count half),
+multiplied by recency, which halves every SEARCH_HALF_LIFE hours. Candidates
+are scanned from the last indexed post backwards, and the scan stops as soon
+as no older post can score higher than the results found so far. Common
+terms do not make queries slower, as recent posts are found first.
+"""
+
+import heapq
+import math
+import re
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from .config import SEARCH_HALF_LIFE, SEARCH_PREFIX_TERMS
+from .db import Post
+
+_WORD = re.compile(r"\w+")
+_PREFIX_WEIGHT = 0.5
+
+
+def tokenize(text: str) -> list[str]:
+    return _WORD.findall(unicodedata.normalize("NFKC", text).casefold())
+
+
+class SearchCursor(NamedTuple):
+    """Position after the last result of a page
+
+    Scores depend on the time of the query and on the number of posts indexed
+    by then, so both are kept for next pages. Posts indexed later are not
+    searched by next pages.
+    """
+
+    now: float
+    count: int
+    score: float
+    number: int
+
+
+def _contains(postings: array, number: int) -> bool:
+    index = bisect_left(postings, number)
+    return index < len(postings) and postings[index] == number
+
+
+def _descending(alternatives: list[tuple[array, float]]) -> Iterator[int]:
+    if len(alternatives) == 1:
+        return reversed(alternatives[0][0])
+    return _unique(
+        heapq.merge(*(reversed(postings) for postings, _ in alternatives), reverse=True)
+    )
+
+
+def _unique(numbers: Iterable[int]) -> Iterator[int]:
+    last = None
+    for number in numbers:
+        if number != last:
+            last = number
+            yield number
+
+
+class SearchIndex:
+    def __init__(self, half_life: float, prefix_terms: int):
+        self._half_life = half_life * 3600
+        self._prefix_terms = prefix_terms
+        self._postings: dict[str, array] = {}
+        # Sorted terms, for prefix matching
+        self._terms: list[str] = []
+        self._ids: list[str] = []
+        self._times = array("d")
+        # Latest creation time of posts numbered up to every number, bounds
+        # recency of all older posts
+        self._latest = array("d")
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, post: Post) -> None:
+        terms = set(tokenize(post.content))
+        timestamp = post.created_at.timestamp()
+        with self._lock:
+            number = len(self._ids)
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[sys.intern(term)] = array("I")
+                    insort(self._terms, term)
+                postings.append(number)
+            self._times.append(timestamp)
+            self._latest.append(max(timestamp, self._latest[-1]) if number else timestamp)
+            # Published last, so that searches never see partially added post
+            self._ids.append(post.id)
+
+    def reset(self) -> None:
+        """Removes all posts from the index"""
+        with self._lock:
+            # Emptied first, so that searches skip numbers of removed posts
+            self._ids = []
+            self._postings = {}
+            self._terms = []
+            self._times = array("d")
+            self._latest = array("d")
+
+    def _alternatives(self, term: str, prefix: bool, count: int) -> list[tuple[array, float]]:
+        """Returns postings matching the term, with their weights
+
+        Weights count only posts numbered below {count}.
+        """
+        terms = [term] if term in self._postings else []
+        if prefix:
+            start = bisect_left(self._terms, term)
+            for other in self._terms[start : start + self._prefix_terms + 1]:
+                if not other.startswith(term):
+                    break
+                if other != term:
+                    terms.append(other)
+        result = []
+        exact = None
+        for other in terms:
+            postings = self._postings[other]
+            matches = bisect_left(postings, count)
+            if not matches:
+                continue
+            weight = math.log(1 + count / matches)
+            if other == term:
+                exact = weight
+            else:
+                # Prefix match never weighs more than an exact one
+                weight = _PREFIX_WEIGHT * min(weight, exact or weight)
+            result.append((postings, weight))
+        return result
+
+    def search(
+        self, query: str, limit: int, after: Optional[SearchCursor] = None
+    ) -> tuple[list[str], Optional[SearchCursor]]:
+        """Returns ids of best matching posts and cursor of the next page"""
+        terms = tokenize(query)
+        if not terms:
+            return [], None
+        count = len(self._ids) if after is None else after.count
+        now = time.time() if after is None else after.now
+        groups = []
+        for term in dict.fromkeys(terms):
+            prefix = term == terms[-1] and len(term) > 1
+            alternatives = self._alternatives(term, prefix, count)
+            if not alternatives:
+                return [], None
+            groups.append(alternatives)
+        driver = min(groups, key=lambda group: sum(len(p) for p, _ in group))
+        best_relevance = sum(max(weight for _, weight in group) for group in groups)
+
+        # Min-heap of the best limit + 1 results
+        results: list[tuple[float, int]] = []
+        for number in _descending(driver):
+            if number >= count:
+                continue
+            bound = best_relevance * 0.5 ** ((now - self._latest[number]) / self._half_life)
+            if len(results) > limit and bound <= results[0][0]:
+                break
+            relevance = 0.0
+            for group in groups:
+                weight = max(
+                    (weight for postings, weight in group if _contains(postings, number)),
+                    default=0.0,
+                )
+                if not weight:
+                    break
+                relevance += weight
+            else:
+                score = relevance * 0.5 ** ((now - self._times[number]) / self._half_life)
+                if after is not None and (score, number) >= (after.score, after.number):
+                    continue
+                if len(results) <= limit:
+                    heapq.heappush(results, (score, number))
+                elif (score, number) > results[0]:
+                    heapq.heapreplace(results, (score, number))
+
+        results.sort(reverse=True)
+        page = results[:limit]
+        cursor = None
+        if len(results) > limit:
+            cursor = SearchCursor(now, count, *page[-1])
+        # Posts indexed twice (e.g. while workers start) are shown once
+        return list(dict.fromkeys(self._ids[number] for _, number in page)), cursor
+
+    def stats(self) -> dict[str, int]:
+        postings = list(self._postings.values())
+        size = (
+            sys.getsizeof(self._postings)
+            + sum(sys.getsizeof(p) for p in postings)
+            + sum(sys.getsizeof(term) for term in self._terms)
+            + sys.getsizeof(self._terms)
+            + sys.getsizeof(self._ids)
+            + sys.getsizeof(self._times)
+            + sys.getsizeof(self._latest)
+        )
+        return {
+            "search_posts": len(self._ids),
+            "search_terms": len(postings),
+            "search_postings": sum(len(p) for p in postings),
+            "search_bytes": size,
+        }
+
+
+search_index = SearchIndex(SEARCH_HALF_LIFE, SEARCH_PREFIX_TERMS)
@@ -0,0 +1,212 @@
+"""Fast encoding of posts
+
+List endpoints return many posts, and building PostModel with nested
+UserModel for every one of them, only to serialize them again, dominates
+their CPU time. Instead posts are encoded straight into JSON bytes matching
+PostModel. Parts of a post which never change (id, content, created_at) are
+encoded once and cached; only the author and likes are encoded per response.
+
+Pages may also be encoded normalized, matching NormalizedPostsModel: posts
+refer to their authors by username, and every author is encoded once.
+
+Clients accepting MessagePack get the same parts encoded as MessagePack
+instead, if the msgpack package is installed. The format of the current
+request is selected by app.encoding with formatted().
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterable, Iterator, Optional
+
+from .config import POST_ENCODER_CACHE_SIZE
+from .db import Post
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_TRUE = b"true"
+_FALSE = b"false"
+
+
+def encode_string(value: Optional[str]) -> bytes:
+    return json.dumps(value, ensure_ascii=False).encode()
+
+
+def encode_user(username: str, full_name: Optional[str], posts: int) -> bytes:
+    """Encodes user matching UserModel"""
+    return b'{"username":%s,"full_name":%s,"posts":%d}' % (
+        encode_string(username),
+        encode_string(full_name),
+        posts,
+    )
+
+
+class Format:
+    """Encodes parts of responses as JSON, so that they can be joined"""
+
+    media_type = "application/json"
+    null = b"null"
+    is_liked = b',"is_liked":'
+
+    def __init__(self):
+        self.posts = PostEncoder(self, POST_ENCODER_CACHE_SIZE)
+
+    def string(self, value: Optional[str]) -> bytes:
+        return encode_string(value)
+
+    def integer(self, value: int) -> bytes:
+        return b"%d" % value
+
+    def boolean(self, value: bool) -> bytes:
+        return _TRUE if value else _FALSE
+
+    def user(self, username: str, full_name: Optional[str], posts: int) -> bytes:
+        return encode_user(username, full_name, posts)
+
+    def post_parts(self, post: Post) -> tuple[bytes, bytes, bytes]:
+        """Returns parts of post before author, before likes and after is_liked"""
+        return (
+            b'{"id":%s,"author":' % encode_string(post.id),
+            b',"content":%s,"likes":' % encode_string(post.content),
+            b',"created_at":"%s"}' % post.created_at.isoformat().encode(),
+        )
+
+    def list(self, items: Iterable[bytes]) -> bytes:
+        return encode_list(items)
+
+    def normalized(self, posts: Iterable[bytes], users: dict[str, bytes]) -> bytes:
+        return encode_normalized(posts, users)
+
+    def render(self, content: Any) -> bytes:
+        return json.dumps(
+            content, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode()
+
+
+class _MessagePack(Format):
+    """Encodes parts of responses as MessagePack, with keys in JSON order"""
+
+    media_type = "application/msgpack"
+    null = b"\xc0"
+
+    def __init__(self):
+        super().__init__()
+        self.is_liked = msgpack.packb("is_liked")
+
+    def string(self, value: Optional[str]) -> bytes:
+        return msgpack.packb(value)
+
+    def integer(self, value: int) -> bytes:
+        return msgpack.packb(value)
+
+    def boolean(self, value: bool) -> bytes:
+        return msgpack.packb(value)
+
+    def user(self, username: str, full_name: Optional[str], posts: int) -> bytes:
+        return msgpack.packb(
+            {"username": username, "full_name": full_name, "posts": posts}
+        )
+
+    def post_parts(self, post: Post) -> tuple[bytes, bytes, bytes]:
+        pack = msgpack.packb
+        return (
+            b"\x86" + pack("id") + pack(post.id) + pack("author"),
+            pack("content") + pack(post.content) + pack("likes"),
+            pack("created_at") + pack(post.created_at.isoformat()),
+        )
+
+    def list(self, items: Iterable[bytes]) -> bytes:
+        items = list(items)
+        return msgpack.Packer().pack_array_header(len(items)) + b"".join(items)
+
+    def normalized(self, posts: Iterable[bytes], users: dict[str, bytes]) -> bytes:
+        return b"".join(
+            (
+                b"\x82",
+                msgpack.packb("posts"),
+                self.list(posts),
+                msgpack.packb("users"),
+                msgpack.Packer().pack_map_header(len(users)),
+                *(msgpack.packb(name) + user for name, user in users.items()),
+            )
+        )
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content)
+
+
+class PostEncoder:
+    """Encodes posts matching PostModel, caching their immutable parts"""
+
+    def __init__(self, format: Format, maxsize: int):
+        self._format = format
+        self._maxsize = maxsize
+        self._parts: OrderedDict[str, tuple[bytes, bytes, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _parts_of(self, post: Post) -> tuple[bytes, bytes, bytes]:
+        with self._lock:
+            parts = self._parts.get(post.id)
+            if parts is not None:
+                self._parts.move_to_end(post.id)
+                return parts
+        parts = self._format.post_parts(post)
+        with self._lock:
+            self._parts[post.id] = parts
+            if len(self._parts) > self._maxsize:
+                self._parts.popitem(last=False)
+        return parts
+
+    def encode(self, post: Post, author: bytes, likes: int, is_liked: bool) -> bytes:
+        head, middle, tail = self._parts_of(post)
+        return b"".join(
+            (
+                head,
+                author,
+                middle,
+                self._format.integer(likes),
+                self._format.is_liked,
+                self._format.boolean(is_liked),
+                tail,
+            )
+        )
+
+
+def encode_list(items: Iterable[bytes]) -> bytes:
+    return b"[" + b",".join(items) + b"]"
+
+
+def encode_normalized(posts: Iterable[bytes], users: dict[str, bytes]) -> bytes:
+    """Encodes posts referring to authors by username, and authors by username"""
+    return b'{"posts":%s,"users":{%s}}' % (
+        encode_list(posts),
+        b",".join(b"%s:%s" % (encode_string(name), user) for name, user in users.items()),
+    )
+
+
+JSON = Format()
+# None if the msgpack package is not installed
+MSGPACK = _MessagePack() if msgpack is not None else None
+post_encoder = JSON.posts
+
+_format: ContextVar[Format] = ContextVar("format", default=JSON)
+
+
+def response_format() -> Format:
+    """Returns the format the current request wants responses in"""
+    return _format.get()
+
+
+@contextmanager
+def formatted(format: Format) -> Iterator[None]:
+    """Encodes responses in {format} within the block"""
+    token = _format.set(format)
+    try:
+        yield
+    finally:
+        _format.reset(token)
@@ -0,0 +1,623 @@
+"""SQLite storage backend
+
+Data is stored in a SQLite database in WAL mode, so readers never wait for
+the writer. Reads use a pool of connections, while all writes go through a
+single writer connection. Likes are queued and committed in batched
+transactions (see app.likes). Until a like is applied, whether the user liked
+the post is read from the queue, as in the memory backend, while numbers of
+likes and pages of likers are updated with the batch.
+
+The database may be shared by several worker processes. Every write records
+a row in the changes table, so that workers can update their in-memory state
+(see app.changes) with writes of other workers. Changes are kept for
+CHANGES_RETENTION seconds.
+"""
+
+import asyncio
+import fcntl
+import queue
+import secrets
+import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Callable, Iterable, Iterator, Optional
+from uuid import uuid4
+
+from .config import (
+    CHANGES_RETENTION,
+    LIKE_BATCH_DELAY,
+    LIKE_BATCH_SIZE,
+    SQLITE_POOL_SIZE,
+)
+from .db import Imported, ImportBatch, LikeKey, LikesPage, Post, PostKey, User
+from .likes import Intent, LikeQueue
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    key TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    password_hash TEXT NOT NULL,
+    full_name TEXT,
+    posts INTEGER NOT NULL DEFAULT 0,
+    followers INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0,
+    likes_version INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS posts (
+    id TEXT PRIMARY KEY,
+    author TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    likes INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS posts_author_created_at
+    ON posts (author, created_at, id);
+CREATE TABLE IF NOT EXISTS likes (
+    post TEXT NOT NULL,
+    liker TEXT NOT NULL,
+    liked_at REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (post, liker)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS follows (
+    follower TEXT NOT NULL,
+    followee TEXT NOT NULL,
+    PRIMARY KEY (follower, followee)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS follows_followee ON follows (followee, follower);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    origin TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    target TEXT,
+    created_at REAL NOT NULL
+);
+"""
+# Likes of databases created before likes had times are dated by the upgrade
+_LIKES_COLUMNS = "PRAGMA table_info(likes)"
+_ADD_LIKED_AT = "ALTER TABLE likes ADD COLUMN liked_at REAL NOT NULL DEFAULT 0"
+_DATE_LIKES = "UPDATE likes SET liked_at = ?"
+_LIKE_INDEXES = """
+CREATE INDEX IF NOT EXISTS likes_post_liked_at ON likes (post, liked_at, liker);
+CREATE INDEX IF NOT EXISTS likes_liker_liked_at ON likes (liker, liked_at, post);
+"""
+
+_FIND_USER = """
+SELECT username, password_hash, full_name, version, likes_version
+FROM users WHERE key = ?
+"""
+_COUNT_POSTS = "SELECT posts FROM users WHERE key = ?"
+_ANY_USER = "SELECT 1 FROM users LIMIT 1"
+_ADD_USER = """
+INSERT INTO users (key, username, password_hash, full_name) VALUES (?, ?, ?, ?)
+"""
+_SAVE_USER = """
+INSERT INTO users (key, username, password_hash, full_name) VALUES (?, ?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET
+    username = excluded.username,
+    password_hash = excluded.password_hash,
+    full_name = excluded.full_name,
+    version = version + 1
+"""
+_POST_COLUMNS = "id, author, content, created_at, likes, version"
+_FIND_POST = f"SELECT {_POST_COLUMNS} FROM posts WHERE id = ?"
+_POSTS = f"SELECT {_POST_COLUMNS} FROM posts WHERE id > ? ORDER BY id LIMIT ?"
+_SAVE_POST = "INSERT INTO posts (id, author, content, created_at) VALUES (?, ?, ?, ?)"
+_BUMP_POSTS = "UPDATE users SET posts = posts + 1, version = version + 1 WHERE key = ?"
+_NEWEST = f"""
+SELECT {_POST_COLUMNS} FROM posts WHERE author = ?
+ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?
+"""
+_BEFORE = f"""
+SELECT {_POST_COLUMNS} FROM posts WHERE author = ? AND (created_at, id) < (?, ?)
+ORDER BY created_at DESC, id DESC LIMIT ?
+"""
+_AFTER = f"""
+SELECT {_POST_COLUMNS} FROM posts WHERE author = ? AND (created_at, id) > (?, ?)
+ORDER BY created_at, id LIMIT ?
+"""
+_HAS_BEFORE = "SELECT 1 FROM posts WHERE author = ? AND (created_at, id) < (?, ?) LIMIT 1"
+_HAS_AFTER = "SELECT 1 FROM posts WHERE author = ? AND (created_at, id) > (?, ?) LIMIT 1"
+_IS_LIKED = "SELECT 1 FROM likes WHERE post = ? AND liker = ?"
+_COUNT_LIKES = "SELECT likes FROM posts WHERE id = ?"
+_LIKE = "INSERT OR IGNORE INTO likes (post, liker, liked_at) VALUES (?, ?, ?)"
+_UNLIKE = "DELETE FROM likes WHERE post = ? AND liker = ?"
+_ADJUST_LIKES = "UPDATE posts SET likes = likes + ?, version = version + 1 WHERE id = ?"
+_BUMP_AUTHOR = """
+UPDATE users SET version = version + 1
+WHERE key = (SELECT author FROM posts WHERE id = ?)
+"""
+_BUMP_LIKER = "UPDATE users SET likes_version = likes_version + 1 WHERE key = ?"
+_POST_LIKES = """
+SELECT liked_at, liker FROM likes WHERE post = ?
+ORDER BY liked_at DESC, liker DESC LIMIT ?
+"""
+_POST_LIKES_BEFORE = """
+SELECT liked_at, liker FROM likes WHERE post = ? AND (liked_at, liker) < (?, ?)
+ORDER BY liked_at DESC, liker DESC LIMIT ?
+"""
+_USER_LIKES = """
+SELECT liked_at, post FROM likes WHERE liker = ?
+ORDER BY liked_at DESC, post DESC LIMIT ?
+"""
+_USER_LIKES_BEFORE = """
+SELECT liked_at, post FROM likes WHERE liker = ? AND (liked_at, post) < (?, ?)
+ORDER BY liked_at DESC, post DESC LIMIT ?
+"""
+_FOLLOW = "INSERT OR IGNORE INTO follows (follower, followee) VALUES (?, ?)"
+_UNFOLLOW = "DELETE FROM follows WHERE follower = ? AND followee = ?"
+_ADJUST_FOLLOWERS = "UPDATE users SET followers = followers + ? WHERE key = ?"
+_FOLLOWERS = "SELECT follower FROM follows WHERE followee = ?"
+_FOLLOWING = "SELECT followee FROM follows WHERE follower = ?"
+_COUNT_FOLLOWERS = "SELECT followers FROM users WHERE key = ?"
+_IMPORT_USER = """
+INSERT OR IGNORE INTO users (key, username, password_hash, full_name)
+VALUES (?, ?, ?, ?)
+"""
+_IMPORT_POST = """
+INSERT OR IGNORE INTO posts (id, author, content, created_at)
+SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM users WHERE key = ?)
+"""
+_ADJUST_POSTS = "UPDATE users SET posts = posts + ?, version = version + 1 WHERE key = ?"
+_IMPORT_LIKE = """
+INSERT OR IGNORE INTO likes (post, liker, liked_at)
+SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM posts WHERE id = ?)
+    AND EXISTS (SELECT 1 FROM users WHERE key = ?)
+"""
+_IMPORT_FOLLOW = """
+INSERT OR IGNORE INTO follows (follower, followee)
+SELECT ?, ? WHERE EXISTS (SELECT 1 FROM users WHERE key = ?)
+    AND EXISTS (SELECT 1 FROM users WHERE key = ?)
+"""
+_COUNT_USERS = "SELECT count(*) FROM users"
+_COUNT_ALL_POSTS = "SELECT count(*), coalesce(sum(likes), 0) FROM posts"
+_INIT_EPOCH = "INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', ?)"
+_EPOCH = "SELECT value FROM meta WHERE key = 'epoch'"
+_RECORD = """
+INSERT INTO changes (origin, kind, subject, target, created_at) VALUES (?, ?, ?, ?, ?)
+"""
+# The last number given to a change, even if the change has expired since
+_LAST_CHANGE = "SELECT coalesce(max(seq), 0) FROM sqlite_sequence WHERE name = 'changes'"
+_CHANGES = """
+SELECT seq, origin, kind, subject, target FROM changes WHERE seq > ? ORDER BY seq
+"""
+_EXPIRE_CHANGES = "DELETE FROM changes WHERE created_at < ?"
+
+
+_TOTALS_TTL = 30.0
+
+
+def _timestamp(created_at: datetime) -> str:
+    # Fixed precision keeps lexicographic order equal to chronological one
+    return created_at.isoformat(timespec="microseconds")
+
+
+def _count_likes(connection: sqlite3.Connection, post_ids: Iterable[str]) -> dict[str, int]:
+    return {
+        post_id: connection.execute(_COUNT_LIKES, (post_id,)).fetchone()[0]
+        for post_id in post_ids
+    }
+
+
+class SqlitePosts:
+    """View of user posts backed by the (author, created_at, id) index"""
+
+    def __init__(self, database: "SqliteDatabase", user: User, key: str):
+        self._database = database
+        self._user = user
+        self._key = key
+
+    def _fetch(self, sql: str, *params) -> list[Post]:
+        with self._database._reader() as connection:
+            rows = connection.execute(sql, (self._key, *params)).fetchall()
+        return [self._database._post(row, self._user) for row in rows]
+
+    def _exists(self, sql: str, key: PostKey) -> bool:
+        with self._database._reader() as connection:
+            row = connection.execute(
+                sql, (self._key, _timestamp(key[0]), key[1])
+            ).fetchone()
+        return row is not None
+
+    def newest(self, offset: int = 0, limit: Optional[int] = None) -> Iterator[Post]:
+        return iter(self._fetch(_NEWEST, -1 if limit is None else limit, offset))
+
+    def before(self, key: PostKey, limit: Optional[int] = None) -> Iterator[Post]:
+        return iter(
+            self._fetch(_BEFORE, _timestamp(key[0]), key[1], -1 if limit is None else limit)
+        )
+
+    def after(self, key: PostKey, limit: int) -> Iterator[Post]:
+        return reversed(self._fetch(_AFTER, _timestamp(key[0]), key[1], limit))
+
+    def has_before(self, key: PostKey) -> bool:
+        return self._exists(_HAS_BEFORE, key)
+
+    def has_after(self, key: PostKey) -> bool:
+        return self._exists(_HAS_AFTER, key)
+
+    def __iter__(self) -> Iterator[Post]:
+        return self.newest()
+
+    def __len__(self) -> int:
+        with self._database._reader() as connection:
+            row = connection.execute(_COUNT_POSTS, (self._key,)).fetchone()
+        return 0 if row is None else row[0]
+
+
+class SqliteLikes:
+    """View of post likes backed by the (post, liker) primary key
+
+    The number of likes is read together with the post. Pages of likers are
+    read by SqliteDatabase.post_likes from the (post, liked_at, liker) index.
+    """
+
+    def __init__(self, database: "SqliteDatabase", post_id: str, count: int):
+        self._database = database
+        self._post_id = post_id
+        self._count = count
+
+    def __contains__(self, username: object) -> bool:
+        # Likes are read from the queue until they are applied
+        pending = self._database._likes.pending(self._post_id, str(username))
+        if pending is not None:
+            return pending
+        with self._database._reader() as connection:
+            row = connection.execute(_IS_LIKED, (self._post_id, username)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class SqliteDatabase:
+    def __init__(
+        self,
+        path: str,
+        pool_size: int = SQLITE_POOL_SIZE,
+        like_batch_size: int = LIKE_BATCH_SIZE,
+        like_batch_delay: float = LIKE_BATCH_DELAY,
+    ):
+        self._path = path
+        self._writer = self._connect()
+        self._writer.execute("PRAGMA journal_mode = WAL")
+        self._writer.executescript(_SCHEMA)
+        self._writer.execute(_INIT_EPOCH, (secrets.token_hex(8),))
+        self.epoch = self._writer.execute(_EPOCH).fetchone()[0]
+        # Identifies changes made by this process
+        self._origin = secrets.token_hex(8)
+        self._expired_at = 0.0
+        # Numbers of users, posts and likes take full scans to count, so they
+        # are counted at most every _TOTALS_TTL seconds
+        self._totals: dict[str, float] = {}
+        self._totals_at = 0.0
+        self._write_lock = threading.Lock()
+        self._upgrade()
+        self._pool: queue.SimpleQueue[sqlite3.Connection] = queue.SimpleQueue()
+        for _ in range(pool_size):
+            self._pool.put(self._connect())
+        self.on_likes: Optional[Callable[[dict[str, int]], None]] = None
+        self._likes = LikeQueue(self._apply_likes, like_batch_size, like_batch_delay)
+        # Number of the last like queued in the current context (request)
+        self._queued: ContextVar[int] = ContextVar("queued", default=0)
+
+    def _upgrade(self) -> None:
+        # Columns are checked within the transaction, as other workers may be
+        # upgrading the database at the same time
+        with self._transaction() as connection:
+            columns = [row[1] for row in connection.execute(_LIKES_COLUMNS)]
+            if "liked_at" not in columns:
+                connection.execute(_ADD_LIKED_AT)
+                connection.execute(_DATE_LIKES, (time.time(),))
+        self._writer.executescript(_LIKE_INDEXES)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            self._path,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=64,
+        )
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute("PRAGMA busy_timeout = 5000")
+        return connection
+
+    @contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        # Queued likes are not flushed by reads, they are applied in batches
+        connection = self._pool.get()
+        try:
+            yield connection
+        finally:
+            self._pool.put(connection)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._writer
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+            self._writer.execute("COMMIT")
+
+    def _user(self, key: str, row) -> User:
+        user = User(
+            username=row[0],
+            password_hash=row[1],
+            full_name=row[2],
+            version=row[3],
+            likes_version=row[4],
+        )
+        user.posts = SqlitePosts(self, user, key)
+        return user
+
+    def _post(self, row, author: Optional[User] = None) -> Post:
+        if author is None:
+            author = self.find_user(row[1])
+            assert author is not None
+        return Post(
+            id=row[0],
+            author=author,
+            content=row[2],
+            created_at=datetime.fromisoformat(row[3]),
+            likes=SqliteLikes(self, row[0], row[4]),
+            version=row[5],
+        )
+
+    def find_user(self, username: str) -> Optional[User]:
+        with self._reader() as connection:
+            row = connection.execute(_FIND_USER, (username,)).fetchone()
+        return None if row is None else self._user(username, row)
+
+    def find_post(self, post_id: str) -> Optional[Post]:
+        with self._reader() as connection:
+            row = connection.execute(_FIND_POST, (post_id,)).fetchone()
+        return None if row is None else self._post(row)
+
+    def posts(self) -> Iterator[Post]:
+        authors: dict[str, Optional[User]] = {}
+        last = ""
+        while True:
+            with self._reader() as connection:
+                rows = connection.execute(_POSTS, (last, 1000)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                if row[1] not in authors:
+                    authors[row[1]] = self.find_user(row[1])
+                author = authors[row[1]]
+                if author is not None:
+                    yield self._post(row, author)
+            last = rows[-1][0]
+
+    def is_empty(self) -> bool:
+        with self._reader() as connection:
+            return connection.execute(_ANY_USER).fetchone() is None
+
+    def stats(self) -> dict[str, float]:
+        now = time.monotonic()
+        if now - self._totals_at >= _TOTALS_TTL:
+            with self._reader() as connection:
+                (users,) = connection.execute(_COUNT_USERS).fetchone()
+                posts, likes = connection.execute(_COUNT_ALL_POSTS).fetchone()
+            self._totals = {"users": users, "posts": posts, "likes": likes}
+            self._totals_at = now
+        return {**self._totals, **self._likes.stats()}
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        with open(f"{self._path}.lock", "w") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            yield
+
+    def _record(
+        self,
+        connection: sqlite3.Connection,
+        kind: str,
+        subject: str,
+        target: Optional[str] = None,
+    ) -> None:
+        now = time.time()
+        connection.execute(_RECORD, (self._origin, kind, subject, target, now))
+        if now - self._expired_at >= CHANGES_RETENTION / 2:
+            self._expired_at = now
+            connection.execute(_EXPIRE_CHANGES, (now - CHANGES_RETENTION,))
+
+    def last_change(self) -> int:
+        with self._reader() as connection:
+            return connection.execute(_LAST_CHANGE).fetchone()[0]
+
+    def changes(
+        self, after: int
+    ) -> tuple[int, Optional[list[tuple[str, str, Optional[str]]]]]:
+        """Returns last change number and changes of other processes after {after}
+
+        Changes are (kind, subject, target) triples. Instead of them None is
+        returned if some changes after {after} have expired already.
+        """
+        with self._reader() as connection:
+            rows = connection.execute(_CHANGES, (after,)).fetchall()
+            if not rows:
+                last = connection.execute(_LAST_CHANGE).fetchone()[0]
+        if not rows:
+            # All changes after {after} may have expired already
+            return (after, []) if last <= after else (last, None)
+        if rows[0][0] != after + 1:
+            return rows[-1][0], None
+        return rows[-1][0], [
+            (kind, subject, target)
+            for _, origin, kind, subject, target in rows
+            if origin != self._origin
+        ]
+
+    def save_user(self, key: str, user: User):
+        with self._transaction() as connection:
+            connection.execute(
+                _SAVE_USER, (key, user.username, user.password_hash, user.full_name)
+            )
+
+    def add_user(self, key: str, user: User) -> bool:
+        try:
+            with self._transaction() as connection:
+                connection.execute(
+                    _ADD_USER, (key, user.username, user.password_hash, user.full_name)
+                )
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def save_post(self, post: Post):
+        if not post.id:
+            post.id = uuid4().hex
+        author = post.author.username.lower()
+        with self._transaction() as connection:
+            connection.execute(
+                _SAVE_POST, (post.id, author, post.content, _timestamp(post.created_at))
+            )
+            connection.execute(_BUMP_POSTS, (author,))
+            self._record(connection, "post", post.id)
+
+    def import_batch(self, batch: ImportBatch) -> Imported:
+        users = likes = follows = 0
+        posts = []
+        authors: Counter[str] = Counter()
+        liked: Counter[str] = Counter()
+        likers = set()
+        with self._transaction() as connection:
+            for key, user in batch.users:
+                users += connection.execute(
+                    _IMPORT_USER, (key, user.username, user.password_hash, user.full_name)
+                ).rowcount
+            for post in batch.posts:
+                author = post.author.username.lower()
+                params = (post.id, author, post.content, _timestamp(post.created_at))
+                if connection.execute(_IMPORT_POST, (*params, author)).rowcount:
+                    authors[author] += 1
+                    posts.append(post)
+                    # Other workers index imported posts, but do not stream them
+                    self._record(connection, "import", post.id)
+            connection.executemany(
+                _ADJUST_POSTS, [(count, author) for author, count in authors.items()]
+            )
+            for post_id, username, liked_at in batch.likes:
+                params = (post_id, username, liked_at, post_id, username)
+                if connection.execute(_IMPORT_LIKE, params).rowcount:
+                    liked[post_id] += 1
+                    likers.add(username)
+                    likes += 1
+            for post_id, count in liked.items():
+                connection.execute(_ADJUST_LIKES, (count, post_id))
+                connection.execute(_BUMP_AUTHOR, (post_id,))
+                self._record(connection, "likes", post_id)
+            counts = _count_likes(connection, liked)
+            connection.executemany(_BUMP_LIKER, [(username,) for username in likers])
+            for follower, followee in batch.follows:
+                params = (follower, followee, follower, followee)
+                if connection.execute(_IMPORT_FOLLOW, params).rowcount:
+                    connection.execute(_ADJUST_FOLLOWERS, (1, followee))
+                    self._record(connection, "follow", follower, followee)
+                    follows += 1
+        # Posts are returned as stored, so that they are ranked by their likes
+        for post in posts:
+            post.likes = SqliteLikes(self, post.id, counts.get(post.id, 0))
+        if counts and self.on_likes is not None:
+            self.on_likes(counts)
+        return Imported(users, posts, likes, follows)
+
+    def add_like(self, post: Post, username: str, liked_at: Optional[float] = None):
+        self._queued.set(self._likes.put(True, post.id, username, liked_at))
+
+    def remove_like(self, post: Post, username: str):
+        self._queued.set(self._likes.put(False, post.id, username))
+
+    def is_liked(self, post: Post, username: str) -> bool:
+        return username in post.likes
+
+    def _like_keys(
+        self, sql: str, sql_before: str, key: str, before: Optional[LikeKey], limit: int
+    ) -> LikesPage:
+        with self._reader() as connection:
+            if before is None:
+                rows = connection.execute(sql, (key, limit + 1)).fetchall()
+            else:
+                rows = connection.execute(sql_before, (key, *before, limit + 1)).fetchall()
+        return LikesPage([(at, name) for at, name in rows[:limit]], len(rows) > limit)
+
+    def post_likes(
+        self, post: Post, before: Optional[LikeKey], limit: int
+    ) -> LikesPage:
+        return self._like_keys(_POST_LIKES, _POST_LIKES_BEFORE, post.id, before, limit)
+
+    def user_likes(
+        self, username: str, before: Optional[LikeKey], limit: int
+    ) -> LikesPage:
+        return self._like_keys(_USER_LIKES, _USER_LIKES_BEFORE, username, before, limit)
+
+    def follow(self, follower: str, followee: str):
+        with self._transaction() as connection:
+            if connection.execute(_FOLLOW, (follower, followee)).rowcount:
+                connection.execute(_ADJUST_FOLLOWERS, (1, followee))
+                self._record(connection, "follow", follower, followee)
+
+    def unfollow(self, follower: str, followee: str):
+        with self._transaction() as connection:
+            if connection.execute(_UNFOLLOW, (follower, followee)).rowcount:
+                connection.execute(_ADJUST_FOLLOWERS, (-1, followee))
+                self._record(connection, "follow", follower, followee)
+
+    def followers(self, username: str) -> Iterable[str]:
+        with self._reader() as connection:
+            return [row[0] for row in connection.execute(_FOLLOWERS, (username,))]
+
+    def following(self, username: str) -> Iterable[str]:
+        with self._reader() as connection:
+            return [row[0] for row in connection.execute(_FOLLOWING, (username,))]
+
+    def count_followers(self, username: str) -> int:
+        with self._reader() as connection:
+            row = connection.execute(_COUNT_FOLLOWERS, (username,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def _apply_likes(self, intents: list[Intent]) -> None:
+        changed = set()
+        with self._transaction() as connection:
+            for like, post_id, username, at in intents:
+                if like:
+                    delta = connection.execute(_LIKE, (post_id, username, at)).rowcount
+                else:
+                    delta = -connection.execute(_UNLIKE, (post_id, username)).rowcount
+                if delta:
+                    connection.execute(_ADJUST_LIKES, (delta, post_id))
+                    connection.execute(_BUMP_AUTHOR, (post_id,))
+                    connection.execute(_BUMP_LIKER, (username,))
+                    changed.add(post_id)
+            for post_id in changed:
+                self._record(connection, "likes", post_id)
+            counts = _count_likes(connection, changed)
+        if counts and self.on_likes is not None:
+            self.on_likes(counts)
+
+    async def sync(self) -> None:
+        # Other transactions are committed already. Waiting for the batch of
+        # likes of the request makes them visible to other processes before
+        # the request completes, while likes of concurrent requests share it
+        applied = self._likes.when_applied(self._queued.get())
+        if not applied.done():
+            await asyncio.wrap_future(applied)
+
+    def close(self) -> None:
+        self._likes.close()
+        while not self._pool.empty():
+            self._pool.get().close()
+        self._writer.close()
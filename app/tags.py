@@ -0,0 +1,231 @@
+"""Hashtags, mentions and trending tags
+
+Hashtags (#word) and mentions (@username) are extracted from every new post.
+Each tag and each mentioned user has an index of (created_at, id) keys of
+posts carrying it, ordered by key.
+
+Trending tags are counted over sliding windows. A window is split into
+buckets of equal duration, each holding a count-min sketch of tags of posts
+created within it; the sketch of the whole window is the sum of sketches of
+its buckets, and the oldest bucket is subtracted from it when it expires.
+Tags with the highest estimated counts are tracked in a bounded table, so
+memory does not depend on the number of distinct tags, and reading trending
+tags does not scan posts.
+"""
+
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+from typing import NamedTuple, Optional
+
+from .config import TRENDING_SKETCH_WIDTH, TRENDING_TOP
+from .db import Post, PostKey, post_key
+
+_TAG = re.compile(r"(?<![\w#])#(\w+)")
+_MENTION = re.compile(r"(?<![\w@])@([a-zA-Z0-9_]+)")
+_DEPTH = 4
+
+# Windows of trending tags: duration and number of buckets
+WINDOWS = {"1h": (3600, 12), "24h": (86400, 24)}
+
+
+def normalize_tag(tag: str) -> str:
+    return unicodedata.normalize("NFKC", tag.removeprefix("#")).casefold()
+
+
+class Tags(NamedTuple):
+    hashtags: set[str]
+    mentions: set[str]
+
+
+def extract(content: str) -> Tags:
+    return Tags(
+        hashtags={normalize_tag(tag) for tag in _TAG.findall(content)},
+        mentions={username.lower() for username in _MENTION.findall(content)},
+    )
+
+
+class PostIndex:
+    """Keys of posts by name, newest last"""
+
+    def __init__(self):
+        self._keys: dict[str, list[PostKey]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, key: PostKey) -> None:
+        with self._lock:
+            keys = self._keys.setdefault(name, [])
+            if not keys or keys[-1] < key:
+                keys.append(key)
+                return
+            index = bisect_left(keys, key)
+            if index == len(keys) or keys[index] != key:
+                keys.insert(index, key)
+
+    def before(
+        self, name: str, before: Optional[PostKey], limit: int
+    ) -> tuple[list[PostKey], bool]:
+        """Returns up to {limit} keys older than {before}, newest first
+
+        Also returns whether there are more keys.
+        """
+        keys = self._keys.get(name, [])
+        end = len(keys) if before is None else bisect_left(keys, before)
+        page = keys[max(0, end - limit - 1) : end][::-1]
+        return page[:limit], len(page) > limit
+
+    def reset(self) -> None:
+        with self._lock:
+            self._keys = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+def _cells(item: str, width: int) -> list[int]:
+    """Returns counters of the item in every row of a count-min sketch"""
+    value = hash(item)
+    result = []
+    for row in range(_DEPTH):
+        result.append(row * width + value % width)
+        value //= width
+    return result
+
+
+class CountMinSketch:
+    __slots__ = ("counts",)
+
+    def __init__(self, width: int):
+        self.counts = array("I", bytes(4 * width * _DEPTH))
+
+    def add(self, cells: list[int], count: int = 1) -> None:
+        for cell in cells:
+            self.counts[cell] += count
+
+    def estimate(self, cells: list[int]) -> int:
+        return min(self.counts[cell] for cell in cells)
+
+    def subtract(self, other: "CountMinSketch") -> None:
+        counts = self.counts
+        for cell, count in enumerate(other.counts):
+            if count:
+                counts[cell] -= count
+
+
+class TrendingWindow:
+    def __init__(self, duration: float, buckets: int, width: int, top: int):
+        self._bucket_duration = duration / buckets
+        self._size = buckets
+        self._width = width
+        self._buckets: dict[int, CountMinSketch] = {}
+        self._oldest = 0
+        self._total = CountMinSketch(width)
+        # Estimated counts of tags which are likely the most frequent ones,
+        # and min-heap of (count, tag) entries; entries whose count differs
+        # from the table are outdated and skipped
+        self._top: dict[str, int] = {}
+        self._heap: list[tuple[int, str]] = []
+        self._capacity = top
+        self._lock = threading.Lock()
+
+    def _expire(self, current: int) -> None:
+        if self._oldest > current - self._size:
+            return
+        for bucket in [b for b in self._buckets if b <= current - self._size]:
+            self._total.subtract(self._buckets.pop(bucket))
+        self._oldest = min(self._buckets, default=current)
+        for tag in list(self._top):
+            count = self._total.estimate(_cells(tag, self._width))
+            if count:
+                self._top[tag] = count
+            else:
+                del self._top[tag]
+        self._heap = [(count, tag) for tag, count in self._top.items()]
+        heapq.heapify(self._heap)
+
+    def _lowest(self) -> tuple[int, str]:
+        heap = self._heap
+        while self._top.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0]
+
+    def add(self, tag: str, cells: list[int], timestamp: float) -> None:
+        bucket = int(timestamp // self._bucket_duration)
+        with self._lock:
+            current = int(time.time() // self._bucket_duration)
+            self._expire(current)
+            if bucket <= current - self._size:
+                return
+            sketch = self._buckets.get(bucket)
+            if sketch is None:
+                sketch = self._buckets[bucket] = CountMinSketch(self._width)
+                self._oldest = min(self._oldest, bucket)
+            sketch.add(cells)
+            self._total.add(cells)
+            count = self._total.estimate(cells)
+            if tag not in self._top and len(self._top) >= self._capacity:
+                lowest, lowest_tag = self._lowest()
+                if count <= lowest:
+                    return
+                del self._top[lowest_tag]
+            self._top[tag] = count
+            heapq.heappush(self._heap, (count, tag))
+            if len(self._heap) > 4 * self._capacity:
+                self._heap = [(count, tag) for tag, count in self._top.items()]
+                heapq.heapify(self._heap)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._buckets = {}
+            self._oldest = 0
+            self._total = CountMinSketch(self._width)
+            self._top = {}
+            self._heap = []
+
+    def top(self, limit: int) -> list[tuple[str, int]]:
+        """Returns up to {limit} tags with the highest estimated counts"""
+        with self._lock:
+            self._expire(int(time.time() // self._bucket_duration))
+            return heapq.nsmallest(
+                limit, self._top.items(), key=lambda item: (-item[1], item[0])
+            )
+
+
+class Trending:
+    def __init__(self, width: int, top: int):
+        self._width = width
+        self.hashtags = PostIndex()
+        self.mentions = PostIndex()
+        self.windows = {
+            name: TrendingWindow(duration, buckets, width, top)
+            for name, (duration, buckets) in WINDOWS.items()
+        }
+
+    def on_post(self, post: Post) -> None:
+        tags = extract(post.content)
+        key = post_key(post)
+        timestamp = post.created_at.timestamp()
+        for tag in tags.hashtags:
+            self.hashtags.add(tag, key)
+            tag_cells = _cells(tag, self._width)
+            for window in self.windows.values():
+                window.add(tag, tag_cells, timestamp)
+        for username in tags.mentions:
+            self.mentions.add(username, key)
+
+    def reset(self) -> None:
+        """Forgets all posts and tag counts"""
+        self.hashtags.reset()
+        self.mentions.reset()
+        for window in self.windows.values():
+            window.reset()
+
+    def top(self, window: str, limit: int) -> list[tuple[str, int]]:
+        return self.windows[window].top(limit)
+
+
+trending = Trending(TRENDING_SKETCH_WIDTH, TRENDING_TOP)
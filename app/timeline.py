@@ -0,0 +1,142 @@
+"""Home timelines with posts of followed users
+
+A timeline is materialized on the first read and then kept up to date with
+fan-out on write: a new post is pushed into the timelines of its author's
+followers. Posts of authors with more than TIMELINE_FANOUT_LIMIT followers
+are not pushed; they are merged into the timeline on read instead, so each
+timeline remembers which of the followed authors are such celebrities.
+
+Timelines keep only (created_at, id) keys of the newest TIMELINE_SIZE posts,
+and are rebuilt from scratch whenever the user follows or unfollows someone.
+"""
+
+import heapq
+from bisect import bisect_left, insort
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+
+from .config import TIMELINE_FANOUT_LIMIT, TIMELINE_SIZE
+from .db import Post, PostKey, Storage, database, post_key
+
+
+def _unique(posts: Iterable[Post]) -> Iterator[Post]:
+    # Merged sources are ordered by key, so duplicates are always adjacent
+    last = None
+    for post in posts:
+        if post.id != last:
+            last = post.id
+            yield post
+
+
+class _Timeline:
+    def __init__(self, capacity: int, keys: list[PostKey], celebrities: set[str]):
+        self._capacity = capacity
+        self._keys = keys
+        self.celebrities = celebrities
+
+    def add(self, key: PostKey) -> None:
+        if not self._keys or self._keys[-1] <= key:
+            self._keys.append(key)
+        else:
+            insort(self._keys, key)
+        # Trim in bulk, so each insert costs amortized O(1)
+        if len(self._keys) >= 2 * self._capacity:
+            del self._keys[: len(self._keys) - self._capacity]
+
+    def before(self, key: Optional[PostKey]) -> Iterator[PostKey]:
+        start = len(self._keys) if key is None else bisect_left(self._keys, key)
+        for index in range(start - 1, -1, -1):
+            yield self._keys[index]
+
+
+class Timelines:
+    def __init__(self, storage: Storage, capacity: int, fanout_limit: int):
+        self._storage = storage
+        self._capacity = capacity
+        self._fanout_limit = fanout_limit
+        self._timelines: dict[str, _Timeline] = {}
+        self._celebrities: set[str] = set()
+
+    def _is_celebrity(self, username: str) -> bool:
+        celebrity = self._storage.count_followers(username) > self._fanout_limit
+        if celebrity and username not in self._celebrities:
+            self._celebrities.add(username)
+            for follower in self._storage.followers(username):
+                timeline = self._timelines.get(follower)
+                if timeline is not None:
+                    timeline.celebrities.add(username)
+        elif not celebrity and username in self._celebrities:
+            self._celebrities.discard(username)
+            # Timelines miss the posts which were not pushed, so they are rebuilt
+            for follower in self._storage.followers(username):
+                self._timelines.pop(follower, None)
+        return celebrity
+
+    def _build(self, username: str) -> _Timeline:
+        following = list(self._storage.following(username))
+        sources = []
+        for author in (username, *following):
+            user = self._storage.find_user(author)
+            if user is not None:
+                sources.append(user.posts.newest(limit=self._capacity))
+        merged = heapq.merge(*sources, key=post_key, reverse=True)
+        keys = [post_key(post) for post in islice(_unique(merged), self._capacity)]
+        keys.reverse()
+        celebrities = self._celebrities.intersection(following)
+        timeline = _Timeline(self._capacity, keys, celebrities)
+        self._timelines[username] = timeline
+        return timeline
+
+    def _resolve(self, keys: Iterable[PostKey]) -> Iterator[Post]:
+        for _, post_id in keys:
+            post = self._storage.find_post(post_id)
+            if post is not None:
+                yield post
+
+    def page(
+        self, username: str, before: Optional[PostKey], limit: int
+    ) -> tuple[list[Post], bool]:
+        """Returns up to {limit} posts older than {before} and if there are more
+
+        Once the timeline is built, cost depends on the page size and on the
+        number of followed authors with too many followers to be fanned out on
+        write, but not on the number of followed users.
+        """
+        timeline = self._timelines.get(username)
+        if timeline is None:
+            timeline = self._build(username)
+        sources = [self._resolve(timeline.before(before))]
+        for celebrity in timeline.celebrities:
+            author = self._storage.find_user(celebrity)
+            if author is None:
+                continue
+            if before is None:
+                sources.append(author.posts.newest(limit=limit + 1))
+            else:
+                sources.append(author.posts.before(before, limit + 1))
+        merged = heapq.merge(*sources, key=post_key, reverse=True)
+        posts = list(islice(_unique(merged), limit + 1))
+        return posts[:limit], len(posts) > limit
+
+    def on_post(self, post: Post) -> None:
+        author = post.author.username.lower()
+        key = post_key(post)
+        if author in self._timelines:
+            self._timelines[author].add(key)
+        if self._is_celebrity(author):
+            return
+        for follower in self._storage.followers(author):
+            timeline = self._timelines.get(follower)
+            if timeline is not None:
+                timeline.add(key)
+
+    def on_follows_changed(self, follower: str, followee: str) -> None:
+        self._timelines.pop(follower, None)
+        self._is_celebrity(followee)
+
+    def reset(self) -> None:
+        """Drops all timelines, so that they are built again on read"""
+        self._timelines.clear()
+
+
+timelines = Timelines(database, TIMELINE_SIZE, TIMELINE_FANOUT_LIMIT)
@@ -0,0 +1,21 @@
+import os
+import tempfile
+
+# Settings are read when the app is imported
+_data = tempfile.mkdtemp(prefix="kpitter-tests-")
+os.environ.setdefault("KPITTER_STORAGE", "sqlite")
+os.environ.setdefault("KPITTER_SQLITE_PATH", os.path.join(_data, "kpitter.db"))
+os.environ.setdefault("KPITTER_SEED", "none")
+os.environ.setdefault("KPITTER_HASH_WORKERS", "0")
+os.environ.setdefault("KPITTER_IMPORT_TOKEN", "test")
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="session")
+def client():
+    from app.main import app
+
+    with TestClient(app) as client:
+        yield client
@@ -0,0 +1,34 @@
+from types import SimpleNamespace
+
+from app import cache
+from app.cache import CredentialCache
+
+
+def test_credentials_expire_and_least_recent_are_evicted(monkeypatch):
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    credentials = CredentialCache(maxsize=2, ttl=10)
+
+    credentials.add("alice", "secret", b"hash1")
+    assert credentials.check("alice", "secret", b"hash1")
+    assert not credentials.check("alice", "wrong", b"hash1")
+    # An entry of another password hash is dropped
+    assert not credentials.check("alice", "secret", b"hash2")
+    assert not credentials.check("alice", "secret", b"hash1")
+
+    credentials.add("alice", "secret", b"hash1")
+    clock.now = 9.9
+    assert credentials.check("alice", "secret", b"hash1")
+    clock.now = 10
+    assert not credentials.check("alice", "secret", b"hash1")
+    assert len(credentials) == 0
+
+    credentials.add("alice", "secret", b"hash1")
+    credentials.add("bob", "secret", b"hash1")
+    # Checking alice makes bob the least recently used entry
+    assert credentials.check("alice", "secret", b"hash1")
+    credentials.add("carol", "secret", b"hash1")
+    assert not credentials.check("bob", "secret", b"hash1")
+    assert credentials.check("alice", "secret", b"hash1")
+    assert credentials.check("carol", "secret", b"hash1")
+    assert credentials.stats() == {"size": 2, "hits": 5, "misses": 5, "evictions": 3}
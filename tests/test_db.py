@@ -0,0 +1,123 @@
+import random
+import sys
+import threading
+from datetime import datetime, timedelta
+
+from app.db import Database, LikeLog, Post, User, post_key
+from app.journal import close_journal, open_journal
+
+_USERS = 400
+_THREADS = 8
+_POSTS = 300
+
+
+def _write(database: Database, hot: Post, number: int) -> None:
+    rnd = random.Random(number)
+    mine = [f"u{i}" for i in range(number, _USERS, _THREADS)]
+    for name in mine:
+        database.add_like(hot, name)
+        database.add_like(hot, name)
+    for name in mine[::2]:
+        database.remove_like(hot, name)
+    start = datetime(2024, 1, 1)
+    for k in range(_POSTS):
+        author = database.find_user(f"u{rnd.randrange(_USERS)}")
+        created_at = start + timedelta(seconds=rnd.randrange(10**6))
+        database.save_post(Post(f"p{number}-{k}", author, "x", created_at))
+        user, other = mine[k % len(mine)], f"u{rnd.randrange(_USERS)}"
+        database.follow(user, other)
+        database.follow(other, user)
+        if k % 3 == 0:
+            database.unfollow(other, user)
+
+
+def _likers(database: Database, post_id: str) -> set[str]:
+    return {name for name, _ in database.likers(database.find_post(post_id))}
+
+
+def _follows(database: Database) -> list[tuple[str, list[str]]]:
+    return sorted((user, sorted(users)) for user, users in database.follows() if users)
+
+
+def test_concurrent_writes_to_shards(tmp_path):
+    # Threads are switched as often as possible, to interleave their writes
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    database = Database(shards=16)
+    journal = open_journal(database, str(tmp_path), snapshot_interval=0.05)
+    try:
+        for i in range(_USERS):
+            database.save_user(f"u{i}", User(f"U{i}", "hash", None))
+        hot = Post("hot", database.find_user("u0"), "hot", datetime.now())
+        database.save_post(hot)
+        threads = [
+            threading.Thread(target=_write, args=(database, hot, number))
+            for number in range(_THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(60)
+        assert not any(thread.is_alive() for thread in threads), "Deadlock"
+        database.flush_likes()
+    finally:
+        sys.setswitchinterval(interval)
+        close_journal(database, journal)
+
+    # Every thread unliked every other post of its users
+    likers = {f"u{i}" for i in range(_USERS) if i // _THREADS % 2}
+    assert _likers(database, "hot") == likers
+    assert len(hot.likes) == len(likers)
+    total = 0
+    for _, user in database.users():
+        posts = list(user.posts.newest())
+        keys = [post_key(post) for post in posts]
+        assert keys == sorted(set(keys), reverse=True)
+        assert all(post.author is user for post in posts)
+        total += len(posts)
+    assert total == len(list(database.posts())) == _THREADS * _POSTS + 1
+    for follower, followees in database.follows():
+        for followee in followees:
+            assert follower in database.followers(followee)
+
+    # Snapshots taken during writes and the journal restore the same state
+    replayed = Database(shards=4)
+    close_journal(replayed, open_journal(replayed, str(tmp_path)))
+    assert _likers(replayed, "hot") == likers
+    assert sorted(post.id for post in replayed.posts()) == sorted(
+        post.id for post in database.posts()
+    )
+    assert _follows(replayed) == _follows(database)
+
+
+def test_like_log_keeps_likes_in_order_of_time():
+    rnd = random.Random(0)
+    log = LikeLog()
+    liked: set[int] = set()
+    now = 0.0
+    for _ in range(5000):
+        item = rnd.randrange(1000)
+        if rnd.random() < 0.7:
+            # Most likes are late, some have the time of another like
+            now += rnd.random()
+            at = now if rnd.random() < 0.3 else now - rnd.random() * 1000
+            if rnd.random() < 0.05:
+                at = float(round(at))
+            assert log.add(item, at) == (item not in liked)
+            liked.add(item)
+        else:
+            assert log.discard(item) == (item in liked)
+            liked.discard(item)
+        assert len(log) == len(liked)
+    assert all((item in log) == (item in liked) for item in range(1000))
+
+    likes = list(log)
+    times = [at for at, _ in likes]
+    assert times == sorted(set(times))
+    assert {item for _, item in likes} == liked
+    pages, before, more = [], None, True
+    while more:
+        page, more = log.newest(before, 7)
+        pages += page
+        before = page[-1][0] if page else None
+    assert pages == likes[::-1]
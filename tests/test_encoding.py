@@ -0,0 +1,39 @@
+import pytest
+
+msgpack = pytest.importorskip("msgpack")
+
+_MSGPACK = {"Accept": "application/msgpack"}
+
+
+def test_msgpack_responses_match_json(client):
+    auth = ("packed_author", "password1")
+    response = client.post(
+        "/api/register", json={"username": auth[0], "password": auth[1]}
+    )
+    assert response.status_code == 201
+    response = client.post(
+        f"/api/users/{auth[0]}/posts", json={"content": "Packed post"}, auth=auth
+    )
+    post = response.json()
+    refs = [
+        {"username": auth[0], "post_id": post["id"]},
+        {"username": auth[0], "post_id": "missing"},
+    ]
+
+    requests = [
+        ("GET", f"/api/users/{auth[0]}", None, {}),
+        ("GET", f"/api/users/{auth[0]}/posts/{post['id']}", None, {}),
+        ("GET", f"/api/users/{auth[0]}/posts", None, {"shape": "normalized"}),
+        ("POST", "/api/posts:batchGet", {"posts": refs}, {}),
+        ("GET", "/api/users/missing", None, {}),
+    ]
+    for method, url, body, params in requests:
+        expected = client.request(method, url, json=body, params=params, auth=auth)
+        packed = client.request(
+            method, url, json=body, params=params, auth=auth, headers=_MSGPACK
+        )
+        assert packed.status_code == expected.status_code
+        assert packed.headers["content-type"] == "application/msgpack"
+        assert msgpack.unpackb(packed.content) == expected.json()
+        if "etag" in expected.headers:
+            assert packed.headers["etag"] == "W/" + expected.headers["etag"]
@@ -0,0 +1,50 @@
+def _register(client, username: str) -> tuple[str, str]:
+    auth = (username, "password1")
+    response = client.post(
+        "/api/register", json={"username": auth[0], "password": auth[1]}
+    )
+    assert response.status_code == 201
+    return auth
+
+
+def _etag(client, url: str, auth=None) -> str:
+    response = client.get(url, auth=auth)
+    assert response.status_code == 200
+    return response.headers["etag"]
+
+
+def _modified(client, url: str, etag: str, auth=None) -> bool:
+    response = client.get(url, auth=auth, headers={"If-None-Match": etag})
+    assert response.status_code in (200, 304)
+    if response.status_code == 304:
+        assert response.headers["etag"] == etag
+        assert not response.content
+    return response.status_code == 200
+
+
+def test_etags_change_with_posts_and_likes(client):
+    author = _register(client, "etag_author")
+    fan = _register(client, "etag_fan")
+    user_url = f"/api/users/{author[0]}"
+    posts_url = f"/api/users/{author[0]}/posts"
+
+    user = _etag(client, user_url)
+    assert not _modified(client, user_url, user)
+    response = client.post(posts_url, json={"content": "Tagged post"}, auth=author)
+    post_url = f"{posts_url}/{response.json()['id']}"
+    assert _modified(client, user_url, user)
+
+    posts = _etag(client, posts_url, fan)
+    post = _etag(client, post_url, fan)
+    anonymous = _etag(client, post_url)
+    assert not _modified(client, posts_url, posts, fan)
+    assert not _modified(client, post_url, post, fan)
+
+    response = client.put(f"{post_url}/like", auth=fan)
+    assert response.status_code == 201
+    assert _modified(client, posts_url, posts, fan)
+    assert _modified(client, post_url, post, fan)
+    assert client.get(post_url, auth=fan).json()["is_liked"]
+    # Others see the number of likes change, but not the like of the fan
+    assert _modified(client, post_url, anonymous)
+    assert _etag(client, post_url) != _etag(client, post_url, fan)
@@ -0,0 +1,38 @@
+import json
+from uuid import uuid4
+
+
+def _lines(records: list[dict]) -> bytes:
+    return "".join(json.dumps(record) + "\n" for record in records).encode()
+
+
+def test_imported_posts_are_ranked_by_likes(client):
+    users = ["ranked_author", "ranked_fan1", "ranked_fan2", "ranked_fan3"]
+    posts = [uuid4().hex for _ in range(4)]
+    records = [
+        {"type": "user", "username": name, "password": "password1"} for name in users
+    ]
+    records += [
+        {"type": "post", "id": post, "author": users[0], "content": f"Post {n}"}
+        for n, post in enumerate(posts)
+    ]
+    # Posts get 2, 3, 0 and 1 likes
+    for post, likers in zip(posts, [users[1:3], users[1:], [], users[3:]]):
+        records += [
+            {"type": "like", "post_id": post, "username": name} for name in likers
+        ]
+    response = client.post(
+        "/api/import",
+        content=_lines(records),
+        headers={"X-Import-Token": "test", "Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    assert response.json()["likes"] == 6
+
+    response = client.get("/api/posts/top", params={"limit": 10})
+    assert response.status_code == 200
+    # Other tests share the storage, and may have published posts too
+    top = [
+        (post["id"], post["likes"]) for post in response.json() if post["id"] in posts
+    ]
+    assert top == [(posts[1], 3), (posts[0], 2), (posts[3], 1), (posts[2], 0)]
@@ -0,0 +1,107 @@
+import json
+from datetime import datetime
+
+from app.db import Database, Post, User
+from app.journal import close_journal, open_journal
+
+
+def _likers(database: Database, post: Post) -> list[str]:
+    return sorted(name for name, _ in database.likers(post))
+
+
+def _state(database: Database) -> tuple:
+    users = sorted((key, user.username) for key, user in database.users())
+    posts = sorted(
+        (post.id, post.author.username, _likers(database, post))
+        for post in database.posts()
+    )
+    follows = sorted(
+        (user, sorted(users)) for user, users in database.follows() if users
+    )
+    return users, posts, follows
+
+
+def test_snapshot_includes_writes_made_while_copying(tmp_path):
+    database = Database(shards=4)
+    journal = open_journal(database, str(tmp_path), snapshot_interval=3600)
+    names = [f"u{i}" for i in range(8)]
+    for name in names:
+        database.save_user(name, User(name, "hash", None))
+    post = Post("first", database.find_user("u0"), "First", datetime(2024, 1, 1))
+    database.save_post(post)
+    copy_shards = database.copy_shards
+
+    def copy_while_writing():
+        for number, copy in enumerate(copy_shards()):
+            # Writes land in shards copied already and in the ones not copied yet
+            name = f"late{number}"
+            database.save_user(name, User(name, "hash", None))
+            late = Post(name, database.find_user(name), "Late", datetime(2024, 1, 2))
+            database.save_post(late)
+            database.add_like(post, names[number])
+            database.add_like(late, names[number])
+            if number:
+                database.remove_like(post, names[number - 1])
+            database.flush_likes()
+            database.follow(names[number], name)
+            database.unfollow(names[number], f"late{number - 1}")
+            yield copy
+
+    database.copy_shards = copy_while_writing
+    try:
+        journal.snapshot()
+    finally:
+        close_journal(database, journal)
+
+    assert len(list(tmp_path.glob("snapshot-*.jsonl"))) == 1
+    replayed = Database(shards=4)
+    close_journal(replayed, open_journal(replayed, str(tmp_path)))
+    assert _state(replayed) == _state(database)
+
+
+def _write(database: Database, number: int) -> None:
+    name = f"user{number}"
+    database.save_user(name, User(name, "hash", f"User {number}"))
+    post = Post(f"post{number}", database.find_user(name), "Post", datetime.now())
+    database.save_post(post)
+    database.add_like(post, "user0")
+    database.add_like(post, name)
+    database.remove_like(post, "user0")
+    database.follow(name, "user0")
+    database.follow("user0", name)
+    database.unfollow("user0", f"user{number - 1}")
+
+
+def test_replay_skips_torn_write_and_repeats_records(tmp_path):
+    database = Database()
+    journal = open_journal(database, str(tmp_path), snapshot_interval=3600)
+    for number in range(5):
+        _write(database, number)
+    close_journal(database, journal)
+    (segment,) = tmp_path.glob("journal-*.jsonl")
+    # The process crashed in the middle of the next record
+    with segment.open("a", encoding="utf-8") as file:
+        file.write('{"seq": 1000, "op": "save_us')
+
+    restored = Database()
+    journal = open_journal(restored, str(tmp_path), snapshot_interval=3600)
+    assert _state(restored) == _state(database)
+    _write(restored, 5)
+    close_journal(restored, journal)
+    expected = _state(restored)
+
+    # Records replayed twice, as when a snapshot already includes them
+    records = []
+    for segment in sorted(tmp_path.glob("journal-*.jsonl")):
+        for line in segment.read_text(encoding="utf-8").splitlines():
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                pass
+    last = max(record["seq"] for record in records)
+    with (tmp_path / f"journal-{last + 1:020d}.jsonl").open("w") as file:
+        for record in records:
+            file.write(json.dumps({**record, "seq": record["seq"] + last}) + "\n")
+    replayed = Database()
+    close_journal(replayed, open_journal(replayed, str(tmp_path)))
+    assert _state(replayed) == expected
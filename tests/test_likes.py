@@ -0,0 +1,67 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from app.db import Post, User
+from app.likes import Intent, LikeQueue
+from app.sqlitedb import SqliteDatabase
+
+
+def test_reads_do_not_flush_likes(tmp_path):
+    usernames = [f"user_{i}" for i in range(20)]
+    # The batch is applied by the last intent, which fills it
+    database = SqliteDatabase(
+        str(tmp_path / "likes.db"),
+        like_batch_size=len(usernames) + 1,
+        like_batch_delay=60,
+    )
+    try:
+        for username in usernames:
+            database.save_user(username, User(username, "hash", None))
+        author = database.find_user(usernames[0])
+        post = Post("", author, "Liked post", datetime.now())
+        database.save_post(post)
+        for username in usernames:
+            database.add_like(post, username)
+            # Reads between likes see the queued likes
+            assert database.find_user(username) is not None
+            assert database.is_liked(database.find_post(post.id), username)
+        assert database.stats()["like_batches"] == 0
+
+        database.remove_like(post, usernames[0])
+        asyncio.run(database.sync())
+        stats = database.stats()
+        assert stats["like_batches"] == 1
+        assert stats["likes_applied"] == len(usernames)
+        post = database.find_post(post.id)
+        assert len(post.likes) == len(usernames) - 1
+        assert not database.is_liked(post, usernames[0])
+        assert database.is_liked(post, usernames[1])
+    finally:
+        database.close()
+
+
+def test_likes_are_applied_after_a_failed_batch():
+    applied: list[Intent] = []
+    failures = [RuntimeError("Storage is unavailable")]
+
+    def apply(intents: list[Intent]) -> None:
+        if failures:
+            raise failures.pop()
+        applied.extend(intents)
+
+    likes = LikeQueue(apply, batch_size=100, batch_delay=0.01)
+    try:
+        failed = likes.when_applied(likes.put(True, "post", "alice"))
+        with pytest.raises(RuntimeError):
+            failed.result(timeout=5)
+        assert likes.pending("post", "alice") is None
+        assert len(likes) == 0
+
+        # The background thread goes on with later likes
+        likes.when_applied(likes.put(True, "post", "bob")).result(timeout=5)
+        assert [intent[:3] for intent in applied] == [(True, "post", "bob")]
+        assert likes.pending("post", "bob") is None
+    finally:
+        likes.close()
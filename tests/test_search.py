@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+
+from app.db import Post, User
+from app.logic import decode_search_cursor, encode_search_cursor
+from app.search import SearchIndex
+
+
+def test_search_pages_follow_each_other(client):
+    author = User("searcher", "hash", None)
+    start = datetime.now() - timedelta(hours=1)
+    index = SearchIndex(half_life=24, prefix_terms=8)
+    posts = []
+    for number in range(20):
+        # Every third post matches only by prefix, two posts share every time
+        content = f"kitten {number}" if number % 3 else f"kit {number}"
+        created_at = start + timedelta(minutes=number // 2)
+        posts.append(Post(f"p{number}", author, content, created_at))
+        index.add(posts[-1])
+    index.add(Post("other", author, "puppy", start))
+
+    expected, cursor = index.search("kit", limit=100)
+    assert sorted(expected) == sorted(post.id for post in posts)
+    assert cursor is None
+
+    pages, cursor = [], None
+    for _ in range(len(posts)):
+        page, cursor = index.search("kit", limit=3, after=cursor)
+        pages += page
+        if cursor is None:
+            break
+        # Posts indexed between pages neither show up nor move the others
+        index.add(Post(f"new{len(pages)}", author, "kit kitten", datetime.now()))
+        cursor = decode_search_cursor(encode_search_cursor(cursor))
+    assert pages == expected
+
+    response = client.get("/api/search", params={"q": "kit", "cursor": "broken"})
+    assert response.status_code == 400
@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+
+from app.db import Database, Post, User
+from app.timeline import Timelines
+
+
+def test_posts_of_authors_crossing_fanout_limit_stay_in_timelines():
+    database = Database()
+    for name in ("star", "fan", "other"):
+        database.save_user(name, User(name, "hash", None))
+    timelines = Timelines(database, capacity=10, fanout_limit=1)
+    start = datetime(2024, 1, 1)
+
+    def post(number: int) -> Post:
+        post = Post("", database.find_user("star"), f"#{number}", start)
+        post.created_at += timedelta(minutes=number)
+        database.save_post(post)
+        timelines.on_post(post)
+        return post
+
+    def page() -> list[str]:
+        return [post.content for post in timelines.page("fan", None, 10)[0]]
+
+    database.follow("fan", "star")
+    timelines.on_follows_changed("fan", "star")
+    post(1)
+    assert page() == ["#1"]
+    # The second follower makes the star a celebrity, merged into timelines on read
+    database.follow("other", "star")
+    timelines.on_follows_changed("other", "star")
+    post(2)
+    assert page() == ["#2", "#1"]
+    # Posts which were not pushed remain after the star loses the follower
+    database.unfollow("other", "star")
+    timelines.on_follows_changed("other", "star")
+    post(3)
+    assert page() == ["#3", "#2", "#1"]
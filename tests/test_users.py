@@ -0,0 +1,22 @@
+from app.db import Database, User
+from app.sqlitedb import SqliteDatabase
+
+
+def test_new_user_does_not_replace_existing_one(tmp_path):
+    path = str(tmp_path / "users.db")
+    # Two workers sharing the database register the same username
+    first, second = SqliteDatabase(path), SqliteDatabase(path)
+    try:
+        assert first.add_user("alice", User("Alice", "first", None))
+        assert not second.add_user("alice", User("ALICE", "second", None))
+        assert second.find_user("alice").password_hash == "first"
+        second.save_user("alice", User("Alice", "changed", None))
+        assert first.find_user("alice").password_hash == "changed"
+    finally:
+        first.close()
+        second.close()
+
+    memory = Database()
+    assert memory.add_user("bob", User("Bob", "first", None))
+    assert not memory.add_user("bob", User("BOB", "second", None))
+    assert memory.find_user("bob").password_hash == "first"